@@ -0,0 +1,459 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import sqlite3
+import traceback
+from typing import Iterable, Optional
+
+from site_store import _now_ts, _table_columns, db_conn
+
+# 本地漫画目录：把列表 / 搜索 / 详情接口见过的漫画元数据存进 SQLite，
+# 并建立 FTS5 索引，上游慢或不可用时可以直接在本地搜索。
+LOCAL_SEARCH_PAGE_SIZE = 20
+FACET_LIMIT = 20
+
+# main_tag: 0=site,1=work,2=author,3=tag,4=actor
+_MAIN_TAG_COLUMNS = {1: "works", 2: "author", 3: "tags", 4: "actors"}
+
+_CATALOG_COLUMNS = (
+    "album_id",
+    "title",
+    "author",
+    "tags",
+    "actors",
+    "works",
+    "description",
+    "detail_json",
+    "detail_updated_at",
+    "first_seen_at",
+    "updated_at",
+)
+
+_fts_enabled = False
+_background_tasks: set[asyncio.Future] = set()
+
+
+def _fts_tokenizer(conn: sqlite3.Connection) -> Optional[str]:
+    """trigram handles CJK substrings; fall back to unicode61 on older SQLite."""
+    for tokenizer in ("trigram", "unicode61"):
+        try:
+            conn.execute(f"CREATE VIRTUAL TABLE temp._fts_probe USING fts5(x, tokenize='{tokenizer}')")
+            conn.execute("DROP TABLE temp._fts_probe")
+            return tokenizer
+        except sqlite3.OperationalError:
+            continue
+    return None
+
+
+def _migrate_catalog_ids(conn: sqlite3.Connection) -> bool:
+    """Rebuild old catalogs keyed by album_id so the FTS index has a stable integer id."""
+    # 旧表以 album_id 为主键，FTS 只能挂在隐式 rowid 上，VACUUM 后 rowid 可能变化，索引就对不上了
+    if "id" in _table_columns(conn, "album_catalog"):
+        return False
+    conn.commit()
+    # 关掉外键，删除旧表时不级联删除 album_catalog_tags
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        columns = _table_columns(conn, "album_catalog")
+        if "id" in columns:
+            conn.rollback()
+            return False
+        conn.execute("DROP TRIGGER IF EXISTS album_catalog_ai")
+        conn.execute("DROP TRIGGER IF EXISTS album_catalog_ad")
+        conn.execute("DROP TRIGGER IF EXISTS album_catalog_au")
+        conn.execute("DROP TABLE IF EXISTS album_catalog_fts")
+        conn.execute(
+            """
+            CREATE TABLE album_catalog_new (
+                id INTEGER PRIMARY KEY,
+                album_id TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL DEFAULT '',
+                author TEXT NOT NULL DEFAULT '',
+                tags TEXT NOT NULL DEFAULT '',
+                actors TEXT NOT NULL DEFAULT '',
+                works TEXT NOT NULL DEFAULT '',
+                description TEXT NOT NULL DEFAULT '',
+                detail_json TEXT,
+                detail_updated_at INTEGER,
+                first_seen_at INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+            """
+        )
+        copied = ", ".join(column for column in _CATALOG_COLUMNS if column in columns)
+        conn.execute(f"INSERT INTO album_catalog_new ({copied}) SELECT {copied} FROM album_catalog ORDER BY rowid")
+        if "detail_updated_at" not in columns:
+            # 列表页也会刷新 updated_at，详情单独记录保存时间
+            conn.execute("UPDATE album_catalog_new SET detail_updated_at = updated_at WHERE detail_json IS NOT NULL")
+        conn.execute("DROP TABLE album_catalog")
+        conn.execute("ALTER TABLE album_catalog_new RENAME TO album_catalog")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    print("[backend] album catalog rebuilt with integer ids")
+    return True
+
+
+def init_catalog() -> None:
+    global _fts_enabled
+    with db_conn() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS album_catalog (
+                id INTEGER PRIMARY KEY,
+                album_id TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL DEFAULT '',
+                author TEXT NOT NULL DEFAULT '',
+                tags TEXT NOT NULL DEFAULT '',
+                actors TEXT NOT NULL DEFAULT '',
+                works TEXT NOT NULL DEFAULT '',
+                description TEXT NOT NULL DEFAULT '',
+                detail_json TEXT,
+                detail_updated_at INTEGER,
+                first_seen_at INTEGER NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+            """
+        )
+        migrated = _migrate_catalog_ids(conn)
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS album_catalog_tags (
+                album_id TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                PRIMARY KEY (album_id, tag),
+                FOREIGN KEY (album_id) REFERENCES album_catalog(album_id) ON DELETE CASCADE
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_album_catalog_tags_tag ON album_catalog_tags(tag)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_album_catalog_author ON album_catalog(author)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_album_catalog_updated ON album_catalog(updated_at DESC)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chapter_catalog (
+                photo_id TEXT PRIMARY KEY,
+                album_id TEXT NOT NULL,
+                detail_json TEXT NOT NULL,
+                updated_at INTEGER NOT NULL
+            )
+            """
+        )
+
+        tokenizer = _fts_tokenizer(conn)
+        if tokenizer is None:
+            print("[backend] SQLite has no FTS5, local search falls back to LIKE")
+            _fts_enabled = False
+            return
+
+        conn.execute(
+            f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS album_catalog_fts USING fts5(
+                title, author, tags, actors, works, description,
+                content='album_catalog', content_rowid='id', tokenize='{tokenizer}'
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS album_catalog_ai AFTER INSERT ON album_catalog BEGIN
+                INSERT INTO album_catalog_fts(rowid, title, author, tags, actors, works, description)
+                VALUES (new.id, new.title, new.author, new.tags, new.actors, new.works, new.description);
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS album_catalog_ad AFTER DELETE ON album_catalog BEGIN
+                INSERT INTO album_catalog_fts(album_catalog_fts, rowid, title, author, tags, actors, works, description)
+                VALUES ('delete', old.id, old.title, old.author, old.tags, old.actors, old.works, old.description);
+            END
+            """
+        )
+        conn.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS album_catalog_au AFTER UPDATE ON album_catalog BEGIN
+                INSERT INTO album_catalog_fts(album_catalog_fts, rowid, title, author, tags, actors, works, description)
+                VALUES ('delete', old.id, old.title, old.author, old.tags, old.actors, old.works, old.description);
+                INSERT INTO album_catalog_fts(rowid, title, author, tags, actors, works, description)
+                VALUES (new.id, new.title, new.author, new.tags, new.actors, new.works, new.description);
+            END
+            """
+        )
+        if migrated:
+            conn.execute("INSERT INTO album_catalog_fts(album_catalog_fts) VALUES('rebuild')")
+        _fts_enabled = True
+
+
+def _join(values) -> str:
+    if not values:
+        return ""
+    if isinstance(values, str):
+        return values
+    return "\n".join(str(v) for v in values if v)
+
+
+def _as_list(values) -> list[str]:
+    if not values:
+        return []
+    if isinstance(values, str):
+        return [values]
+    return [str(v) for v in values if v]
+
+
+def _upsert(conn: sqlite3.Connection, item: dict, detail: Optional[dict], now: int) -> None:
+    album_id = str(item["id"])
+    tags = _as_list(item.get("tags"))
+    conn.execute(
+        """
+        INSERT INTO album_catalog (
+            album_id, title, author, tags, actors, works, description, detail_json, detail_updated_at,
+            first_seen_at, updated_at
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(album_id) DO UPDATE SET
+            title = CASE WHEN excluded.title <> '' THEN excluded.title ELSE album_catalog.title END,
+            author = CASE WHEN excluded.author <> '' THEN excluded.author ELSE album_catalog.author END,
+            tags = CASE WHEN excluded.tags <> '' THEN excluded.tags ELSE album_catalog.tags END,
+            actors = CASE WHEN excluded.actors <> '' THEN excluded.actors ELSE album_catalog.actors END,
+            works = CASE WHEN excluded.works <> '' THEN excluded.works ELSE album_catalog.works END,
+            description = CASE WHEN excluded.description <> '' THEN excluded.description ELSE album_catalog.description END,
+            detail_json = COALESCE(excluded.detail_json, album_catalog.detail_json),
+            detail_updated_at = COALESCE(excluded.detail_updated_at, album_catalog.detail_updated_at),
+            updated_at = excluded.updated_at
+        """,
+        (
+            album_id,
+            item.get("title") or "",
+            _join(item.get("author")),
+            _join(tags),
+            _join(item.get("actors")),
+            _join(item.get("works")),
+            item.get("description") or "",
+            json.dumps(detail, ensure_ascii=False) if detail is not None else None,
+            now if detail is not None else None,
+            now,
+            now,
+        ),
+    )
+    if tags:
+        conn.execute("DELETE FROM album_catalog_tags WHERE album_id = ?", (album_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO album_catalog_tags (album_id, tag) VALUES (?, ?)",
+            [(album_id, tag) for tag in tags],
+        )
+
+
+def upsert_briefs(items: Iterable[dict]) -> None:
+    """Record album_brief dicts from list / search / ranking pages."""
+    items = [item for item in items if item.get("id")]
+    if not items:
+        return
+    now = _now_ts()
+    with db_conn() as conn:
+        for item in items:
+            _upsert(conn, item, None, now)
+
+
+def upsert_detail(detail: dict) -> None:
+    """Record an album_detail_to_dict result, keeping the full payload."""
+    with db_conn() as conn:
+        _upsert(conn, detail, detail, _now_ts())
+
+
+def get_detail(album_id: str) -> Optional[dict]:
+    with db_conn() as conn:
+        row = conn.execute(
+            "SELECT detail_json FROM album_catalog WHERE album_id = ?",
+            (album_id,),
+        ).fetchone()
+    if not row or not row["detail_json"]:
+        return None
+    return json.loads(row["detail_json"])
+
+
+def get_fresh_details(album_ids: list[str], max_age: float) -> dict[str, dict]:
+    """Stored details saved within max_age seconds, keyed by album id."""
+    if max_age <= 0 or not album_ids:
+        return {}
+    with db_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT album_id, detail_json FROM album_catalog
+            WHERE album_id IN (SELECT value FROM json_each(?))
+              AND detail_json IS NOT NULL AND detail_updated_at >= ?
+            """,
+            (json.dumps(album_ids), _now_ts() - max_age),
+        ).fetchall()
+    return {row["album_id"]: json.loads(row["detail_json"]) for row in rows}
+
+
+def upsert_chapter(detail: dict) -> None:
+    """Record a photo_detail_to_dict result for offline reading."""
+    with db_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO chapter_catalog (photo_id, album_id, detail_json, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(photo_id) DO UPDATE SET
+                album_id = excluded.album_id,
+                detail_json = excluded.detail_json,
+                updated_at = excluded.updated_at
+            """,
+            (
+                str(detail["id"]),
+                str(detail.get("album_id") or ""),
+                json.dumps(detail, ensure_ascii=False),
+                _now_ts(),
+            ),
+        )
+
+
+def get_chapter(photo_id: str) -> Optional[dict]:
+    with db_conn() as conn:
+        row = conn.execute(
+            "SELECT detail_json FROM chapter_catalog WHERE photo_id = ?",
+            (photo_id,),
+        ).fetchone()
+    if not row:
+        return None
+    return json.loads(row["detail_json"])
+
+
+def record_in_background(func, *args) -> None:
+    """Fire-and-forget catalog write so the response does not wait for SQLite."""
+
+    async def run():
+        try:
+            await asyncio.to_thread(func, *args)
+        except Exception:
+            traceback.print_exc()
+
+    task = asyncio.ensure_future(run())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _fts_query(q: str, main_tag: int) -> Optional[str]:
+    terms = [term for term in q.split() if term]
+    # trigram 至少需要 3 个字符
+    if not terms or any(len(term) < 3 for term in terms):
+        return None
+    column = _MAIN_TAG_COLUMNS.get(main_tag)
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    if column:
+        return " ".join(f"{column}:{term}" for term in quoted)
+    return " ".join(quoted)
+
+
+def _serialize_brief(row) -> dict:
+    tags = [tag for tag in (row["tags"] or "").split("\n") if tag]
+    return {
+        "id": row["album_id"],
+        "title": row["title"],
+        "tags": tags,
+        "author": row["author"],
+        "cover": f"/api/comics/{row['album_id']}/cover",
+    }
+
+
+def search_local(
+    q: str,
+    page: int = 1,
+    main_tag: int = 0,
+    tag: str = "",
+    author: str = "",
+    page_size: int = LOCAL_SEARCH_PAGE_SIZE,
+) -> dict:
+    """Search the local catalog; returns the /api/search shape plus tag / author facets."""
+    where = []
+    params: list = []
+    order_by = "album_catalog.updated_at DESC"
+    from_clause = "album_catalog"
+
+    fts_query = _fts_query(q, main_tag) if _fts_enabled else None
+    if fts_query:
+        from_clause = "album_catalog_fts JOIN album_catalog ON album_catalog.id = album_catalog_fts.rowid"
+        where.append("album_catalog_fts MATCH ?")
+        params.append(fts_query)
+        order_by = "bm25(album_catalog_fts), album_catalog.updated_at DESC"
+    else:
+        column = _MAIN_TAG_COLUMNS.get(main_tag)
+        columns = [column] if column else ["title", "author", "tags", "actors", "works", "description"]
+        for term in q.split():
+            like = f"%{term}%"
+            where.append("(" + " OR ".join(f"album_catalog.{c} LIKE ?" for c in columns) + ")")
+            params.extend([like] * len(columns))
+
+    if tag:
+        where.append(
+            "album_catalog.album_id IN (SELECT album_id FROM album_catalog_tags WHERE tag = ?)"
+        )
+        params.append(tag)
+    if author:
+        where.append("album_catalog.author = ?")
+        params.append(author)
+
+    where_clause = " AND ".join(where) or "1 = 1"
+    offset = (page - 1) * page_size
+    with db_conn() as conn:
+        total = conn.execute(
+            f"SELECT COUNT(*) AS total FROM {from_clause} WHERE {where_clause}",
+            params,
+        ).fetchone()["total"]
+        rows = conn.execute(
+            f"""
+            SELECT album_catalog.*
+            FROM {from_clause}
+            WHERE {where_clause}
+            ORDER BY {order_by}
+            LIMIT ? OFFSET ?
+            """,
+            [*params, page_size, offset],
+        ).fetchall()
+        matched = f"SELECT album_catalog.album_id FROM {from_clause} WHERE {where_clause}"
+        tag_rows = conn.execute(
+            f"""
+            SELECT tag, COUNT(*) AS total
+            FROM album_catalog_tags
+            WHERE album_id IN ({matched})
+            GROUP BY tag
+            ORDER BY total DESC, tag ASC
+            LIMIT ?
+            """,
+            [*params, FACET_LIMIT],
+        ).fetchall()
+        author_rows = conn.execute(
+            f"""
+            SELECT author, COUNT(*) AS total
+            FROM album_catalog
+            WHERE author <> '' AND album_id IN ({matched})
+            GROUP BY author
+            ORDER BY total DESC, author ASC
+            LIMIT ?
+            """,
+            [*params, FACET_LIMIT],
+        ).fetchall()
+
+    return {
+        "items": [_serialize_brief(row) for row in rows],
+        "total": total,
+        "page_count": math.ceil(total / page_size) if total else 0,
+        "source": "local",
+        "facets": {
+            "tags": [{"name": row["tag"], "count": row["total"]} for row in tag_rows],
+            "authors": [{"name": row["author"], "count": row["total"]} for row in author_rows],
+        },
+    }
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# 每个上游域名一个熔断器：连续失败达到阈值后打开，冷却期内直接快速失败，
+# 冷却结束后放行一个试探请求（half-open），成功则恢复，失败则重新打开。
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+RETRY_BUDGET_RATIO = float(os.getenv("UPSTREAM_RETRY_BUDGET", "0.2"))
+RETRY_BUDGET_MIN_TOKENS = float(os.getenv("UPSTREAM_RETRY_BUDGET_MIN", "10"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a domain whose breaker is open."""
+
+
+class RetryBudgetExhausted(Exception):
+    """Raised when a retry would exceed the global retry budget."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        key: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        cooldown: float = BREAKER_COOLDOWN_SECONDS,
+        on_change=None,
+    ):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_change = time.time()
+        self._trial_in_flight = False
+        self._on_change = on_change
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        previous = self.state
+        self.state = state
+        self.last_change = time.time()
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if self._on_change and previous != state:
+            self._on_change(self.key, previous, state)
+
+    def is_open(self) -> bool:
+        """True while the breaker rejects calls (does not consume a half-open trial)."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at < self.cooldown
+            return self.state == HALF_OPEN and self._trial_in_flight
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self._transition(HALF_OPEN)
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def release(self) -> None:
+        """Give back a half-open trial whose call was abandoned without an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self._transition(OPEN)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "key": self.key,
+                "state": self.state,
+                "failures": self.failures,
+                "last_change": int(self.last_change),
+            }
+
+
+class BreakerRegistry:
+    """Lazily created breakers keyed by upstream host, with a log of state changes."""
+
+    def __init__(self, history: int = 100):
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._events: deque[dict] = deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def _on_change(self, key: str, previous: str, state: str) -> None:
+        self._events.append({"key": key, "from": previous, "to": state, "at": int(time.time())})
+        print(f"[backend] circuit {key}: {previous} -> {state}")
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker(key, on_change=self._on_change))
+        return breaker
+
+    def is_open(self, key: str) -> bool:
+        breaker = self._breakers.get(key)
+        return breaker is not None and breaker.is_open()
+
+    def snapshot(self) -> dict:
+        return {
+            "breakers": [b.snapshot() for _, b in sorted(self._breakers.items())],
+            "events": list(self._events),
+        }
+
+
+class RetryBudget:
+    """Token bucket: every first attempt deposits ``ratio`` tokens, every retry spends one."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_tokens: float = RETRY_BUDGET_MIN_TOKENS):
+        self.ratio = ratio
+        self.max_tokens = max(min_tokens, 1.0) * 10
+        self.tokens = max(min_tokens, 1.0)
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                self.rejected += 1
+                return False
+            self.tokens -= 1
+            self.retries += 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "ratio": self.ratio,
+                "tokens": round(self.tokens, 2),
+                "requests": self.requests,
+                "retries": self.retries,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import math
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from fastapi import Response
+
+import upstream
+
+# 封面缓存：封面原图落盘，列表页可以一次请求拿到整页的缩略图，
+# 拼成一张雪碧图（坐标表放在响应头里）或者以 multipart 返回，结果按 id 列表和尺寸记忆化。
+# 磁盘上的封面按文件数和总大小设上限，超出后按 mtime 淘汰最久没用过的（读取时会刷新 mtime）。
+COVER_BUNDLE_MAX = int(os.getenv("COVER_BUNDLE_MAX", "100"))
+COVER_FETCH_CONCURRENCY = int(os.getenv("COVER_FETCH_CONCURRENCY", "8"))
+COVER_BUNDLE_CACHE_ENTRIES = int(os.getenv("COVER_BUNDLE_CACHE_ENTRIES", "200"))
+COVER_SPRITE_COLUMNS = int(os.getenv("COVER_SPRITE_COLUMNS", "10"))
+COVER_THUMB_QUALITY = int(os.getenv("COVER_THUMB_QUALITY", "85"))
+COVER_CACHE_MAX_FILES = int(os.getenv("COVER_CACHE_MAX_FILES", "50000"))
+COVER_CACHE_MAX_BYTES = int(os.getenv("COVER_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# 淘汰时一次清到上限的这个比例，免得每写一张就扫一遍目录
+EVICT_TARGET_RATIO = 0.9
+# 命中时最多这么久刷新一次 mtime
+TOUCH_INTERVAL = 60 * 60
+
+BUNDLE_LAYOUTS = ("sprite", "multipart")
+_ALBUM_ID_RE = re.compile(r"^[0-9A-Za-z_-]+$")
+
+
+def _thumbnail(content: bytes, width: int, height: int):
+    from PIL import Image, ImageOps
+
+    img = Image.open(io.BytesIO(content))
+    return ImageOps.fit(img.convert("RGB"), (width, height), Image.LANCZOS)
+
+
+def build_sprite(album_ids: list[str], covers: dict[str, bytes], width: int, height: int) -> tuple[bytes, dict]:
+    """One JPEG grid of thumbnails and {album_id: [x, y, w, h]} for the tiles that exist."""
+    from PIL import Image
+
+    present = [album_id for album_id in album_ids if album_id in covers]
+    columns = max(1, min(COVER_SPRITE_COLUMNS, len(present)))
+    rows = max(1, math.ceil(len(present) / columns))
+    sheet = Image.new("RGB", (columns * width, rows * height), (255, 255, 255))
+    coords = {}
+    for i, album_id in enumerate(present):
+        x, y = (i % columns) * width, (i // columns) * height
+        try:
+            sheet.paste(_thumbnail(covers[album_id], width, height), (x, y))
+        except Exception:
+            traceback.print_exc()
+            continue
+        coords[album_id] = [x, y, width, height]
+    buf = io.BytesIO()
+    sheet.save(buf, format="JPEG", quality=COVER_THUMB_QUALITY)
+    return buf.getvalue(), coords
+
+
+def build_multipart(album_ids: list[str], covers: dict[str, bytes], width: int, height: int) -> tuple[bytes, str]:
+    """multipart/mixed body with one pre-sized JPEG part per album."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for album_id in album_ids:
+        if album_id not in covers:
+            continue
+        try:
+            thumb = _thumbnail(covers[album_id], width, height)
+        except Exception:
+            traceback.print_exc()
+            continue
+        buf = io.BytesIO()
+        thumb.save(buf, format="JPEG", quality=COVER_THUMB_QUALITY)
+        parts.append(
+            f"--{boundary}\r\n"
+            f"Content-Type: image/jpeg\r\n"
+            f"Content-ID: <{album_id}>\r\n"
+            f"X-Album-Id: {album_id}\r\n\r\n".encode("ascii")
+            + buf.getvalue()
+            + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(parts), f"multipart/mixed; boundary={boundary}"
+
+
+class CoverCache:
+    """Album covers on disk, plus memoized sprite / multipart bundles of thumbnails."""
+
+    def __init__(self, fetch: Callable[[str], Awaitable[bytes]], cover_dir: Path):
+        self._fetch = fetch
+        self.cover_dir = cover_dir
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._bundles: OrderedDict[tuple, dict] = OrderedDict()
+        self._usage_lock = threading.Lock()
+        # (文件数, 总字节)，首次写入时扫描目录得到；其他 worker 的写入要到下次淘汰扫描时才算进来
+        self._usage: Optional[list[int]] = None
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self.bundle_hits = 0
+        self.bundle_misses = 0
+
+    # ---- Covers ----
+
+    def _path(self, album_id: str) -> Path:
+        if not _ALBUM_ID_RE.match(album_id):
+            raise ValueError(f"Invalid album id: {album_id}")
+        return self.cover_dir / f"{album_id}.jpg"
+
+    def _read(self, album_id: str) -> Optional[bytes]:
+        path = self._path(album_id)
+        try:
+            content = path.read_bytes()
+            if time.time() - path.stat().st_mtime > TOUCH_INTERVAL:
+                os.utime(path)
+        except FileNotFoundError:
+            return None
+        return content
+
+    def _write(self, album_id: str, content: bytes) -> None:
+        self.cover_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(album_id)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            replaced = path.stat().st_size
+        except FileNotFoundError:
+            replaced = None
+        tmp_path.write_bytes(content)
+        tmp_path.replace(path)
+        with self._usage_lock:
+            usage = self._usage
+            if usage is None:
+                usage = self._usage = list(self._scan_usage())
+            elif replaced is None:
+                usage[0] += 1
+                usage[1] += len(content)
+            else:
+                usage[1] += len(content) - replaced
+            if self._over_limit(usage[0], usage[1], 1.0):
+                self._evict()
+
+    # ---- Eviction ----
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        if not self.cover_dir.exists():
+            return entries
+        for path in self.cover_dir.glob("*.jpg"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_usage(self) -> tuple[int, int]:
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    @staticmethod
+    def _over_limit(files: int, size: int, ratio: float) -> bool:
+        return (COVER_CACHE_MAX_FILES > 0 and files > COVER_CACHE_MAX_FILES * ratio) or (
+            COVER_CACHE_MAX_BYTES > 0 and size > COVER_CACHE_MAX_BYTES * ratio
+        )
+
+    def _evict(self) -> None:
+        """Delete least recently used covers until usage is below the target; caller holds _usage_lock."""
+        entries = self._entries()
+        entries.sort(key=lambda entry: entry[0])
+        files, size = len(entries), sum(entry[1] for entry in entries)
+        removed = 0
+        for _, entry_size, path in entries:
+            if not self._over_limit(files, size, EVICT_TARGET_RATIO):
+                break
+            path.unlink(missing_ok=True)
+            files -= 1
+            size -= entry_size
+            removed += 1
+        self._usage = [files, size]
+        self.evictions += removed
+        if removed:
+            print(f"[backend] cover cache evicted {removed} files")
+
+    async def _fill(self, album_id: str) -> bytes:
+        content = await self._fetch(album_id)
+        try:
+            await upstream.run_sync(self._write, album_id, content)
+        except Exception:
+            traceback.print_exc()
+        return content
+
+    async def get(self, album_id: str) -> bytes:
+        content = await upstream.run_sync(self._read, album_id)
+        if content is not None:
+            self.hits += 1
+            return content
+        self.misses += 1
+        future = self._inflight.get(album_id)
+        if future is None:
+            future = asyncio.ensure_future(self._fill(album_id))
+            self._inflight[album_id] = future
+            future.add_done_callback(lambda f: self._done(album_id, f))
+        return await asyncio.shield(future)
+
+    def _done(self, album_id: str, future: asyncio.Future) -> None:
+        self._inflight.pop(album_id, None)
+        if not future.cancelled():
+            future.exception()
+
+    # ---- Bundles ----
+
+    async def bundle(self, album_ids: list[str], width: int, height: int, layout: str) -> Response:
+        key = (tuple(album_ids), width, height, layout)
+        entry = self._bundles.get(key)
+        if entry is not None:
+            self._bundles.move_to_end(key)
+            self.bundle_hits += 1
+            return self._response(entry, "HIT")
+        self.bundle_misses += 1
+
+        semaphore = asyncio.Semaphore(COVER_FETCH_CONCURRENCY)
+
+        async def load(album_id: str) -> Optional[bytes]:
+            async with semaphore:
+                try:
+                    return await self.get(album_id)
+                except Exception as e:
+                    print(f"[backend] cover {album_id} failed: {e}")
+                    return None
+
+        results = await asyncio.gather(*(load(album_id) for album_id in album_ids))
+        covers = {album_id: content for album_id, content in zip(album_ids, results) if content is not None}
+
+        headers = {}
+        if layout == "sprite":
+            body, coords = await upstream.run_sync(build_sprite, album_ids, covers, width, height)
+            media_type = "image/jpeg"
+            headers["X-Sprite-Map"] = json.dumps(coords, separators=(",", ":"))
+            missing = [album_id for album_id in album_ids if album_id not in coords]
+        else:
+            body, media_type = await upstream.run_sync(build_multipart, album_ids, covers, width, height)
+            missing = [album_id for album_id in album_ids if album_id not in covers]
+        if missing:
+            headers["X-Covers-Missing"] = ",".join(missing)
+
+        entry = {"body": body, "media_type": media_type, "headers": headers}
+        # 有缺失的结果不记忆，下次请求再补
+        if not missing:
+            self._bundles[key] = entry
+            while len(self._bundles) > COVER_BUNDLE_CACHE_ENTRIES:
+                self._bundles.popitem(last=False)
+        return self._response(entry, "MISS")
+
+    @staticmethod
+    def _response(entry: dict, status: str) -> Response:
+        return Response(
+            content=entry["body"],
+            media_type=entry["media_type"],
+            headers={**entry["headers"], "X-Cache": status},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "files": self._usage[0] if self._usage is not None else None,
+            "bytes": self._usage[1] if self._usage is not None else None,
+            "max_files": COVER_CACHE_MAX_FILES,
+            "max_bytes": COVER_CACHE_MAX_BYTES,
+            "evictions": self.evictions,
+            "bundles": len(self._bundles),
+            "bundle_hits": self.bundle_hits,
+            "bundle_misses": self.bundle_misses,
+        }
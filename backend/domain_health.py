@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import random
+import time
+import traceback
+from typing import Awaitable, Callable, Optional
+
+# 后台域名探测：定期 ping 所有 API 域名，维护延迟和错误率的 EWMA，
+# 主域名劣化时自动把最健康的域名换到第一位。
+DOMAIN_PROBE_INTERVAL = float(os.getenv("DOMAIN_PROBE_INTERVAL", "30"))
+DOMAIN_PROBE_TIMEOUT = float(os.getenv("DOMAIN_PROBE_TIMEOUT", "8"))
+DOMAIN_EWMA_ALPHA = float(os.getenv("DOMAIN_EWMA_ALPHA", "0.3"))
+DOMAIN_ERROR_THRESHOLD = float(os.getenv("DOMAIN_ERROR_THRESHOLD", "0.5"))
+DOMAIN_LATENCY_FACTOR = float(os.getenv("DOMAIN_LATENCY_FACTOR", "3"))
+DOMAIN_WEIGHTED_ROTATION = os.getenv("DOMAIN_WEIGHTED_ROTATION", "1") != "0"
+
+
+class DomainHealthMonitor:
+    """EWMA scoreboard for upstream domains plus a background prober."""
+
+    def __init__(
+        self,
+        ping: Callable[[str, float], Awaitable[dict]],
+        get_client: Callable,
+        alpha: float = DOMAIN_EWMA_ALPHA,
+    ):
+        self._ping = ping
+        self._get_client = get_client
+        self.alpha = alpha
+        self._scores: dict[str, dict] = {}
+        self._pinned: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self.last_failover: Optional[dict] = None
+
+    # ---- Scoreboard ----
+
+    def record(self, domain: str, latency_ms: Optional[float], error: str = "") -> None:
+        """Fold one observation into the EWMA; latency None means the call failed."""
+        item = self._scores.setdefault(domain, {
+            "latency_ewma": None,
+            "error_ewma": 0.0,
+            "samples": 0,
+            "last_checked": None,
+            "last_error": "",
+        })
+        failed = latency_ms is None or latency_ms < 0
+        item["error_ewma"] = self._ewma(item["error_ewma"], 1.0 if failed else 0.0, item["samples"])
+        if not failed:
+            item["latency_ewma"] = self._ewma(item["latency_ewma"], float(latency_ms), item["samples"])
+        item["samples"] += 1
+        item["last_checked"] = int(time.time())
+        item["last_error"] = error if failed else ""
+
+    def _ewma(self, current: Optional[float], sample: float, samples: int) -> float:
+        if current is None or samples == 0:
+            return sample
+        return self.alpha * sample + (1 - self.alpha) * current
+
+    def is_healthy(self, domain: str) -> bool:
+        item = self._scores.get(domain)
+        if not item or not item["samples"]:
+            return True
+        return item["error_ewma"] < DOMAIN_ERROR_THRESHOLD and item["latency_ewma"] is not None
+
+    def _score(self, domain: str) -> float:
+        """Lower is better: latency inflated by the error rate."""
+        item = self._scores.get(domain)
+        if not item or item["latency_ewma"] is None:
+            return math.inf
+        return item["latency_ewma"] / max(1.0 - item["error_ewma"], 0.05)
+
+    def _weights(self, domains: list[str]) -> dict[str, float]:
+        healthy = [d for d in domains if self.is_healthy(d) and self._score(d) != math.inf]
+        raw = {d: 1.0 / max(self._score(d), 1.0) for d in healthy}
+        total = sum(raw.values())
+        return {d: (w / total if total else 0.0) for d, w in raw.items()}
+
+    def scoreboard(self) -> list[dict]:
+        cl = self._get_client()
+        current = list(cl.get_domain_list())
+        known = current + [d for d in self._scores if d not in current]
+        weights = self._weights(current)
+        board = []
+        for domain in known:
+            item = self._scores.get(domain, {})
+            latency = item.get("latency_ewma")
+            board.append({
+                "domain": domain,
+                "latency_ewma": round(latency) if latency is not None else None,
+                "error_rate": round(item.get("error_ewma", 0.0), 3),
+                "samples": item.get("samples", 0),
+                "healthy": self.is_healthy(domain),
+                "weight": round(weights.get(domain, 0.0), 3),
+                "last_checked": item.get("last_checked"),
+                "last_error": item.get("last_error", ""),
+                "primary": bool(current) and domain == current[0],
+            })
+        return board
+
+    # ---- Failover ----
+
+    def pin(self, domain: Optional[str]) -> None:
+        """Keep a manually chosen primary until it degrades."""
+        self._pinned = domain
+
+    def _primary_degraded(self, primary: str, domains: list[str]) -> bool:
+        if not self.is_healthy(primary):
+            return True
+        healthy_scores = [self._score(d) for d in domains if self.is_healthy(d) and self._score(d) != math.inf]
+        if not healthy_scores or self._score(primary) == math.inf:
+            return False
+        return self._score(primary) > DOMAIN_LATENCY_FACTOR * min(healthy_scores)
+
+    def _ordered(self, domains: list[str], weighted: bool) -> list[str]:
+        weights = self._weights(domains)
+        healthy = sorted(weights, key=self._score)
+        if weighted and len(healthy) > 1:
+            # 按权重抽取主域名，让流量在健康域名之间分摊
+            first = random.choices(healthy, weights=[weights[d] for d in healthy], k=1)[0]
+            healthy = [first] + [d for d in healthy if d != first]
+        unknown = [d for d in domains if d not in weights and self.is_healthy(d)]
+        unhealthy = sorted(
+            (d for d in domains if not self.is_healthy(d)),
+            key=lambda d: self._scores[d]["error_ewma"],
+        )
+        return healthy + unknown + unhealthy
+
+    def rebalance(self) -> list[str]:
+        cl = self._get_client()
+        current = list(cl.get_domain_list())
+        if len(current) < 2:
+            return current
+
+        primary = current[0]
+        degraded = self._primary_degraded(primary, current)
+        if degraded:
+            self._pinned = None
+        elif self._pinned == primary or not DOMAIN_WEIGHTED_ROTATION:
+            return current
+
+        new_list = self._ordered(current, weighted=not degraded)
+        if new_list != current:
+            cl.set_domain_list(new_list)
+            if degraded and new_list[0] != primary:
+                self.last_failover = {"from": primary, "to": new_list[0], "at": int(time.time())}
+                print(f"[backend] domain failover: {primary} -> {new_list[0]}")
+        return new_list
+
+    # ---- Background prober ----
+
+    async def probe_once(self) -> None:
+        cl = self._get_client()
+        domains = list(cl.get_domain_list())
+        results = await asyncio.gather(*(self._ping(d, DOMAIN_PROBE_TIMEOUT) for d in domains))
+        for result in results:
+            self.record(result["domain"], result["latency"], result.get("error", ""))
+        self.rebalance()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(DOMAIN_PROBE_INTERVAL)
+
+    def start(self) -> None:
+        if DOMAIN_PROBE_INTERVAL <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
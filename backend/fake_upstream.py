@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import random
+import time
+from typing import Optional
+
+from jmcomic import JmImageResp
+
+# 假上游：设置 JM_FAKE_UPSTREAM 后 get_client() 返回这里的客户端，不访问网络，
+# 用确定性的假数据代替禁漫接口，用来测试熔断、域名切换和离线降级。
+# ok：正常返回；down：所有请求失败；flaky：按 JM_FAKE_UPSTREAM_FAIL_RATE 随机失败
+FAKE_UPSTREAM = os.getenv("JM_FAKE_UPSTREAM", "").lower()
+FAKE_UPSTREAM_FAIL_RATE = float(os.getenv("JM_FAKE_UPSTREAM_FAIL_RATE", "0.5"))
+FAKE_UPSTREAM_LATENCY = float(os.getenv("JM_FAKE_UPSTREAM_LATENCY", "0"))
+
+FAKE_API_DOMAINS = ["fake-api-1.invalid", "fake-api-2.invalid"]
+FAKE_IMAGE_DOMAIN = "fake-cdn.invalid"
+FAKE_PAGE_SIZE = 20
+FAKE_TOTAL = 200
+
+
+def _seed(value: str) -> int:
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class FakeResponse:
+    def __init__(self, url: str, content: bytes = b"{}", status_code: int = 200):
+        self.url = url
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+
+class FakePostman:
+    """Stands in for the jmcomic postman; its mode can be flipped at runtime."""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.requests = 0
+
+    def _fail(self) -> bool:
+        if self.mode == "down":
+            return True
+        if self.mode == "flaky":
+            return random.random() < FAKE_UPSTREAM_FAIL_RATE
+        return False
+
+    def get(self, url, **kwargs):
+        self.requests += 1
+        if FAKE_UPSTREAM_LATENCY > 0:
+            time.sleep(FAKE_UPSTREAM_LATENCY)
+        if self._fail():
+            raise ConnectionError(f"fake upstream unreachable: {url}")
+        # 章节图片和封面都在 /media/ 下
+        if FAKE_IMAGE_DOMAIN in url or "/media/" in url:
+            return FakeResponse(url, _fake_png(url))
+        return FakeResponse(url)
+
+    def post(self, url, **kwargs):
+        return self.get(url, **kwargs)
+
+    def get_meta_data(self, key=None, dv=None):
+        return {} if key is None else dv
+
+    def copy(self):
+        return FakePostman(self.mode)
+
+    def get_root_postman(self):
+        return self
+
+
+def _fake_png(url: str) -> bytes:
+    from PIL import Image
+
+    seed = _seed(url)
+    color = (seed & 0xFF, (seed >> 8) & 0xFF, (seed >> 16) & 0xFF)
+    buf = io.BytesIO()
+    Image.new("RGB", (200, 280), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class FakeImageDetail:
+    def __init__(self, photo_id: str, index: int):
+        self.filename = f"{index + 1:05d}.png"
+        self.download_url = f"https://{FAKE_IMAGE_DOMAIN}/media/photos/{photo_id}/{self.filename}"
+        self.scramble_id = None
+        self.img_file_suffix = ".png"
+
+
+class FakePhoto:
+    def __init__(self, photo_id: str, album_id: str, album_index: int):
+        self.photo_id = photo_id
+        self.album_id = album_id
+        self.album_index = album_index
+        self.name = f"Fake chapter {album_index}"
+        self.scramble_id = None
+        self.tags = ["fake"]
+        self._pages = 3 + _seed(photo_id) % 6
+
+    def __len__(self):
+        return self._pages
+
+    def create_image_detail(self, index: int) -> FakeImageDetail:
+        return FakeImageDetail(self.photo_id, index)
+
+
+class FakeAlbum:
+    def __init__(self, album_id: str):
+        seed = _seed(album_id)
+        self.album_id = album_id
+        self.name = f"Fake album {album_id}"
+        self.author = f"author{seed % 7}"
+        self.authors = [self.author]
+        self.description = "Generated by the fake upstream."
+        self.tags = ["fake", f"tag{seed % 5}"]
+        self.actors = []
+        self.works = []
+        self.likes = str(seed % 1000)
+        self.views = str(seed % 100000)
+        self.comment_count = seed % 50
+        self.pub_date = "2024-01-01"
+        self.update_date = "2024-01-01"
+        self.page_count = 0
+        # 第一章与漫画同 id，和单章节漫画的真实情况一致
+        chapters = 1 + seed % 3
+        self.episode_list = [
+            (album_id if i == 0 else f"{album_id}{i:02d}", str(i + 1), f"Fake chapter {i + 1}")
+            for i in range(chapters)
+        ]
+        self.related_list = []
+
+
+class FakePage:
+    def __init__(self, prefix: str, page: int):
+        start = (page - 1) * FAKE_PAGE_SIZE
+        self.content = [
+            (
+                str(100000 + _seed(f"{prefix}:{start + i}") % 900000),
+                {"name": f"Fake {prefix} #{start + i + 1}", "tags": ["fake"], "author": "fake"},
+            )
+            for i in range(max(0, min(FAKE_PAGE_SIZE, FAKE_TOTAL - start)))
+        ]
+        self.total = FAKE_TOTAL
+        self.page_count = (FAKE_TOTAL + FAKE_PAGE_SIZE - 1) // FAKE_PAGE_SIZE
+
+
+class FakeJmClient:
+    """Just enough of the jmcomic client surface used by main.py, without network access."""
+
+    def __init__(self, mode: str = "ok"):
+        self.postman = FakePostman(mode)
+        self._domains = list(FAKE_API_DOMAINS)
+        self._photo_albums: dict[str, tuple[str, int]] = {}
+
+    def set_mode(self, mode: str) -> None:
+        self._root_postman().mode = mode
+
+    def _root_postman(self) -> FakePostman:
+        return self.postman.get_root_postman()
+
+    def _request(self, path: str) -> FakeResponse:
+        """Try every domain in order like the real client's domain retry."""
+        error: Optional[Exception] = None
+        for domain in list(self._domains):
+            try:
+                return self.postman.get(f"https://{domain}{path}")
+            except Exception as e:
+                error = e
+        raise error or ConnectionError("fake upstream has no domains")
+
+    # ---- Domains ----
+
+    def set_cache_dict(self, cache_dict) -> None:
+        pass
+
+    def get_domain_list(self) -> list[str]:
+        return self._domains
+
+    def set_domain_list(self, domains: list[str]) -> None:
+        self._domains = list(domains)
+
+    def get_html_domain(self) -> str:
+        return FAKE_API_DOMAINS[0]
+
+    def get_html_domain_all(self) -> list[str]:
+        return list(FAKE_API_DOMAINS)
+
+    # ---- Metadata ----
+
+    def get_album_detail(self, album_id) -> FakeAlbum:
+        self._request(f"/album/{album_id}")
+        album = FakeAlbum(str(album_id))
+        for pid, sort, _ in album.episode_list:
+            self._photo_albums[pid] = (album.album_id, int(sort))
+        return album
+
+    def get_photo_detail(self, photo_id, fetch_album=True, fetch_scramble_id=True) -> FakePhoto:
+        self._request(f"/photo/{photo_id}")
+        album_id, album_index = self._photo_albums.get(str(photo_id), (str(photo_id), 1))
+        return FakePhoto(str(photo_id), album_id, album_index)
+
+    def search(self, search_query, page=1, main_tag=0, order_by=None, time=None, category=None, sub_category=None):
+        self._request(f"/search/?q={search_query}&page={page}")
+        return FakePage(f"search:{search_query}:{main_tag}", page)
+
+    def categories_filter(self, page=1, time=None, category=None, order_by=None, sub_category=None):
+        self._request(f"/albums?page={page}")
+        return FakePage(f"list:{category}:{order_by}:{time}", page)
+
+    def day_ranking(self, page=1, category=None):
+        self._request(f"/albums?t=t&page={page}")
+        return FakePage(f"day:{category}", page)
+
+    def week_ranking(self, page=1, category=None):
+        self._request(f"/albums?t=w&page={page}")
+        return FakePage(f"week:{category}", page)
+
+    def month_ranking(self, page=1, category=None):
+        self._request(f"/albums?t=m&page={page}")
+        return FakePage(f"month:{category}", page)
+
+    # ---- Images ----
+
+    def get_jm_image(self, img_url) -> JmImageResp:
+        return JmImageResp(self.postman.get(img_url))
+
+    def fetch_image(self, img_url) -> FakeResponse:
+        """Raw CDN response for upstream.get_jm_image, see upstream.set_image_transport."""
+        return self._root_postman().get(img_url)
+
+    @staticmethod
+    def img_is_not_need_to_decode(img_url, resp) -> bool:
+        return True
@@ -6,18 +6,18 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'jmcomic', 'src
 
 import io
 import time
+import asyncio
 import traceback
 from typing import Optional, List
 from contextlib import asynccontextmanager
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import json
 import shutil
 import zipfile
 import math
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query, Response, BackgroundTasks, Depends, Header, File, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Query, Request, Response, BackgroundTasks, Depends, Header, File, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
@@ -27,7 +27,18 @@ from jmcomic import (
     JmcomicText,
     JmImageTool,
 )
+import album_catalog
+import fake_upstream
+import response_cache
 import site_store
+import upstream
+import user_data
+from cover_cache import BUNDLE_LAYOUTS, COVER_BUNDLE_MAX, CoverCache
+from domain_health import DomainHealthMonitor
+from offline import OfflineStore
+from ranking_snapshots import RANKING_TYPES, RankingSnapshots
+from site_backup import SiteBackups
+from response_cache import ResponseCache
 
 # ---------------------------------------------------------------------------
 # Global jmcomic client (created once at startup)
@@ -46,6 +57,19 @@ def get_chapter_cache_dir(album_id: str, photo_id: str) -> Path:
 # 缓存下载状态跟踪 {photo_id: {status, progress, total, error}}
 _cache_status: dict = {}
 _pdf_status: dict = {}
+# 列表 / 搜索 / 排行的响应缓存
+api_cache = ResponseCache()
+# 上游不可用时从本地数据提供详情 / 章节 / 图片
+offline_store = OfflineStore(CACHE_DIR)
+# 站点数据库的定时在线备份
+site_backups = SiteBackups(site_store.DB_PATH, site_store.DB_PATH.parent / "backups" / "auto")
+# 批量详情接口：单次最多多少个 id，同时向上游发起多少个请求
+ALBUM_BATCH_MAX = int(os.getenv("ALBUM_BATCH_MAX", "50"))
+ALBUM_BATCH_CONCURRENCY = int(os.getenv("ALBUM_BATCH_CONCURRENCY", "8"))
+# 本地目录里保存时间不超过这么多秒的详情直接返回，不再请求上游
+ALBUM_BATCH_CACHE_TTL = float(os.getenv("ALBUM_BATCH_CACHE_TTL", "3600"))
+# 列表页一次查询整页漫画的收藏 / 历史 / 进度 / 缓存标记
+ALBUM_STATES_MAX = int(os.getenv("ALBUM_STATES_MAX", "200"))
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
 
 
@@ -66,9 +90,16 @@ def has_cached_images(cache_dir: Path) -> bool:
 def get_client():
     global _client
     if _client is None:
-        option = JmModuleConfig.option_class().default()
-        _client = option.new_jm_client()
+        if fake_upstream.FAKE_UPSTREAM:
+            print(f"[backend] using fake upstream ({fake_upstream.FAKE_UPSTREAM})")
+            _client = fake_upstream.FakeJmClient(fake_upstream.FAKE_UPSTREAM)
+            upstream.set_image_transport(_client.fetch_image)
+        else:
+            option = JmModuleConfig.option_class().default()
+            upstream.configure(option)
+            _client = option.new_jm_client()
         _client.set_cache_dict({})
+        upstream.guard_client(_client)
     return _client
 
 
@@ -77,6 +108,7 @@ async def lifespan(app: FastAPI):
     # Startup: warm up the client
     try:
         site_store.init_site_storage()
+        album_catalog.init_catalog()
         print("[backend] site storage initialized")
     except Exception as e:
         print(f"[backend] site storage init failed: {e}")
@@ -87,9 +119,23 @@ async def lifespan(app: FastAPI):
         print("[backend] jmcomic client initialized")
     except Exception as e:
         print(f"[backend] client init warning: {e}")
+    domain_monitor.start()
+    ranking_snapshots.start()
+    site_store.progress_buffer.start()
+    site_store.session_reaper.start()
+    site_backups.start()
     yield
     # Shutdown
     print("[backend] shutting down")
+    await domain_monitor.stop()
+    await ranking_snapshots.stop()
+    await upstream.aclose()
+    await site_backups.stop()
+    await site_store.session_reaper.stop()
+    await site_store.progress_buffer.stop()
+    site_store.writer.close()
+    site_store.pool.close_all()
+    site_store.read_pool.close_all()
 
 
 app = FastAPI(title="JMComic API", lifespan=lifespan)
@@ -99,6 +145,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache", "X-Sprite-Map", "X-Covers-Missing", "ETag"],
 )
 
 
@@ -163,12 +210,60 @@ def photo_detail_to_dict(photo) -> dict:
     }
 
 
+def unscramble_image(img_src, num: int):
+    """Reassemble a scrambled JM image (replicates JmImageTool.decode_and_save)."""
+    from PIL import Image
+
+    w, h = img_src.size
+    img_decode = Image.new("RGB", (w, h))
+    over = h % num
+    for i in range(num):
+        move = math.floor(h / num)
+        y_src = h - (move * (i + 1)) - over
+        y_dst = move * i
+        if i == 0:
+            move += over
+        else:
+            y_dst += over
+        img_decode.paste(
+            img_src.crop((0, y_src, w, y_src + move)),
+            (0, y_dst, w, y_dst + move),
+        )
+    return img_decode
+
+
+def render_chapter_image(content: bytes, img_url: str, scramble_id: Optional[int], suffix: str) -> tuple[bytes, str]:
+    """Decode a downloaded chapter image, returning (bytes, media_type)."""
+    if scramble_id and not jmcomic.JmcomicClient.img_is_not_need_to_decode(img_url, None):
+        num = JmImageTool.get_num_by_url(scramble_id, img_url)
+        img_src = JmImageTool.open_image(content)
+        img_out = unscramble_image(img_src, num) if num > 0 else img_src
+        buf = io.BytesIO()
+        img_out.save(buf, format="JPEG", quality=92)
+        return buf.getvalue(), "image/jpeg"
+
+    # GIF or no-decode needed
+    suffix = (suffix or "").lower()
+    media = "image/jpeg"
+    if suffix in (".png",):
+        media = "image/png"
+    elif suffix in (".gif",):
+        media = "image/gif"
+    elif suffix in (".webp",):
+        media = "image/webp"
+    return content, media
+
+
 def _download_chapter_background(album_id: str, photo_id: str):
     """后台任务：下载并解码整个章节到磁盘缓存"""
     try:
         cl = get_client()
         photo = cl.get_photo_detail(photo_id, fetch_album=True, fetch_scramble_id=True)
         total = len(photo)
+        try:
+            album_catalog.upsert_chapter(photo_detail_to_dict(photo))
+        except Exception:
+            traceback.print_exc()
         cache_dir = get_chapter_cache_dir(album_id, photo_id)
         cache_dir.mkdir(parents=True, exist_ok=True)
 
@@ -185,26 +280,11 @@ def _download_chapter_background(album_id: str, photo_id: str):
             suffix = normalize_image_suffix(image_detail.img_file_suffix or '')
 
             if scramble_id and not cl.img_is_not_need_to_decode(img_url, resp):
-                from PIL import Image as PILImage
                 num = JmImageTool.get_num_by_url(scramble_id, img_url)
                 img_src = JmImageTool.open_image(resp.content)
                 if num > 0:
                     out_path = cache_dir / f"{i:04d}.jpg"
-                    w, h = img_src.size
-                    img_decode = PILImage.new("RGB", (w, h))
-                    over = h % num
-                    for j in range(num):
-                        move = math.floor(h / num)
-                        y_src = h - (move * (j + 1)) - over
-                        y_dst = move * j
-                        if j == 0:
-                            move += over
-                        else:
-                            y_dst += over
-                        img_decode.paste(
-                            img_src.crop((0, y_src, w, y_src + move)),
-                            (0, y_dst, w, y_dst + move),
-                        )
+                    img_decode = unscramble_image(img_src, num)
                     img_decode.save(str(out_path), format="JPEG", quality=92)
                 else:
                     out_path = cache_dir / f"{i:04d}.{suffix}"
@@ -280,6 +360,13 @@ def page_content_to_dict(page_content) -> dict:
     }
 
 
+def catalog_page(page_content) -> dict:
+    """page_content_to_dict + record the albums into the local catalog."""
+    data = page_content_to_dict(page_content)
+    album_catalog.record_in_background(album_catalog.upsert_briefs, data["items"])
+    return data
+
+
 # ---------------------------------------------------------------------------
 # API Routes
 # ---------------------------------------------------------------------------
@@ -287,49 +374,78 @@ def page_content_to_dict(page_content) -> dict:
 # ---- Browse / Category ----
 
 @app.get("/api/comics")
-def list_comics(
+async def list_comics(
     page: int = Query(1, ge=1),
     order_by: str = Query("mr"),  # mr=latest, mv=views
     time: str = Query("a"),       # a=all, m=month, w=week, t=today
     category: str = Query("0"),   # 0=all
 ):
     """List comics with filters (categories_filter)."""
-    try:
+    async def load():
         cl = get_client()
-        result = cl.categories_filter(
-            page=page,
-            time=time,
-            category=category,
-            order_by=order_by,
+        result = await upstream.run_client(
+            lambda: cl.categories_filter(
+                page=page,
+                time=time,
+                category=category,
+                order_by=order_by,
+            )
         )
-        return page_content_to_dict(result)
+        return catalog_page(result)
+
+    try:
+        key = response_cache.make_key("list", page=page, order_by=order_by, time=time, category=category)
+        return await api_cache.serve("list", key, load)
+    except upstream.UpstreamUnavailable as e:
+        raise HTTPException(503, str(e))
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(500, str(e))
 
 
+async def _load_ranking_page(ranking_type: str, page: int, category: str) -> dict:
+    cl = get_client()
+    if ranking_type == "all":
+        result = await upstream.run_client(cl.categories_filter, page, 'a', category, 'mv')
+    elif ranking_type == "day":
+        result = await upstream.run_client(cl.day_ranking, page, category)
+    elif ranking_type == "week":
+        result = await upstream.run_client(cl.week_ranking, page, category)
+    else:
+        result = await upstream.run_client(cl.month_ranking, page, category)
+    return catalog_page(result)
+
+
+ranking_snapshots = RankingSnapshots(
+    _load_ranking_page,
+    site_store.DB_PATH.parent / "ranking_snapshots",
+)
+
+
 @app.get("/api/ranking/{ranking_type}")
-def ranking(
+async def ranking(
     ranking_type: str,
     page: int = Query(1, ge=1),
     category: str = Query("0"),
 ):
     """Get ranking: all / day / week / month."""
+    if ranking_type not in RANKING_TYPES:
+        raise HTTPException(400, f"Invalid ranking type: {ranking_type}")
+
+    # 预计算范围内的页直接返回快照
+    snapshot = ranking_snapshots.get(ranking_type, category, page)
+    if snapshot is not None:
+        return snapshot
+
     try:
-        cl = get_client()
-        if ranking_type == "all":
-            result = cl.categories_filter(page, 'a', category, 'mv')
-        elif ranking_type == "day":
-            result = cl.day_ranking(page, category)
-        elif ranking_type == "week":
-            result = cl.week_ranking(page, category)
-        elif ranking_type == "month":
-            result = cl.month_ranking(page, category)
-        else:
-            raise HTTPException(400, f"Invalid ranking type: {ranking_type}")
-        return page_content_to_dict(result)
-    except HTTPException:
-        raise
+        key = response_cache.make_key("ranking", ranking_type=ranking_type, page=page, category=category)
+        return await api_cache.serve(
+            "ranking",
+            key,
+            lambda: _load_ranking_page(ranking_type, page, category),
+        )
+    except upstream.UpstreamUnavailable as e:
+        raise HTTPException(503, str(e))
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(500, str(e))
@@ -338,60 +454,205 @@ def ranking(
 # ---- Search ----
 
 @app.get("/api/search")
-def search(
+async def search(
     q: str = Query(..., min_length=1),
     page: int = Query(1, ge=1),
     main_tag: int = Query(0),     # 0=site,1=work,2=author,3=tag,4=actor
     order_by: str = Query("mr"),
     time: str = Query("a"),
     category: str = Query("0"),
+    source: str = Query("remote"),  # remote / local
+    tag: str = Query(""),
+    author: str = Query(""),
 ):
-    """Search comics."""
-    try:
+    """Search comics. source=local searches the catalog of albums seen before."""
+    async def search_catalog():
+        return await upstream.run_sync(album_catalog.search_local, q, page, main_tag, tag, author)
+
+    if source == "local":
+        try:
+            return await search_catalog()
+        except Exception as e:
+            traceback.print_exc()
+            raise HTTPException(500, str(e))
+
+    async def load():
         cl = get_client()
-        result = cl.search(
-            search_query=q,
+        result = await upstream.run_client(
+            lambda: cl.search(
+                search_query=q,
+                page=page,
+                main_tag=main_tag,
+                order_by=order_by,
+                time=time,
+                category=category,
+                sub_category=None,
+            )
+        )
+        return catalog_page(result)
+
+    try:
+        key = response_cache.make_key(
+            "search",
+            q=q,
             page=page,
             main_tag=main_tag,
             order_by=order_by,
             time=time,
             category=category,
-            sub_category=None,
         )
-        return page_content_to_dict(result)
+        return await api_cache.serve("search", key, load)
     except Exception as e:
         traceback.print_exc()
+        # 上游不可用时退回本地目录搜索
+        try:
+            local = await search_catalog()
+        except Exception:
+            traceback.print_exc()
+            local = None
+        if local and local["items"]:
+            return local
+        if isinstance(e, upstream.UpstreamUnavailable):
+            raise HTTPException(503, str(e))
         raise HTTPException(500, str(e))
 
 
 # ---- Comic Detail ----
 
+async def offline_fallback(load, *args) -> Optional[Response]:
+    """Offline copy of a response, or None when offline mode is off or nothing is stored."""
+    if not offline_store.fallback_enabled():
+        return None
+    try:
+        return await upstream.run_sync(load, *args)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+
+async def _load_album_detail(album_id: str) -> dict:
+    cl = get_client()
+    album = await upstream.run_client(cl.get_album_detail, album_id)
+    data = album_detail_to_dict(album)
+    album_catalog.record_in_background(album_catalog.upsert_detail, data)
+    return data
+
+
 @app.get("/api/comics/{album_id}")
-def comic_detail(album_id: str):
+async def comic_detail(album_id: str):
     """Get full album detail."""
+    if offline_store.active():
+        offline = await offline_fallback(offline_store.album_response, album_id)
+        if offline is not None:
+            return offline
     try:
-        cl = get_client()
-        album = cl.get_album_detail(album_id)
-        return album_detail_to_dict(album)
+        return await _load_album_detail(album_id)
+    except upstream.UpstreamUnavailable as e:
+        offline = await offline_fallback(offline_store.album_response, album_id)
+        if offline is not None:
+            return offline
+        raise HTTPException(503, str(e))
     except Exception as e:
         traceback.print_exc()
+        offline = await offline_fallback(offline_store.album_response, album_id)
+        if offline is not None:
+            return offline
         raise HTTPException(500, str(e))
 
 
+class AlbumBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=ALBUM_BATCH_MAX)
+
+
+@app.post("/api/comics/batch")
+async def comic_detail_batch(body: AlbumBatchRequest):
+    """Details for many albums in one request; ids that fail are listed in errors."""
+    album_ids = list(dict.fromkeys(item.strip() for item in body.ids if item.strip()))
+    semaphore = asyncio.Semaphore(ALBUM_BATCH_CONCURRENCY)
+    upstream_down = offline_store.active()
+    try:
+        items = await upstream.run_sync(album_catalog.get_fresh_details, album_ids, ALBUM_BATCH_CACHE_TTL)
+    except Exception:
+        traceback.print_exc()
+        items = {}
+
+    async def resolve(album_id: str):
+        async with semaphore:
+            error = "所有上游域名均处于熔断状态"
+            if not upstream_down:
+                try:
+                    return album_id, await _load_album_detail(album_id), None
+                except Exception as e:
+                    error = str(e) or e.__class__.__name__
+            if offline_store.fallback_enabled():
+                try:
+                    data = await upstream.run_sync(offline_store.album_detail, album_id)
+                except Exception:
+                    traceback.print_exc()
+                    data = None
+                if data is not None:
+                    return album_id, {**data, "stale": True}, None
+            return album_id, None, error
+
+    errors = {}
+    misses = [album_id for album_id in album_ids if album_id not in items]
+    for album_id, data, error in await asyncio.gather(*(resolve(album_id) for album_id in misses)):
+        if data is not None:
+            items[album_id] = data
+        else:
+            errors[album_id] = error
+    return {"items": {album_id: items[album_id] for album_id in album_ids if album_id in items}, "errors": errors}
+
+
+async def _fetch_cover(album_id: str, size: str = "") -> bytes:
+    url = JmcomicText.get_album_cover_url(album_id, size=size)
+    resp = await upstream.get_jm_image(url)
+    resp.require_success()
+    return resp.content
+
+
+cover_cache = CoverCache(_fetch_cover, site_store.DB_PATH.parent / "covers")
+
+
 @app.get("/api/comics/{album_id}/cover")
-def comic_cover(album_id: str, size: str = Query("")):
+async def comic_cover(album_id: str, size: str = Query("")):
     """Proxy album cover image."""
     try:
-        cl = get_client()
         url = JmcomicText.get_album_cover_url(album_id, size=size)
-        resp = cl.get_jm_image(url)
-        resp.require_success()
+        if size:
+            content = await _fetch_cover(album_id, size)
+        else:
+            content = await cover_cache.get(album_id)
         content_type = "image/jpeg"
         if url.endswith(".png"):
             content_type = "image/png"
         elif url.endswith(".webp"):
             content_type = "image/webp"
-        return Response(content=resp.content, media_type=content_type)
+        return Response(content=content, media_type=content_type)
+    except upstream.UpstreamUnavailable as e:
+        raise HTTPException(503, str(e))
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(500, str(e))
+
+
+@app.get("/api/covers/bundle")
+async def cover_bundle(
+    ids: str = Query(..., min_length=1),   # comma-separated album ids
+    width: int = Query(150, ge=32, le=400),
+    height: int = Query(200, ge=32, le=600),
+    layout: str = Query("sprite"),        # sprite / multipart
+):
+    """Thumbnails for a whole listing page in one response."""
+    if layout not in BUNDLE_LAYOUTS:
+        raise HTTPException(400, f"Invalid layout: {layout}")
+    album_ids = list(dict.fromkeys(item.strip() for item in ids.split(",") if item.strip()))
+    if not album_ids:
+        raise HTTPException(400, "ids 不能为空")
+    if len(album_ids) > COVER_BUNDLE_MAX:
+        raise HTTPException(400, f"最多 {COVER_BUNDLE_MAX} 个 id")
+    try:
+        return await cover_cache.bundle(album_ids, width, height, layout)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(500, str(e))
@@ -399,24 +660,44 @@ def comic_cover(album_id: str, size: str = Query("")):
 
 # ---- Chapter / Photo ----
 
+def _fetch_photo(photo_id: str):
+    return get_client().get_photo_detail(photo_id, fetch_album=True, fetch_scramble_id=True)
+
+
 @app.get("/api/chapters/{photo_id}")
-def chapter_detail(photo_id: str):
+async def chapter_detail(photo_id: str):
     """Get chapter detail with image list."""
+    if offline_store.active():
+        offline = await offline_fallback(offline_store.chapter_response, photo_id)
+        if offline is not None:
+            return offline
     try:
-        cl = get_client()
-        photo = cl.get_photo_detail(photo_id, fetch_album=True, fetch_scramble_id=True)
-        return photo_detail_to_dict(photo)
+        photo = await upstream.run_client(_fetch_photo, photo_id)
+        data = photo_detail_to_dict(photo)
+        album_catalog.record_in_background(album_catalog.upsert_chapter, data)
+        return data
+    except upstream.UpstreamUnavailable as e:
+        offline = await offline_fallback(offline_store.chapter_response, photo_id)
+        if offline is not None:
+            return offline
+        raise HTTPException(503, str(e))
     except Exception as e:
         traceback.print_exc()
+        offline = await offline_fallback(offline_store.chapter_response, photo_id)
+        if offline is not None:
+            return offline
         raise HTTPException(500, str(e))
 
 
 @app.get("/api/chapters/{photo_id}/images/{index}")
-def chapter_image(photo_id: str, index: int):
+async def chapter_image(photo_id: str, index: int):
     """Serve a decoded comic image."""
+    if offline_store.active():
+        offline = await offline_fallback(offline_store.page_response, photo_id, index)
+        if offline is not None:
+            return offline
     try:
-        cl = get_client()
-        photo = cl.get_photo_detail(photo_id, fetch_album=True, fetch_scramble_id=True)
+        photo = await upstream.run_client(_fetch_photo, photo_id)
         if index < 0 or index >= len(photo):
             raise HTTPException(404, "Image index out of range")
 
@@ -425,57 +706,30 @@ def chapter_image(photo_id: str, index: int):
         scramble_id = int(image_detail.scramble_id) if image_detail.scramble_id else None
 
         # Download the image
-        resp = cl.get_jm_image(img_url)
+        resp = await upstream.get_jm_image(img_url)
         resp.require_success()
 
-        # Decode if needed
-        if scramble_id and not cl.img_is_not_need_to_decode(img_url, resp):
-            from PIL import Image
-
-            num = JmImageTool.get_num_by_url(scramble_id, img_url)
-            img_src = JmImageTool.open_image(resp.content)
-
-            if num == 0:
-                # No decoding needed
-                buf = io.BytesIO()
-                img_src.save(buf, format="JPEG", quality=92)
-                return Response(content=buf.getvalue(), media_type="image/jpeg")
-
-            # In-memory decode (replicate decode_and_save logic)
-            w, h = img_src.size
-            img_decode = Image.new("RGB", (w, h))
-            over = h % num
-            for i in range(num):
-                move = math.floor(h / num)
-                y_src = h - (move * (i + 1)) - over
-                y_dst = move * i
-                if i == 0:
-                    move += over
-                else:
-                    y_dst += over
-                img_decode.paste(
-                    img_src.crop((0, y_src, w, y_src + move)),
-                    (0, y_dst, w, y_dst + move),
-                )
-
-            buf = io.BytesIO()
-            img_decode.save(buf, format="JPEG", quality=92)
-            return Response(content=buf.getvalue(), media_type="image/jpeg")
-        else:
-            # GIF or no-decode needed
-            suffix = image_detail.img_file_suffix.lower()
-            media = "image/jpeg"
-            if suffix in (".png",):
-                media = "image/png"
-            elif suffix in (".gif",):
-                media = "image/gif"
-            elif suffix in (".webp",):
-                media = "image/webp"
-            return Response(content=resp.content, media_type=media)
+        # Decode if needed (CPU bound, keep it off the event loop)
+        content, media = await upstream.run_sync(
+            render_chapter_image,
+            resp.content,
+            img_url,
+            scramble_id,
+            image_detail.img_file_suffix,
+        )
+        return Response(content=content, media_type=media)
     except HTTPException:
         raise
+    except upstream.UpstreamUnavailable as e:
+        offline = await offline_fallback(offline_store.page_response, photo_id, index)
+        if offline is not None:
+            return offline
+        raise HTTPException(503, str(e))
     except Exception as e:
         traceback.print_exc()
+        offline = await offline_fallback(offline_store.page_response, photo_id, index)
+        if offline is not None:
+            return offline
         raise HTTPException(500, str(e))
 
 
@@ -486,11 +740,29 @@ class LoginRequest(BaseModel):
     password: str
 
 
+def _client_ip(request: Request) -> str:
+    """Client address, trusting X-Real-IP only from the local reverse proxy."""
+    host = request.client.host if request.client else ""
+    if host in ("127.0.0.1", "::1"):
+        return request.headers.get("x-real-ip", host)
+    return host
+
+
 @app.post("/api/auth/login")
-def login(body: LoginRequest):
-    result = site_store.authenticate_user(body.username, body.password)
+async def login(body: LoginRequest, request: Request):
+    client_ip = _client_ip(request)
+    retry_after = site_store.login_throttle.retry_after(client_ip, body.username)
+    if retry_after > 0:
+        raise HTTPException(
+            429,
+            "登录失败次数过多，请稍后再试",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    result = await site_store.authenticate_user_async(body.username, body.password)
     if not result:
+        site_store.login_throttle.record_failure(client_ip, body.username)
         raise HTTPException(401, "登录失败")
+    site_store.login_throttle.record_success(client_ip, body.username)
     return {"ok": True, **result}
 
 
@@ -518,16 +790,31 @@ async def upload_my_avatar(
     if not avatar.content_type or not avatar.content_type.startswith("image/"):
         raise HTTPException(400, "只支持图片文件")
     content = await avatar.read()
-    user = site_store.set_user_avatar(current_user["id"], content)
+    user = await site_store.set_user_avatar(current_user["id"], content)
     return {"ok": True, "user": user}
 
 
 @app.get("/api/users/{user_id}/avatar")
-def get_user_avatar(user_id: int):
-    avatar_path = site_store.get_avatar_path(user_id)
-    if not avatar_path.exists():
+def get_user_avatar(
+    request: Request,
+    user_id: int,
+    v: Optional[int] = Query(None),
+    size: int = Query(256, ge=1, le=1024),
+    format: Optional[str] = Query(None),
+):
+    if format is not None and format not in site_store.AVATAR_FORMATS:
+        raise HTTPException(400, "不支持的头像格式")
+    headers = {}
+    if format is None:
+        format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpg"
+        headers["Vary"] = "Accept"
+    found = site_store.resolve_avatar(user_id, v, size, format)
+    if found is None:
         raise HTTPException(404, "头像不存在")
-    return FileResponse(str(avatar_path), media_type="image/jpeg")
+    path, media_type, immutable = found
+    # 带当前版本号的地址内容不会再变；旧版本号或不带版本号的请求每次回源校验
+    headers["Cache-Control"] = "public, max-age=31536000, immutable" if immutable else "no-cache"
+    return FileResponse(str(path), media_type=media_type, headers=headers)
 
 
 class CreateUserRequest(BaseModel):
@@ -598,6 +885,75 @@ def admin_delete_user(
     return {"ok": True}
 
 
+# ---- User data import / export ----
+
+def _ndjson_download(user_id: Optional[int], name: str) -> StreamingResponse:
+    filename = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.ndjson"
+    return StreamingResponse(
+        user_data.export_ndjson(user_id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/api/admin/data/export")
+def admin_export_data(current_user: dict = Depends(site_store.require_admin_user)):
+    return _ndjson_download(None, "site-data")
+
+
+@app.post("/api/admin/data/import")
+async def admin_import_data(
+    request: Request,
+    on_conflict: str = Query("newer"),
+    current_user: dict = Depends(site_store.require_admin_user),
+):
+    return await user_data.import_ndjson(
+        request.stream(),
+        on_conflict=on_conflict,
+        actor_user_id=current_user["id"],
+    )
+
+
+@app.get("/api/users/me/data/export")
+def export_my_data(current_user: dict = Depends(site_store.require_current_user)):
+    return _ndjson_download(current_user["id"], f"user-{current_user['id']}")
+
+
+@app.post("/api/users/me/data/import")
+async def import_my_data(
+    request: Request,
+    on_conflict: str = Query("newer"),
+    current_user: dict = Depends(site_store.require_current_user),
+):
+    return await user_data.import_ndjson(
+        request.stream(),
+        on_conflict=on_conflict,
+        user_id=current_user["id"],
+        actor_user_id=current_user["id"],
+    )
+
+
+# ---- Site database backups ----
+
+@app.get("/api/admin/backups")
+async def admin_list_backups(current_user: dict = Depends(site_store.require_admin_user)):
+    return {
+        **site_backups.stats(),
+        "items": await asyncio.to_thread(site_backups.list_backups),
+    }
+
+
+@app.post("/api/admin/backups")
+async def admin_create_backup(current_user: dict = Depends(site_store.require_admin_user)):
+    if site_backups.running():
+        raise HTTPException(status_code=409, detail="备份正在进行中")
+    try:
+        backup = await site_backups.run()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"备份失败：{e}")
+    return {"ok": True, "item": backup}
+
+
 @app.post("/api/auth/change-password")
 def auth_change_password(
     body: ChangePasswordRequest,
@@ -619,9 +975,13 @@ def favorites(
     page_size: int = Query(24, ge=1, le=100),
     folder_id: str = Query("0"),
     order_by: str = Query("mr"),
+    cursor: Optional[str] = Query(None),
+    with_total: bool = Query(True),
     current_user: dict = Depends(site_store.require_current_user),
 ):
-    data = site_store.list_favorites(current_user["id"], page, page_size)
+    data = site_store.list_favorites(
+        current_user["id"], page, page_size, cursor=cursor, with_total=with_total
+    )
     data["folders"] = []
     return data
 
@@ -701,9 +1061,13 @@ class ReadingProgressRequest(BaseModel):
 def get_history(
     page: int = Query(1, ge=1),
     page_size: int = Query(24, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    with_total: bool = Query(True),
     current_user: dict = Depends(site_store.require_current_user),
 ):
-    return site_store.list_history(current_user["id"], page, page_size)
+    return site_store.list_history(
+        current_user["id"], page, page_size, cursor=cursor, with_total=with_total
+    )
 
 
 @app.post("/api/history")
@@ -745,6 +1109,19 @@ def get_reading_state(
     return site_store.get_reading_state(current_user["id"], album_id)
 
 
+class AlbumStatesRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=ALBUM_STATES_MAX)
+
+
+@app.post("/api/reading/states")
+def get_album_states(
+    body: AlbumStatesRequest,
+    current_user: dict = Depends(site_store.require_current_user),
+):
+    """Per-album badges for a listing page: favorite, history, chapter progress and cached chapters."""
+    return site_store.get_album_states(current_user["id"], body.ids)
+
+
 @app.post("/api/reading/progress")
 def save_reading_progress(
     body: ReadingProgressRequest,
@@ -765,6 +1142,47 @@ def save_reading_progress(
     return {"ok": True, "item": item}
 
 
+# ---- Sync ----
+
+class SyncProgressItem(BaseModel):
+    album_id: str
+    photo_id: str
+    album_title: str = ""
+    album_author: str = ""
+    cover: str = ""
+    chapter_title: str = ""
+    chapter_sort: Optional[int] = None
+    last_page: int = Field(0, ge=0)
+    total_pages: int = Field(0, ge=0)
+    updated_at: Optional[int] = Field(None, ge=0)
+
+
+class SyncProgressRequest(BaseModel):
+    items: List[SyncProgressItem] = Field(..., min_length=1, max_length=site_store.SYNC_UPLOAD_MAX)
+
+
+@app.get("/api/sync")
+def get_sync_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=site_store.SYNC_PAGE_MAX),
+    current_user: dict = Depends(site_store.require_current_user),
+):
+    """Favorites, history and progress changed after the `since` cursor; pass back `cursor` next time."""
+    return site_store.get_sync_changes(current_user["id"], since, limit)
+
+
+@app.post("/api/sync/progress")
+def upload_sync_progress(
+    body: SyncProgressRequest,
+    current_user: dict = Depends(site_store.require_current_user),
+):
+    result = site_store.upload_reading_progress(
+        current_user["id"],
+        [item.model_dump() for item in body.items],
+    )
+    return {"ok": True, **result}
+
+
 # ---- Comment ----
 
 class CommentRequest(BaseModel):
@@ -777,15 +1195,36 @@ def get_comments(
     album_id: str,
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+    with_total: bool = Query(True),
+    if_none_match: Optional[str] = Header(None),
     current_user: dict = Depends(site_store.require_current_user),
 ):
-    return site_store.list_comments(
+    version = site_store.get_comment_version(album_id)
+    etag = site_store.comment_etag(
         album_id,
+        version,
         page,
         page_size,
         viewer_user_id=current_user["id"],
         viewer_is_admin=current_user["is_admin"],
+        cursor=cursor,
+        with_total=with_total,
     )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    data = site_store.list_comments(
+        album_id,
+        page,
+        page_size,
+        viewer_user_id=current_user["id"],
+        viewer_is_admin=current_user["is_admin"],
+        cursor=cursor,
+        with_total=with_total,
+        version=version,
+    )
+    return Response(content=response_cache.encode_json(data), media_type="application/json", headers=headers)
 
 
 @app.post("/api/comments/{album_id}")
@@ -1152,10 +1591,14 @@ def download_chapter_pdf(album_id: str, photo_id: str):
 
 @app.get("/api/domains")
 def get_domains():
-    """Get current domain list."""
+    """Get current domain list and the health scoreboard."""
     try:
         cl = get_client()
-        return {"domains": cl.get_domain_list()}
+        return {
+            "domains": cl.get_domain_list(),
+            "health": domain_monitor.scoreboard(),
+            "last_failover": domain_monitor.last_failover,
+        }
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(500, str(e))
@@ -1171,6 +1614,7 @@ def set_domains(body: DomainRequest):
     try:
         cl = get_client()
         cl.set_domain_list(body.domains)
+        domain_monitor.pin(body.domains[0] if body.domains else None)
         return {"ok": True, "domains": cl.get_domain_list()}
     except Exception as e:
         traceback.print_exc()
@@ -1193,16 +1637,15 @@ def discover_domains():
         raise HTTPException(500, str(e))
 
 
-def _ping_domain(domain: str, timeout: float = 8.0) -> dict:
+async def _ping_domain(domain: str, timeout: float = 8.0) -> dict:
     """Ping a single domain and return latency info."""
-    from curl_cffi import requests as curl_requests
     url = f"https://{domain}"
     try:
         start = time.time()
-        resp = curl_requests.get(
+        await upstream.pool.request(
+            "GET",
             url,
             timeout=timeout,
-            impersonate="chrome",
             allow_redirects=False,
         )
         latency = round((time.time() - start) * 1000)
@@ -1211,8 +1654,11 @@ def _ping_domain(domain: str, timeout: float = 8.0) -> dict:
         return {"domain": domain, "latency": -1, "status": "error", "error": str(e)}
 
 
+domain_monitor = DomainHealthMonitor(_ping_domain, get_client)
+
+
 @app.get("/api/domains/ping")
-def ping_domains():
+async def ping_domains():
     """Test latency for all known domains."""
     try:
         cl = get_client()
@@ -1220,22 +1666,20 @@ def ping_domains():
         # Also try to discover more domains
         all_domains = set(current_domains)
         try:
-            discovered = cl.get_html_domain_all()
+            discovered = await upstream.run_sync(cl.get_html_domain_all)
             if discovered:
                 all_domains.update(discovered)
         except Exception:
             pass
 
-        results = []
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = {executor.submit(_ping_domain, d): d for d in all_domains}
-            for future in as_completed(futures):
-                results.append(future.result())
-
+        results = list(await asyncio.gather(*(_ping_domain(d) for d in all_domains)))
+        for result in results:
+            domain_monitor.record(result["domain"], result["latency"], result.get("error", ""))
         results.sort(key=lambda x: (x["latency"] < 0, x["latency"]))
         return {
             "current": current_domains,
             "results": results,
+            "health": domain_monitor.scoreboard(),
         }
     except Exception as e:
         traceback.print_exc()
@@ -1254,12 +1698,45 @@ def switch_domain(body: SwitchDomainRequest):
         current = cl.get_domain_list()
         new_list = [body.domain] + [d for d in current if d != body.domain]
         cl.set_domain_list(new_list)
+        domain_monitor.pin(body.domain)
         return {"ok": True, "domains": cl.get_domain_list()}
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(500, str(e))
 
 
+# ---- Upstream ----
+
+@app.get("/api/upstream/stats")
+def upstream_stats():
+    """Connection pool, hedging, circuit breaker and retry budget state for upstream hosts."""
+    return {
+        "pool": upstream.pool.stats(),
+        "hedge": upstream.hedge_policy.stats(),
+        "circuit": upstream.breakers.snapshot(),
+        "retry_budget": upstream.retry_budget.snapshot(),
+        "response_cache": api_cache.stats(),
+        "ranking_snapshots": ranking_snapshots.stats(),
+        "offline": offline_store.stats(),
+        "covers": cover_cache.stats(),
+        "reading_progress": site_store.progress_buffer.stats(),
+        "comment_cache": site_store.comment_tree_cache.stats(),
+    }
+
+
+@app.get("/api/admin/site/stats")
+def admin_site_stats(current_user: dict = Depends(site_store.require_admin_user)):
+    """Site database pools, writer and session cleanup; backups are under /api/admin/backups."""
+    return {
+        "sessions": site_store.session_reaper.stats(),
+        "site_db": {
+            "pool": site_store.pool.stats(),
+            "read_pool": site_store.read_pool.stats(),
+            "writer": site_store.writer.stats(),
+        },
+    }
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Response
+from fastapi.responses import FileResponse
+
+import album_catalog
+import upstream
+from response_cache import encode_json
+
+# 离线降级：上游全部不可用时，用本地目录保存的漫画 / 章节元数据和 CACHE_DIR 里已缓存的图片继续提供阅读。
+# 离线返回的响应带 X-Cache: OFFLINE 头，JSON 里带 stale: true。
+# auto：所有域名熔断时直接走离线数据，上游请求失败时也回退到离线数据；on：始终离线；off：关闭
+OFFLINE_MODE = os.getenv("OFFLINE_MODE", "auto").lower()
+
+PAGE_MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+
+def _read_meta(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+class OfflineStore:
+    """Album / chapter detail and page images served from local data only."""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+        self.served = 0
+        self.last_served_at: Optional[int] = None
+
+    def active(self) -> bool:
+        """Skip upstream entirely and answer from local data."""
+        if OFFLINE_MODE == "on":
+            return True
+        if OFFLINE_MODE == "off":
+            return False
+        return upstream.all_domains_open()
+
+    def fallback_enabled(self) -> bool:
+        return OFFLINE_MODE != "off"
+
+    # ---- Lookup ----
+
+    def _chapter_dir(self, photo_id: str, album_id: str = "") -> Optional[Path]:
+        # id 来自请求路径，只接受纯数字，不能带进 glob 或路径里
+        if not photo_id.isdigit() or (album_id and not album_id.isdigit()):
+            return None
+        if album_id:
+            path = self.cache_dir / album_id / photo_id
+            return path if path.is_dir() else None
+        for path in self.cache_dir.glob(f"*/{photo_id}"):
+            if path.is_dir():
+                return path
+        return None
+
+    @staticmethod
+    def _cached_pages(chapter_dir: Optional[Path]) -> list[Path]:
+        if chapter_dir is None:
+            return []
+        return sorted(
+            item for item in chapter_dir.iterdir()
+            if item.is_file() and item.suffix.lower() in PAGE_MEDIA_TYPES and item.stem.isdigit()
+        )
+
+    def album_detail(self, album_id: str) -> Optional[dict]:
+        if not album_id.isdigit():
+            return None
+        album_dir = self.cache_dir / album_id
+        cached = set()
+        if album_dir.is_dir():
+            cached = {
+                chapter_dir.name for chapter_dir in album_dir.iterdir()
+                if chapter_dir.is_dir() and self._cached_pages(chapter_dir)
+            }
+
+        data = album_catalog.get_detail(album_id)
+        if data is None:
+            if not cached:
+                return None
+            # 没有保存过详情，只能用缓存目录里的 meta.json 拼一个最小的详情
+            meta = _read_meta(album_dir / "meta.json")
+            author = meta.get("author", "")
+            episodes = [
+                {
+                    "id": photo_id,
+                    "sort": str(i + 1),
+                    "title": _read_meta(album_dir / photo_id / "meta.json").get("title", ""),
+                }
+                for i, photo_id in enumerate(sorted(cached, key=lambda pid: (len(pid), pid)))
+            ]
+            data = {
+                "id": album_id,
+                "title": meta.get("title", ""),
+                "author": author,
+                "authors": [author] if author else [],
+                "description": "",
+                "tags": [],
+                "actors": [],
+                "works": [],
+                "likes": "0",
+                "views": "0",
+                "comment_count": 0,
+                "pub_date": "",
+                "update_date": "",
+                "page_count": 0,
+                "episodes": episodes,
+                "cover": f"/api/comics/{album_id}/cover",
+                "related_list": [],
+            }
+
+        for episode in data["episodes"]:
+            episode["cached"] = episode["id"] in cached
+        return data
+
+    def chapter_detail(self, photo_id: str) -> Optional[dict]:
+        data = album_catalog.get_chapter(photo_id)
+        chapter_dir = self._chapter_dir(photo_id, (data or {}).get("album_id", ""))
+        pages = self._cached_pages(chapter_dir)
+        if data is None:
+            if not pages:
+                return None
+            data = {
+                "id": photo_id,
+                "title": _read_meta(chapter_dir / "meta.json").get("title", ""),
+                "album_id": chapter_dir.parent.name,
+                "album_index": 1,
+                "page_count": len(pages),
+                "scramble_id": None,
+                "tags": [],
+                "images": [
+                    {
+                        "index": int(page.stem),
+                        "filename": page.name,
+                        "url": f"/api/chapters/{photo_id}/images/{int(page.stem)}",
+                    }
+                    for page in pages
+                ],
+            }
+        data["cached_pages"] = len(pages)
+        return data
+
+    def page_path(self, photo_id: str, index: int) -> Optional[Path]:
+        data = album_catalog.get_chapter(photo_id)
+        chapter_dir = self._chapter_dir(photo_id, (data or {}).get("album_id", ""))
+        if chapter_dir is None:
+            return None
+        matches = sorted(chapter_dir.glob(f"{index:04d}.*"))
+        return matches[0] if matches else None
+
+    # ---- Responses ----
+
+    def _mark_served(self) -> None:
+        self.served += 1
+        self.last_served_at = int(time.time())
+
+    def _json_response(self, data: Optional[dict]) -> Optional[Response]:
+        if data is None:
+            return None
+        self._mark_served()
+        return Response(
+            content=encode_json({**data, "stale": True}),
+            media_type="application/json",
+            headers={"X-Cache": "OFFLINE"},
+        )
+
+    def album_response(self, album_id: str) -> Optional[Response]:
+        return self._json_response(self.album_detail(album_id))
+
+    def chapter_response(self, photo_id: str) -> Optional[Response]:
+        return self._json_response(self.chapter_detail(photo_id))
+
+    def page_response(self, photo_id: str, index: int) -> Optional[Response]:
+        path = self.page_path(photo_id, index)
+        if path is None:
+            return None
+        self._mark_served()
+        return FileResponse(
+            str(path),
+            media_type=PAGE_MEDIA_TYPES.get(path.suffix.lower(), "image/jpeg"),
+            headers={"X-Cache": "OFFLINE"},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "mode": OFFLINE_MODE,
+            "active": self.active(),
+            "served": self.served,
+            "last_served_at": self.last_served_at,
+        }
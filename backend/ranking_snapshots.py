@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from fastapi import Response
+
+from response_cache import encode_json
+
+# 排行榜预计算：定时刷新每种排行 × 每个分类的前 N 页，保存为快照（内存 + 磁盘），
+# 接口优先返回快照，只有超出预计算范围的页才实时请求上游。
+RANKING_TYPES = ("all", "day", "week", "month")
+RANKING_PRECOMPUTE_PAGES = int(os.getenv("RANKING_PRECOMPUTE_PAGES", "3"))
+RANKING_PRECOMPUTE_INTERVAL = float(os.getenv("RANKING_PRECOMPUTE_INTERVAL", "900"))
+RANKING_PRECOMPUTE_CONCURRENCY = int(os.getenv("RANKING_PRECOMPUTE_CONCURRENCY", "4"))
+RANKING_PRECOMPUTE_CATEGORIES = [
+    item.strip()
+    for item in os.getenv(
+        "RANKING_PRECOMPUTE_CATEGORIES",
+        "0,doujin,single,short,hanman,meiman,doujin_cosplay,3D,english_site,another",
+    ).split(",")
+    if item.strip()
+]
+
+
+class RankingSnapshots:
+    """Periodically refreshed ranking pages, served without touching upstream."""
+
+    def __init__(
+        self,
+        load_page: Callable[[str, int, str], Awaitable[dict]],
+        snapshot_dir: Path,
+    ):
+        self._load_page = load_page
+        self.snapshot_dir = snapshot_dir
+        self._snapshots: dict[tuple[str, str, int], dict] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.last_run_started: Optional[int] = None
+        self.last_run_finished: Optional[int] = None
+        self.last_run_errors = 0
+
+    # ---- Lookup ----
+
+    def get(self, ranking_type: str, category: str, page: int) -> Optional[Response]:
+        entry = self._snapshots.get((ranking_type, category, page))
+        if entry is None:
+            return None
+        return Response(
+            content=entry["body"],
+            media_type="application/json",
+            headers={
+                "X-Cache": "SNAPSHOT",
+                "X-Cache-Fetched-At": str(entry["fetched_at"]),
+            },
+        )
+
+    # ---- Persistence ----
+
+    def _file_for(self, ranking_type: str, category: str) -> Path:
+        return self.snapshot_dir / f"{ranking_type}_{category}.json"
+
+    def load_from_disk(self) -> int:
+        if not self.snapshot_dir.exists():
+            return 0
+        loaded = 0
+        for path in self.snapshot_dir.glob("*.json"):
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+                ranking_type, category = data["ranking_type"], data["category"]
+                for page, item in data["pages"].items():
+                    self._snapshots[(ranking_type, category, int(page))] = {
+                        "body": encode_json(item["data"]),
+                        "fetched_at": item["fetched_at"],
+                    }
+                    loaded += 1
+            except Exception:
+                traceback.print_exc()
+        return loaded
+
+    def _save(self, ranking_type: str, category: str, pages: dict[int, dict]) -> None:
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        path = self._file_for(ranking_type, category)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(
+            json.dumps(
+                {
+                    "ranking_type": ranking_type,
+                    "category": category,
+                    "pages": {str(page): item for page, item in pages.items()},
+                },
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+        tmp_path.replace(path)
+
+    # ---- Refresh ----
+
+    async def _refresh_one(self, semaphore: asyncio.Semaphore, ranking_type: str, category: str) -> int:
+        pages: dict[int, dict] = {}
+        errors = 0
+        for page in range(1, RANKING_PRECOMPUTE_PAGES + 1):
+            try:
+                async with semaphore:
+                    data = await self._load_page(ranking_type, page, category)
+            except Exception as e:
+                errors += 1
+                print(f"[backend] ranking snapshot {ranking_type}/{category}/{page} failed: {e}")
+                continue
+            fetched_at = int(time.time())
+            pages[page] = {"data": data, "fetched_at": fetched_at}
+            self._snapshots[(ranking_type, category, page)] = {
+                "body": encode_json(data),
+                "fetched_at": fetched_at,
+            }
+            if page >= data.get("page_count", 0):
+                break
+
+        if pages:
+            # 失败的页保留上一次的快照
+            for page in range(1, RANKING_PRECOMPUTE_PAGES + 1):
+                if page not in pages:
+                    previous = self._snapshots.get((ranking_type, category, page))
+                    if previous is not None:
+                        pages[page] = {"data": json.loads(previous["body"]), "fetched_at": previous["fetched_at"]}
+            try:
+                await asyncio.to_thread(self._save, ranking_type, category, pages)
+            except Exception:
+                traceback.print_exc()
+        return errors
+
+    async def refresh_all(self) -> None:
+        self.last_run_started = int(time.time())
+        semaphore = asyncio.Semaphore(RANKING_PRECOMPUTE_CONCURRENCY)
+        results = await asyncio.gather(*(
+            self._refresh_one(semaphore, ranking_type, category)
+            for ranking_type in RANKING_TYPES
+            for category in RANKING_PRECOMPUTE_CATEGORIES
+        ))
+        self.last_run_errors = sum(results)
+        self.last_run_finished = int(time.time())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(RANKING_PRECOMPUTE_INTERVAL)
+
+    def start(self) -> None:
+        if RANKING_PRECOMPUTE_INTERVAL <= 0 or RANKING_PRECOMPUTE_PAGES <= 0 or self._task is not None:
+            return
+        loaded = self.load_from_disk()
+        if loaded:
+            print(f"[backend] loaded {loaded} ranking snapshot pages")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "pages": len(self._snapshots),
+            "precompute_pages": RANKING_PRECOMPUTE_PAGES,
+            "categories": RANKING_PRECOMPUTE_CATEGORIES,
+            "interval": RANKING_PRECOMPUTE_INTERVAL,
+            "last_run_started": self.last_run_started,
+            "last_run_finished": self.last_run_finished,
+            "last_run_errors": self.last_run_errors,
+        }
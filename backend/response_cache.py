@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from fastapi import Response
+
+# 列表 / 搜索 / 排行接口的响应缓存：按规范化后的查询参数做 key，直接缓存序列化好的 JSON，
+# 过期后在 stale 窗口内先返回旧数据，同时只发起一次后台刷新。
+RESPONSE_CACHE_TTL = {
+    "list": float(os.getenv("RESPONSE_CACHE_TTL_LIST", "120")),
+    "search": float(os.getenv("RESPONSE_CACHE_TTL_SEARCH", "300")),
+    "ranking": float(os.getenv("RESPONSE_CACHE_TTL_RANKING", "600")),
+}
+RESPONSE_CACHE_STALE_SECONDS = float(os.getenv("RESPONSE_CACHE_STALE_SECONDS", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def encode_json(data: dict) -> bytes:
+    """Same encoding as Starlette's JSONResponse."""
+    return json.dumps(
+        data,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def make_key(endpoint: str, **params) -> str:
+    normalized = []
+    for name in sorted(params):
+        value = params[name]
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        normalized.append(f"{name}={value}")
+    return f"{endpoint}?{'&'.join(normalized)}"
+
+
+class ResponseCache:
+    """LRU of serialized JSON bodies with per-endpoint TTL and stale-while-revalidate."""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        stale_seconds: float = RESPONSE_CACHE_STALE_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._background: set[asyncio.Future] = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refresh_errors = 0
+
+    # ---- Storage ----
+
+    def _get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, body: bytes, ttl: float) -> dict:
+        self._discard(key)
+        now = time.monotonic()
+        entry = {
+            "body": body,
+            "fetched_at": time.time(),
+            "expires_at": now + ttl,
+            "stale_until": now + ttl + self.stale_seconds,
+        }
+        self._entries[key] = entry
+        self._bytes += len(body)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._discard(oldest)
+        return entry
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry["body"])
+
+    def invalidate(self, prefix: str = "") -> int:
+        keys = [k for k in self._entries if k.startswith(prefix)]
+        for key in keys:
+            self._discard(key)
+        return len(keys)
+
+    # ---- Loading ----
+
+    async def _load(self, key: str, ttl: float, loader: Callable[[], Awaitable[dict]]) -> dict:
+        """Single-flight load: concurrent callers for one key share one upstream call."""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._fill(key, ttl, loader))
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(future)
+
+    def _done(self, key: str, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            # 调用方已取消时也要取走异常，避免 "exception was never retrieved"
+            future.exception()
+
+    async def _fill(self, key: str, ttl: float, loader: Callable[[], Awaitable[dict]]) -> dict:
+        data = await loader()
+        return self._put(key, encode_json(data), ttl)
+
+    def _refresh_in_background(self, key: str, ttl: float, loader: Callable[[], Awaitable[dict]]) -> None:
+        if key in self._inflight:
+            return
+
+        async def refresh():
+            try:
+                await self._load(key, ttl, loader)
+            except Exception:
+                self.refresh_errors += 1
+                traceback.print_exc()
+
+        task = asyncio.ensure_future(refresh())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def serve(self, endpoint: str, key: str, loader: Callable[[], Awaitable[dict]]) -> Response:
+        ttl = RESPONSE_CACHE_TTL.get(endpoint, 60.0)
+        now = time.monotonic()
+        entry = self._get(key)
+
+        if entry is not None and now < entry["expires_at"]:
+            self.hits += 1
+            return self._response(entry, "HIT")
+
+        if entry is not None and now < entry["stale_until"]:
+            self.stale_hits += 1
+            self._refresh_in_background(key, ttl, loader)
+            return self._response(entry, "STALE")
+
+        self.misses += 1
+        try:
+            entry = await self._load(key, ttl, loader)
+        except Exception:
+            # 上游失败时，哪怕已经超出 stale 窗口也优先返回旧数据
+            if entry is not None:
+                return self._response(entry, "STALE")
+            raise
+        return self._response(entry, "MISS")
+
+    @staticmethod
+    def _response(entry: dict, status: str) -> Response:
+        return Response(
+            content=entry["body"],
+            media_type="application/json",
+            headers={
+                "X-Cache": status,
+                "X-Cache-Fetched-At": str(int(entry["fetched_at"])),
+            },
+        )
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshing": len(self._inflight),
+            "refresh_errors": self.refresh_errors,
+            "ttl": RESPONSE_CACHE_TTL,
+        }
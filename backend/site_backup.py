@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+import traceback
+from pathlib import Path
+from typing import Optional
+
+import site_store
+
+# 在线备份：用 SQLite 的 backup API 按页分批复制站点数据库，写入不受影响；
+# 复制前在源连接上开一个读事务固定快照（WAL 模式下不挡写入），否则期间有写入时备份会从头重来。
+# 副本做完整性检查后才改成正式文件名，按数量和时间轮换。多个 worker 通过 backup_state 表抢同一个时间窗口，
+# 每个周期只有一个 worker 执行。
+SITE_BACKUP_INTERVAL = float(os.getenv("SITE_BACKUP_INTERVAL", str(24 * 60 * 60)))
+SITE_BACKUP_KEEP = int(os.getenv("SITE_BACKUP_KEEP", "7"))
+SITE_BACKUP_MAX_AGE = float(os.getenv("SITE_BACKUP_MAX_AGE", str(30 * 24 * 60 * 60)))
+SITE_BACKUP_STEP_PAGES = int(os.getenv("SITE_BACKUP_STEP_PAGES", "256"))
+SITE_BACKUP_STEP_SLEEP = float(os.getenv("SITE_BACKUP_STEP_SLEEP", "0.005"))
+
+PARTIAL_SUFFIX = ".partial"
+# 超过这个时间还没改名的半成品视为中断留下的，轮换时删掉
+STALE_PARTIAL_SECONDS = 24 * 60 * 60
+
+
+def _claim_backup(conn: sqlite3.Connection, interval: float) -> float:
+    """Take this period's backup slot; 0 if claimed, else seconds until the next one is due."""
+    now = time.time()
+    last_started_at = conn.execute("SELECT last_started_at FROM backup_state WHERE id = 1").fetchone()[0]
+    due_in = last_started_at + interval - now
+    if due_in > 0:
+        return due_in
+    conn.execute("UPDATE backup_state SET last_started_at = ? WHERE id = 1", (int(now),))
+    return 0
+
+
+class SiteBackups:
+    """Scheduled online copies of the site database, verified and rotated."""
+
+    def __init__(self, db_path: Path, backup_dir: Path):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._stopping = False
+        self.runs = 0
+        self.failures = 0
+        self.removed = 0
+        self.pages_total = 0
+        self.pages_remaining = 0
+        self.last_run_started: Optional[int] = None
+        self.last_run_finished: Optional[int] = None
+        self.last_error: Optional[str] = None
+        self.last_backup: Optional[dict] = None
+
+    # ---- Copy ----
+
+    def _next_path(self) -> Path:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = self.backup_dir / f"{self.db_path.stem}-{stamp}.db"
+        suffix = 1
+        while path.exists() or path.with_name(path.name + PARTIAL_SUFFIX).exists():
+            path = self.backup_dir / f"{self.db_path.stem}-{stamp}-{suffix}.db"
+            suffix += 1
+        return path
+
+    def _progress(self, status: int, remaining: int, total: int) -> None:
+        self.pages_total = total
+        self.pages_remaining = remaining
+        if self._stopping:
+            raise RuntimeError("backup interrupted by shutdown")
+        # 每一批之间让出一下，给请求线程留出数据库和 IO
+        if remaining and SITE_BACKUP_STEP_SLEEP > 0:
+            time.sleep(SITE_BACKUP_STEP_SLEEP)
+
+    def _copy(self, target: Path) -> None:
+        source = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        dest = sqlite3.connect(target)
+        try:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(dest, pages=SITE_BACKUP_STEP_PAGES, progress=self._progress)
+            source.execute("COMMIT")
+            # 副本独立成单个文件，不带 -wal
+            dest.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            dest.close()
+            source.close()
+
+    @staticmethod
+    def _verify(path: Path) -> None:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            rows = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+        finally:
+            conn.close()
+        if rows != ["ok"]:
+            raise RuntimeError(f"integrity check failed: {'; '.join(rows[:5])}")
+
+    def _backup(self) -> dict:
+        self.backup_dir.mkdir(parents=True, exist_ok=True)
+        path = self._next_path()
+        partial = path.with_name(path.name + PARTIAL_SUFFIX)
+        started = time.monotonic()
+        try:
+            self._copy(partial)
+            self._verify(partial)
+            with open(partial, "rb") as f:
+                os.fsync(f.fileno())
+            partial.replace(path)
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        return {
+            "name": path.name,
+            "size": path.stat().st_size,
+            "pages": self.pages_total,
+            "duration": round(time.monotonic() - started, 3),
+            "created_at": int(time.time()),
+        }
+
+    # ---- Rotation ----
+
+    def list_backups(self) -> list[dict]:
+        if not self.backup_dir.exists():
+            return []
+        items = []
+        for path in self.backup_dir.glob(f"{self.db_path.stem}-*.db"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            items.append((stat.st_mtime_ns, {"name": path.name, "size": stat.st_size, "created_at": int(stat.st_mtime)}))
+        items.sort(key=lambda item: item[0], reverse=True)
+        return [item for _, item in items]
+
+    def rotate(self) -> int:
+        now = time.time()
+        removed = 0
+        # 最新的一份始终保留，即使已经超龄，免得备份连续失败时一份都不剩
+        for i, item in enumerate(self.list_backups()):
+            if i == 0:
+                continue
+            too_many = SITE_BACKUP_KEEP > 0 and i >= SITE_BACKUP_KEEP
+            too_old = SITE_BACKUP_MAX_AGE > 0 and now - item["created_at"] > SITE_BACKUP_MAX_AGE
+            if too_many or too_old:
+                (self.backup_dir / item["name"]).unlink(missing_ok=True)
+                removed += 1
+        for path in self.backup_dir.glob(f"*{PARTIAL_SUFFIX}"):
+            try:
+                if now - path.stat().st_mtime > STALE_PARTIAL_SECONDS:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+        self.removed += removed
+        return removed
+
+    # ---- Runs ----
+
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self) -> dict:
+        async with self._lock:
+            self.last_run_started = int(time.time())
+            self.pages_total = self.pages_remaining = 0
+            try:
+                backup = await asyncio.to_thread(self._backup)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                raise
+            finally:
+                self.runs += 1
+                self.last_run_finished = int(time.time())
+            self.last_error = None
+            self.last_backup = backup
+            try:
+                await asyncio.to_thread(self.rotate)
+            except Exception:
+                traceback.print_exc()
+            print(f"[backend] site database backed up to {backup['name']} in {backup['duration']}s")
+            return backup
+
+    async def _run(self) -> None:
+        while True:
+            delay = SITE_BACKUP_INTERVAL
+            try:
+                due_in = await site_store.db_write_async(_claim_backup, SITE_BACKUP_INTERVAL)
+                if due_in > 0:
+                    delay = due_in
+                else:
+                    await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(delay)
+
+    def start(self) -> None:
+        self._stopping = False
+        if SITE_BACKUP_INTERVAL <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # 正在复制的线程在下一批之前退出，半成品会被删掉
+        self._stopping = True
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": SITE_BACKUP_INTERVAL,
+            "keep": SITE_BACKUP_KEEP,
+            "max_age": SITE_BACKUP_MAX_AGE,
+            "running": self.running(),
+            "pages_total": self.pages_total,
+            "pages_remaining": self.pages_remaining,
+            "runs": self.runs,
+            "failures": self.failures,
+            "removed": self.removed,
+            "last_run_started": self.last_run_started,
+            "last_run_finished": self.last_run_finished,
+            "last_error": self.last_error,
+            "last_backup": self.last_backup,
+        }
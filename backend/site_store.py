@@ -1,12 +1,21 @@
 from __future__ import annotations
 
+import asyncio
+import base64
 import hashlib
 import hmac
+import json
 import math
 import os
+import queue
 import secrets
 import sqlite3
+import threading
 import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
@@ -18,43 +27,848 @@ DB_PATH = Path(os.getenv("SITE_DB_PATH", str(DEFAULT_DB_PATH))).expanduser()
 AVATAR_DIR = DB_PATH.parent / "avatars"
 SESSION_TTL_SECONDS = 30 * 24 * 60 * 60
 
+# 会话清理：后台按批删除过期的 sessions / revoked_tokens 行；每个用户最多保留 SESSION_MAX_PER_USER 个会话，
+# 超出时登录会挤掉最早的会话（0 表示不限制）
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "600"))
+SESSION_REAP_BATCH = int(os.getenv("SESSION_REAP_BATCH", "1000"))
+SESSION_MAX_PER_USER = int(os.getenv("SESSION_MAX_PER_USER", "20"))
+
+# 连接池：连接建好后复用，PRAGMA 只在新建连接时执行一次
+SITE_DB_POOL_SIZE = int(os.getenv("SITE_DB_POOL_SIZE", "16"))
+SITE_DB_CACHE_KB = int(os.getenv("SITE_DB_CACHE_KB", "16384"))
+SITE_DB_MMAP_BYTES = int(os.getenv("SITE_DB_MMAP_BYTES", str(128 * 1024 * 1024)))
+
+# 单写线程：收藏 / 历史 / 缓存记录 / 评论 / 阅读进度的写入交给一个独占连接的线程，
+# 排队的写入合并进同一个事务提交（每个写入一个 SAVEPOINT，互不影响）；这些模块的读取走只读连接池
+SITE_DB_WRITER = os.getenv("SITE_DB_WRITER", "1") != "0"
+SITE_DB_WRITER_BATCH = int(os.getenv("SITE_DB_WRITER_BATCH", "64"))
+# 等待排队写入完成的最长秒数（0 不限），写线程卡住时请求不会一直挂着
+SITE_DB_WRITE_TIMEOUT = float(os.getenv("SITE_DB_WRITE_TIMEOUT", "30"))
+
+# 登录态缓存：token -> 用户信息，改动用户 / 会话时递增 auth_state.version，
+# 其他 worker 最多 SESSION_CACHE_VERSION_CHECK 秒后发现版本变化并清空本地缓存
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+SESSION_CACHE_VERSION_CHECK = float(os.getenv("SESSION_CACHE_VERSION_CHECK", "1"))
+
+# 签名令牌：token 自带 用户 id / 管理员标记 / 过期时间 / 吊销纪元，校验只需要 HMAC 和内存里的纪元表。
+# 用户的 token_epoch 递增即吊销其全部令牌；单个令牌登出记入 revoked_tokens。
+# 旧的随机 token 仍按 sessions 表校验。签名令牌的 sid 是单独生成的随机 id，sessions 里记为 "s1:<sid>"，
+# 不能当作随机 token 使用。用户变更和单个令牌的吊销记入 auth_changes，各 worker 只增量读取新增的记录，
+# 记录保留 AUTH_CHANGE_RETENTION 秒，落后更多的 worker 整表重新加载。
+SITE_SIGNED_TOKENS = os.getenv("SITE_SIGNED_TOKENS", "1") != "0"
+SIGNED_TOKEN_PREFIX = "s1"
+AUTH_CHANGE_RETENTION = 24 * 60 * 60
+_token_secret: Optional[bytes] = None
+
+# 密码哈希：每个用户记录算法和迭代次数，参数调高后在下次登录成功时重新哈希。
+# 登录时的 PBKDF2 放在独立的小线程池里执行，排队过多直接返回 429；失败次数按 IP / 用户名限流。
+PASSWORD_ALGORITHM = "pbkdf2_sha256"
+LEGACY_PASSWORD_ITERATIONS = 120000
+PASSWORD_ITERATIONS = int(os.getenv("PASSWORD_ITERATIONS", str(LEGACY_PASSWORD_ITERATIONS)))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+LOGIN_THROTTLE_WINDOW = float(os.getenv("LOGIN_THROTTLE_WINDOW", "300"))
+LOGIN_MAX_FAILURES_PER_IP = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "20"))
+# 按 (IP, 用户名) 计数，别人从其他 IP 输错密码不会锁住账号主人；
+# 按用户名的全局上限要高得多，只挡从大量 IP 分散猜同一个账号
+LOGIN_MAX_FAILURES_PER_USER = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", "5"))
+LOGIN_MAX_FAILURES_PER_ACCOUNT = int(os.getenv("LOGIN_MAX_FAILURES_PER_ACCOUNT", "100"))
+
+# 头像：上传时在独立的小线程池里一次生成各尺寸的 WebP / JPEG，排队过多直接返回 429。
+# 文件名带 avatar_updated_at，带版本号的请求可以按 immutable 长期缓存
+AVATAR_SIZES = sorted({int(size) for size in os.getenv("AVATAR_SIZES", "48,96,256").split(",") if size.strip()})
+AVATAR_QUALITY = int(os.getenv("AVATAR_QUALITY", "85"))
+AVATAR_WORKERS = int(os.getenv("AVATAR_WORKERS", "2"))
+AVATAR_MAX_PENDING = int(os.getenv("AVATAR_MAX_PENDING", "16"))
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+AVATAR_FORMATS = {"webp": "image/webp", "jpg": "image/jpeg"}
+
+# 列表总数缓存：收藏 / 历史 / 评论的 COUNT(*) 结果短暂缓存，本进程写入时立即失效
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "30"))
+
+# 阅读进度延迟写入：翻页上报的进度按 (用户, 章节) 在内存里合并，定时或积攒够条数后一个事务批量写入，
+# 关闭时写完剩余部分；本进程的读取会叠加尚未落盘的进度。PROGRESS_FLUSH_INTERVAL=0 时每次直接写库
+PROGRESS_FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", "2"))
+PROGRESS_FLUSH_MAX_PENDING = int(os.getenv("PROGRESS_FLUSH_MAX_PENDING", "500"))
+
+# 评论树缓存：按漫画缓存已组装好的评论页，comment_versions 里的版本号在发表 / 删除评论
+# 以及评论者资料变化时递增；版本号同时用于 ETag，未变化的评论区返回 304
+COMMENT_CACHE_MAX_ENTRIES = int(os.getenv("COMMENT_CACHE_MAX_ENTRIES", "2000"))
+COMMENT_MAX_LENGTH = 2000
+
+# 增量同步：触发器把 favorites / history / chapter_progress 的变更记入 sync_changes，
+# 每个条目只保留最新一条（删除记为墓碑），客户端按序号游标拉取；过期的墓碑由清理任务删除，
+# 游标早于已清理位置的客户端需要从头全量同步
+SYNC_PAGE_MAX = int(os.getenv("SYNC_PAGE_MAX", "1000"))
+SYNC_UPLOAD_MAX = int(os.getenv("SYNC_UPLOAD_MAX", "500"))
+SYNC_TOMBSTONE_TTL = int(os.getenv("SYNC_TOMBSTONE_TTL", str(30 * 24 * 60 * 60)))
+SYNC_KINDS = {
+    "favorite": ("favorites", "album_id"),
+    "history": ("history", "album_id"),
+    "progress": ("chapter_progress", "photo_id"),
+}
+
 
 def _now_ts() -> int:
     return int(time.time())
 
 
+_db_target_ready = False
+
+
 def _ensure_db_target() -> None:
+    global _db_target_ready
     if DB_PATH.exists() and DB_PATH.is_dir():
         raise RuntimeError(f"Database path is a directory, not a file: {DB_PATH}")
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     AVATAR_DIR.mkdir(parents=True, exist_ok=True)
+    _db_target_ready = True
 
 
-@contextmanager
-def db_conn():
-    _ensure_db_target()
-    conn = sqlite3.connect(DB_PATH, timeout=30)
+def _open_connection(read_only: bool = False) -> sqlite3.Connection:
+    # 连接只会被一个线程借出使用，归还后可以交给其他线程
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = {-SITE_DB_CACHE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {SITE_DB_MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ConnectionPool:
+    """Idle SQLite connections checked out by db_conn() and returned afterwards."""
+
+    def __init__(self, max_idle: int = SITE_DB_POOL_SIZE, read_only: bool = False):
+        self.max_idle = max_idle
+        self.read_only = read_only
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        conn = _open_connection(self.read_only)
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"idle": len(self._idle), "opened": self.opened, "max_idle": self.max_idle}
+
+
+pool = ConnectionPool()
+read_pool = ConnectionPool(read_only=True)
+
+
+@contextmanager
+def db_conn():
+    if not _db_target_ready:
+        _ensure_db_target()
+    conn = pool.acquire()
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            # 连接已损坏，不再放回池中
+            conn.close()
+        else:
+            pool.release(conn)
         raise
+    else:
+        pool.release(conn)
+
+
+@contextmanager
+def db_read():
+    """Read-only connection; writes through it fail with "attempt to write a readonly database"."""
+    if not _db_target_ready:
+        _ensure_db_target()
+    conn = read_pool.acquire()
+    try:
+        yield conn
     finally:
-        conn.close()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+        else:
+            read_pool.release(conn)
+
+
+class SQLiteWriter:
+    """One thread that owns a write connection and commits queued writes in groups."""
+
+    def __init__(self, batch_max: int = SITE_DB_WRITER_BATCH):
+        self.batch_max = max(1, batch_max)
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.commits = 0
+        self.failures = 0
+
+    def submit(self, func, *args) -> Future:
+        """Queue func(conn, *args); the future resolves after the transaction commits."""
+        future: Future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="site-db-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((func, args, future))
+        return future
+
+    def _run(self) -> None:
+        batch: list = []
+        stopped = False
+        conn = None
+        try:
+            if not _db_target_ready:
+                _ensure_db_target()
+            conn = _open_connection()
+            conn.isolation_level = None
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    stopped = True
+                    return
+                batch = [job]
+                stop = False
+                while len(batch) < self.batch_max:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stop = True
+                        break
+                    batch.append(job)
+                self._commit(conn, batch)
+                batch = []
+                if stop:
+                    stopped = True
+                    return
+        finally:
+            if conn is not None:
+                conn.close()
+            if not stopped:
+                self._abandon(batch)
+
+    def _abandon(self, batch: list) -> None:
+        """Fail the current batch and everything still queued when the thread dies."""
+        exc = RuntimeError("site database writer stopped")
+        with self._lock:
+            # 之后的 submit 会启动新线程，不会再排进这个队列等一个已经退出的线程
+            if self._thread is threading.current_thread():
+                self._thread = None
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    batch.append(job)
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+        print("[backend] site database writer stopped unexpectedly")
+
+    def _commit(self, conn: sqlite3.Connection, batch: list) -> None:
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = func(conn, *args)
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, exc))
+                else:
+                    conn.execute("RELEASE job")
+                    results.append((future, result, None))
+            conn.execute("COMMIT")
+        except BaseException as exc:
+            # 整个事务失败（磁盘、锁超时等），本批全部报错
+            self.failures += 1
+            rollback_error = None
+            if conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error as e:
+                    rollback_error = e
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            # 回滚失败说明连接已经不可用，退出线程，下次 submit 换新连接
+            if rollback_error is not None:
+                raise rollback_error
+            if not isinstance(exc, Exception):
+                raise
+            return
+        self.commits += 1
+        self.writes += len(results)
+        for future, result, exc in results:
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+    def close(self) -> None:
+        """Finish queued writes and stop the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SITE_DB_WRITER,
+            "queued": self._queue.qsize(),
+            "writes": self.writes,
+            "commits": self.commits,
+            "failures": self.failures,
+        }
+
+
+writer = SQLiteWriter()
+
+
+def db_write(func, *args):
+    """Run func(conn, *args) in a write transaction and return its result."""
+    if not SITE_DB_WRITER:
+        with db_conn() as conn:
+            return func(conn, *args)
+    future = writer.submit(func, *args)
+    try:
+        return future.result(timeout=SITE_DB_WRITE_TIMEOUT or None)
+    except FutureTimeoutError:
+        # 还没开始执行的写入直接取消；已经在执行的照常提交，只是不再等结果
+        future.cancel()
+        raise
+
+
+async def db_write_async(func, *args):
+    if not SITE_DB_WRITER:
+        return await asyncio.to_thread(db_write, func, *args)
+    # 不用 wait_for：内层刚好完成时它会吞掉外部的取消，后台任务就停不下来
+    async with asyncio.timeout(SITE_DB_WRITE_TIMEOUT or None):
+        return await asyncio.wrap_future(writer.submit(func, *args))
+
+
+class SessionCache:
+    """Bounded TTL map of session token to serialized user."""
+
+    def __init__(
+        self,
+        ttl: float = SESSION_CACHE_TTL,
+        max_entries: int = SESSION_CACHE_MAX_ENTRIES,
+        version_check: float = SESSION_CACHE_VERSION_CHECK,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_check = version_check
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        # 本进程内每次失效都递增，读库期间发生失效的结果不写入缓存
+        self._generation = 0
+        self._version: Optional[int] = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _sync_version(self) -> None:
+        now = time.monotonic()
+        if now - self._version_checked_at < self.version_check:
+            return
+        self._version_checked_at = now
+        with db_conn() as conn:
+            row = conn.execute("SELECT version FROM auth_state WHERE id = 1").fetchone()
+        version = row["version"] if row else 0
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._generation += 1
+                self._entries.clear()
+
+    def get(self, token: str) -> tuple[Optional[dict], int]:
+        """Cached user (or None) and the generation to pass back to put()."""
+        if self.ttl <= 0:
+            return None, 0
+        self._sync_version()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[0], self._generation
+            if entry is not None:
+                del self._entries[token]
+            self.misses += 1
+            return None, self._generation
+
+    def put(self, token: str, user: dict, expires_at: int, generation: int) -> None:
+        if self.ttl <= 0:
+            return
+        deadline = time.monotonic() + min(self.ttl, max(0, expires_at - _now_ts()))
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[token] = (user, deadline)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_token(self, token: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            for token in [t for t, (user, _) in self._entries.items() if user["id"] == user_id]:
+                del self._entries[token]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "version": self._version,
+            }
+
+
+session_cache = SessionCache()
+
+
+class EpochTable:
+    """In-memory users and revoked token ids, caught up from auth_changes when auth_state.version moves."""
+
+    def __init__(self, version_check: float = SESSION_CACHE_VERSION_CHECK):
+        self.version_check = version_check
+        self._users: dict[int, dict] = {}
+        self._epochs: dict[int, int] = {}
+        self._revoked: dict[str, int] = {}
+        self._version: Optional[int] = None
+        self._seq: Optional[int] = None
+        self._version_checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.updates = 0
+
+    def invalidate(self) -> None:
+        """Look at auth_state again on the next lookup instead of waiting for version_check."""
+        with self._lock:
+            self._version_checked_at = 0.0
+
+    def _set_user(self, row) -> None:
+        self._epochs[row["id"]] = row["token_epoch"]
+        if bool(row["is_active"]):
+            self._users[row["id"]] = _serialize_user(row)
+        else:
+            self._users.pop(row["id"], None)
+
+    def _drop_user(self, user_id: int) -> None:
+        self._epochs.pop(user_id, None)
+        self._users.pop(user_id, None)
+
+    def _reload(self, conn: sqlite3.Connection) -> None:
+        # 先取序号再读表，读表期间的新变更下次还会再应用一遍
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) AS seq FROM auth_changes").fetchone()["seq"]
+        users = conn.execute("SELECT * FROM users").fetchall()
+        revoked = conn.execute(
+            "SELECT token_id, expires_at FROM revoked_tokens WHERE expires_at > ?",
+            (_now_ts(),),
+        ).fetchall()
+        self._users = {}
+        self._epochs = {}
+        for row in users:
+            self._set_user(row)
+        self._revoked = {row["token_id"]: row["expires_at"] for row in revoked}
+        self._seq = seq
+        self.reloads += 1
+
+    def _catch_up(self, conn: sqlite3.Connection) -> bool:
+        """Apply auth_changes after our position; False when a full reload is needed instead."""
+        rows = conn.execute(
+            "SELECT seq, user_id, token_id, token_expires_at FROM auth_changes WHERE seq > ? ORDER BY seq",
+            (self._seq,),
+        ).fetchall()
+        if not rows:
+            return True
+        # 中间的记录已经被清理掉了
+        if rows[0]["seq"] > self._seq + 1:
+            return False
+        user_ids = set()
+        for row in rows:
+            if row["token_id"] is not None:
+                self._revoked[row["token_id"]] = row["token_expires_at"] or 0
+            elif row["user_id"] is not None:
+                user_ids.add(row["user_id"])
+            else:
+                return False
+        if user_ids:
+            found = conn.execute(
+                "SELECT * FROM users WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(sorted(user_ids)),),
+            ).fetchall()
+            for row in found:
+                self._set_user(row)
+            for user_id in user_ids - {row["id"] for row in found}:
+                self._drop_user(user_id)
+        now = _now_ts()
+        for token_id in [t for t, expires_at in self._revoked.items() if expires_at <= now]:
+            del self._revoked[token_id]
+        self._seq = rows[-1]["seq"]
+        self.updates += 1
+        return True
+
+    def _sync(self) -> None:
+        now = time.monotonic()
+        if self._version is not None and now - self._version_checked_at < self.version_check:
+            return
+        with self._lock:
+            if self._version is not None and time.monotonic() - self._version_checked_at < self.version_check:
+                return
+            with db_conn() as conn:
+                version = conn.execute("SELECT version FROM auth_state WHERE id = 1").fetchone()["version"]
+                self._version_checked_at = time.monotonic()
+                if version == self._version:
+                    return
+                if self._seq is None or not self._catch_up(conn):
+                    self._reload(conn)
+            self._version = version
+
+    def _load_user(self, user_id: int) -> None:
+        # 进程启动后才注册的用户，按主键单独加载一次
+        with self._lock:
+            if user_id in self._epochs:
+                return
+            with db_conn() as conn:
+                row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+            if row is not None:
+                self._set_user(row)
+
+    def lookup(self, user_id: int, epoch: int, token_id: str) -> Optional[dict]:
+        self._sync()
+        if user_id not in self._epochs:
+            self._load_user(user_id)
+        if self._epochs.get(user_id) != epoch or token_id in self._revoked:
+            return None
+        user = self._users.get(user_id)
+        return dict(user) if user is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "revoked": len(self._revoked),
+            "version": self._version,
+            "seq": self._seq,
+            "reloads": self.reloads,
+            "updates": self.updates,
+        }
+
+
+epoch_table = EpochTable()
+
+
+class CountCache:
+    """Short-lived COUNT(*) results keyed by (list name, owner id)."""
+
+    def __init__(self, ttl: float = COUNT_CACHE_TTL, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, conn: sqlite3.Connection, key: tuple, sql: str, params: tuple) -> int:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                return entry[0]
+        total = conn.execute(sql, params).fetchone()["total"]
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[key] = (total, now + self.ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return total
+
+    def invalidate(self, key: tuple) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+count_cache = CountCache()
+
+
+def _encode_cursor(values: list) -> str:
+    return _b64encode(json.dumps(values, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(_b64decode(cursor))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(400, "无效的分页游标")
+    return values
+
+
+def _page_result(items: list, rows: list, page_size: int, cursor_of, total: Optional[int]) -> dict:
+    """Common list response: items, next_cursor, and total / page_count when counted."""
+    data = {
+        "items": items,
+        "next_cursor": _encode_cursor(cursor_of(rows[page_size - 1])) if len(rows) > page_size else None,
+    }
+    if total is not None:
+        data["total"] = total
+        data["page_count"] = math.ceil(total / page_size) if total else 0
+    return data
+
 
+def _bump_auth_version(conn: sqlite3.Connection) -> None:
+    conn.execute("UPDATE auth_state SET version = version + 1 WHERE id = 1")
 
-def _hash_password(password: str, salt_hex: Optional[str] = None) -> tuple[str, str]:
+
+def _record_auth_change(
+    conn: sqlite3.Connection,
+    user_id: Optional[int] = None,
+    token_id: Optional[str] = None,
+    token_expires_at: Optional[int] = None,
+) -> None:
+    """Log a changed user or a revoked token for other workers; neither means reload everything."""
+    conn.execute(
+        "INSERT INTO auth_changes (user_id, token_id, token_expires_at, changed_at) VALUES (?, ?, ?, ?)",
+        (user_id, token_id, token_expires_at, _now_ts()),
+    )
+    _bump_auth_version(conn)
+
+
+def _revoke_token(conn: sqlite3.Connection, token_id: str, expires_at: int) -> None:
+    conn.execute(
+        "INSERT OR IGNORE INTO revoked_tokens (token_id, expires_at) VALUES (?, ?)",
+        (token_id, expires_at),
+    )
+    _record_auth_change(conn, token_id=token_id, token_expires_at=expires_at)
+
+
+def _signed_session_key(sid: str) -> str:
+    """sessions.token / revoked_tokens.token_id of a signed token."""
+    return f"{SIGNED_TOKEN_PREFIX}:{sid}"
+
+
+def _revoke_user_tokens(conn: sqlite3.Connection, user_id: int) -> None:
+    conn.execute("UPDATE users SET token_epoch = token_epoch + 1 WHERE id = ?", (user_id,))
+
+
+def _after_auth_change(user_id: int) -> None:
+    session_cache.invalidate_user(user_id)
+    epoch_table.invalidate()
+
+
+def _get_token_secret() -> bytes:
+    global _token_secret
+    if _token_secret is None:
+        env_secret = os.getenv("SITE_TOKEN_SECRET", "")
+        if env_secret:
+            _token_secret = env_secret.encode("utf-8")
+        else:
+            with db_conn() as conn:
+                row = conn.execute("SELECT token_secret FROM auth_state WHERE id = 1").fetchone()
+            _token_secret = bytes.fromhex(row["token_secret"])
+    return _token_secret
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(_get_token_secret(), payload.encode("ascii"), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+
+def issue_signed_token(row, token_id: str, expires_at: int) -> str:
+    payload = _b64encode(json.dumps(
+        {
+            "uid": row["id"],
+            "adm": int(bool(row["is_admin"])),
+            "exp": expires_at,
+            "ep": row["token_epoch"],
+            "sid": token_id,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8"))
+    body = f"{SIGNED_TOKEN_PREFIX}.{payload}"
+    return f"{body}.{_sign(body)}"
+
+
+def _decode_signed_token(token: str) -> Optional[dict]:
+    """Claims of a well-formed, correctly signed token (expiry not checked)."""
+    parts = token.split(".")
+    if len(parts) != 3 or parts[0] != SIGNED_TOKEN_PREFIX:
+        return None
+    body = f"{parts[0]}.{parts[1]}"
+    if not hmac.compare_digest(_sign(body), parts[2]):
+        return None
+    try:
+        claims = json.loads(_b64decode(parts[1]))
+        return {
+            "uid": int(claims["uid"]),
+            "adm": bool(claims["adm"]),
+            "exp": int(claims["exp"]),
+            "ep": int(claims["ep"]),
+            "sid": str(claims["sid"]),
+        }
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def is_signed_token(token: str) -> bool:
+    return token.startswith(SIGNED_TOKEN_PREFIX + ".")
+
+
+def _hash_password(
+    password: str,
+    salt_hex: Optional[str] = None,
+    iterations: int = PASSWORD_ITERATIONS,
+) -> tuple[str, str]:
     salt = bytes.fromhex(salt_hex) if salt_hex else os.urandom(16)
-    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 120000)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
     return salt.hex(), digest.hex()
 
 
-def _verify_password(password: str, salt_hex: str, password_hash: str) -> bool:
-    _, candidate = _hash_password(password, salt_hex)
-    return hmac.compare_digest(candidate, password_hash)
+def _new_password_hash(password: str) -> tuple[str, str, str, int]:
+    """(salt, hash, algorithm, iterations) with the current parameters."""
+    salt_hex, password_hash = _hash_password(password)
+    return salt_hex, password_hash, PASSWORD_ALGORITHM, PASSWORD_ITERATIONS
+
+
+def _verify_password(password: str, row) -> bool:
+    if row["password_algo"] != PASSWORD_ALGORITHM:
+        return False
+    _, candidate = _hash_password(password, row["password_salt"], row["password_iterations"])
+    return hmac.compare_digest(candidate, row["password_hash"])
+
+
+def _needs_rehash(row) -> bool:
+    return row["password_algo"] != PASSWORD_ALGORITHM or row["password_iterations"] != PASSWORD_ITERATIONS
+
+
+_hash_executor: Optional[ThreadPoolExecutor] = None
+_hash_pending = 0
+
+
+async def _run_password_hash(func, *args):
+    """Run PBKDF2 work on the dedicated hash pool, rejecting when the queue is full."""
+    global _hash_executor, _hash_pending
+    if _hash_pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(429, "登录请求过多，请稍后再试")
+    if _hash_executor is None:
+        _hash_executor = ThreadPoolExecutor(PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+    finally:
+        _hash_pending -= 1
+
+
+class LoginThrottle:
+    """Sliding-window count of failed logins per client IP, per IP and username, and per username."""
+
+    def __init__(
+        self,
+        window: float = LOGIN_THROTTLE_WINDOW,
+        max_per_ip: int = LOGIN_MAX_FAILURES_PER_IP,
+        max_per_user: int = LOGIN_MAX_FAILURES_PER_USER,
+        max_per_account: int = LOGIN_MAX_FAILURES_PER_ACCOUNT,
+        max_keys: int = 10000,
+    ):
+        self.window = window
+        self.max_per_ip = max_per_ip
+        self.max_per_user = max_per_user
+        self.max_per_account = max_per_account
+        self.max_keys = max_keys
+        self._failures: OrderedDict[str, deque[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _keys(self, ip: str, username: str) -> list[tuple[str, int]]:
+        username = _normalize_username(username).lower()
+        return [
+            (f"ip:{ip}", self.max_per_ip),
+            (f"user:{ip}:{username}", self.max_per_user),
+            (f"account:{username}", self.max_per_account),
+        ]
+
+    def retry_after(self, ip: str, username: str) -> float:
+        """Seconds until another attempt is allowed, 0 when not throttled."""
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for key, limit in self._keys(ip, username):
+                failures = self._failures.get(key)
+                if not failures:
+                    continue
+                while failures and failures[0] <= now - self.window:
+                    failures.popleft()
+                if limit > 0 and len(failures) >= limit:
+                    wait = max(wait, failures[0] + self.window - now)
+        return wait
+
+    def record_failure(self, ip: str, username: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for key, _ in self._keys(ip, username):
+                failures = self._failures.setdefault(key, deque())
+                failures.append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def record_success(self, ip: str, username: str) -> None:
+        with self._lock:
+            self._failures.pop(self._keys(ip, username)[1][0], None)
+
+
+login_throttle = LoginThrottle()
 
 
 def _normalize_username(username: str) -> str:
@@ -71,10 +885,54 @@ def _avatar_url(user_id: int, avatar_updated_at: Optional[int]) -> str:
     return f"/api/users/{user_id}/avatar?v={avatar_updated_at}"
 
 
-def get_avatar_path(user_id: int) -> Path:
+def _legacy_avatar_path(user_id: int) -> Path:
     return AVATAR_DIR / f"user_{user_id}.jpg"
 
 
+def _avatar_variant_path(user_id: int, version: int, size: int, fmt: str) -> Path:
+    return AVATAR_DIR / f"user_{user_id}_{version}_{size}.{fmt}"
+
+
+def resolve_avatar(user_id: int, version: Optional[int], size: int, fmt: str) -> Optional[tuple[Path, str, bool]]:
+    """(path, media type, immutable) of the closest avatar variant, or None when the user has none."""
+    size = next((candidate for candidate in AVATAR_SIZES if candidate >= size), AVATAR_SIZES[-1])
+    formats = (fmt, "jpg") if fmt != "jpg" else ("jpg",)
+    # 带版本号且文件存在时，内容永远不会再变
+    if version:
+        for candidate in formats:
+            path = _avatar_variant_path(user_id, version, size, candidate)
+            if path.exists():
+                return path, AVATAR_FORMATS[candidate], True
+
+    with db_read() as conn:
+        row = conn.execute("SELECT avatar_updated_at FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not row or not row["avatar_updated_at"]:
+        return None
+    for candidate in formats:
+        path = _avatar_variant_path(user_id, row["avatar_updated_at"], size, candidate)
+        if path.exists():
+            return path, AVATAR_FORMATS[candidate], False
+    # 改成多尺寸之前上传的头像只有一张 256px JPEG
+    legacy_path = _legacy_avatar_path(user_id)
+    if legacy_path.exists():
+        return legacy_path, AVATAR_FORMATS["jpg"], False
+    return None
+
+
+def _remove_avatar_files(user_id: int, keep_version: Optional[int] = None) -> None:
+    paths = [_legacy_avatar_path(user_id), *AVATAR_DIR.glob(f"user_{user_id}_*")]
+    keep_prefix = f"user_{user_id}_{keep_version}_"
+    for path in paths:
+        if keep_version is not None and path.name.startswith(keep_prefix):
+            continue
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            traceback.print_exc()
+
+
 def _serialize_user(row) -> dict:
     return {
         "id": row["id"],
@@ -157,10 +1015,78 @@ def _active_admin_count(conn: sqlite3.Connection) -> int:
     ).fetchone()["total"]
 
 
+def _init_sync_log(conn: sqlite3.Connection) -> None:
+    created = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sync_changes'"
+    ).fetchone() is None
+    # AUTOINCREMENT 保证序号不复用；触发器先删后插，每个条目只留最新一条
+    # （不能用 INSERT OR REPLACE：外层 UPSERT 的冲突策略会覆盖触发器里的 OR REPLACE）
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            op TEXT NOT NULL,
+            changed_at INTEGER NOT NULL,
+            UNIQUE (user_id, kind, item_key)
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sync_changes_user_seq ON sync_changes(user_id, seq)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sync_changes_tombstones ON sync_changes(changed_at) WHERE op = 'delete'"
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            pruned_seq INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO sync_state (id, pruned_seq) VALUES (1, 0)")
+    # 每个用户清理到的最大墓碑序号；sync_state 里的全局值是改成按用户记录之前留下的，不再更新，只作下限
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sync_pruned (
+            user_id INTEGER PRIMARY KEY,
+            pruned_seq INTEGER NOT NULL
+        )
+        """
+    )
+
+    for kind, (table, key_column) in SYNC_KINDS.items():
+        for event, row, op in (("INSERT", "NEW", "upsert"), ("UPDATE", "NEW", "upsert"), ("DELETE", "OLD", "delete")):
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_sync_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    DELETE FROM sync_changes
+                    WHERE user_id = {row}.user_id AND kind = '{kind}' AND item_key = {row}.{key_column};
+                    INSERT INTO sync_changes (user_id, kind, item_key, op, changed_at)
+                    VALUES ({row}.user_id, '{kind}', {row}.{key_column}, '{op}', CAST(strftime('%s', 'now') AS INTEGER));
+                END
+                """
+            )
+        if created:
+            # 建表前已有的数据补记一次，让 since=0 的全量同步完整
+            conn.execute(
+                f"""
+                INSERT OR IGNORE INTO sync_changes (user_id, kind, item_key, op, changed_at)
+                SELECT user_id, '{kind}', {key_column}, 'upsert', ? FROM {table}
+                """,
+                (_now_ts(),),
+            )
+
+
 def init_site_storage() -> None:
     _ensure_db_target()
     with db_conn() as conn:
-        conn.execute("PRAGMA journal_mode = WAL")
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -168,9 +1094,12 @@ def init_site_storage() -> None:
                 username TEXT NOT NULL UNIQUE,
                 password_salt TEXT NOT NULL,
                 password_hash TEXT NOT NULL,
+                password_algo TEXT NOT NULL DEFAULT 'pbkdf2_sha256',
+                password_iterations INTEGER NOT NULL DEFAULT 120000,
                 is_admin INTEGER NOT NULL DEFAULT 0,
                 is_active INTEGER NOT NULL DEFAULT 1,
                 avatar_updated_at INTEGER,
+                token_epoch INTEGER NOT NULL DEFAULT 0,
                 created_at INTEGER NOT NULL,
                 updated_at INTEGER NOT NULL
             )
@@ -187,6 +1116,44 @@ def init_site_storage() -> None:
             )
             """
         )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS auth_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                token_secret TEXT
+            )
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO auth_state (id, version) VALUES (1, 0)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS backup_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_started_at INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO backup_state (id, last_started_at) VALUES (1, 0)")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                token_id TEXT PRIMARY KEY,
+                expires_at INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS auth_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                token_id TEXT,
+                token_expires_at INTEGER,
+                changed_at INTEGER NOT NULL
+            )
+            """
+        )
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS favorites (
@@ -254,6 +1221,14 @@ def init_site_storage() -> None:
             )
             """
         )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS comment_versions (
+                album_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+            """
+        )
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS user_cache_items (
@@ -276,25 +1251,59 @@ def init_site_storage() -> None:
             conn.execute(
                 "ALTER TABLE users ADD COLUMN avatar_updated_at INTEGER"
             )
+        if "password_algo" not in _table_columns(conn, "users"):
+            conn.execute(
+                "ALTER TABLE users ADD COLUMN password_algo TEXT NOT NULL DEFAULT 'pbkdf2_sha256'"
+            )
+        if "password_iterations" not in _table_columns(conn, "users"):
+            conn.execute(
+                f"ALTER TABLE users ADD COLUMN password_iterations INTEGER NOT NULL DEFAULT {LEGACY_PASSWORD_ITERATIONS}"
+            )
+        if "token_epoch" not in _table_columns(conn, "users"):
+            conn.execute(
+                "ALTER TABLE users ADD COLUMN token_epoch INTEGER NOT NULL DEFAULT 0"
+            )
+        if "token_secret" not in _table_columns(conn, "auth_state"):
+            conn.execute("ALTER TABLE auth_state ADD COLUMN token_secret TEXT")
+        conn.execute(
+            "UPDATE auth_state SET token_secret = ? WHERE id = 1 AND token_secret IS NULL",
+            (secrets.token_hex(32),),
+        )
 
         conn.execute(
             "CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id)"
         )
         conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_favorites_user_updated ON favorites(user_id, updated_at DESC)"
+            "CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens(expires_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_auth_changes_changed_at ON auth_changes(changed_at)"
+        )
+        # 列表的游标分页按完整排序键走索引，替换掉只有时间列的旧索引
+        conn.execute("DROP INDEX IF EXISTS idx_favorites_user_updated")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_favorites_user_keyset "
+            "ON favorites(user_id, updated_at DESC, created_at DESC, album_id DESC)"
         )
+        conn.execute("DROP INDEX IF EXISTS idx_history_user_updated")
         conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_history_user_updated ON history(user_id, last_read_at DESC)"
+            "CREATE INDEX IF NOT EXISTS idx_history_user_keyset ON history(user_id, last_read_at DESC, album_id DESC)"
         )
         conn.execute(
             "CREATE INDEX IF NOT EXISTS idx_progress_user_album_updated ON chapter_progress(user_id, album_id, updated_at DESC)"
         )
+        conn.execute("DROP INDEX IF EXISTS idx_comments_album_parent_created")
         conn.execute(
-            "CREATE INDEX IF NOT EXISTS idx_comments_album_parent_created ON comments(album_id, parent_id, created_at DESC)"
+            "CREATE INDEX IF NOT EXISTS idx_comments_album_parent_keyset "
+            "ON comments(album_id, parent_id, created_at DESC, id DESC)"
         )
         conn.execute(
             "CREATE INDEX IF NOT EXISTS idx_user_cache_items_user_album ON user_cache_items(user_id, album_id, updated_at DESC)"
         )
+        _init_sync_log(conn)
 
         admin = conn.execute(
             "SELECT id FROM users WHERE username = ?",
@@ -302,13 +1311,15 @@ def init_site_storage() -> None:
         ).fetchone()
         if not admin:
             now = _now_ts()
-            salt_hex, password_hash = _hash_password("wyq666")
             conn.execute(
                 """
-                INSERT INTO users (username, password_salt, password_hash, is_admin, is_active, created_at, updated_at)
-                VALUES (?, ?, ?, 1, 1, ?, ?)
+                INSERT INTO users (
+                    username, password_salt, password_hash, password_algo, password_iterations,
+                    is_admin, is_active, created_at, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, 1, 1, ?, ?)
                 """,
-                ("admin", salt_hex, password_hash, now, now),
+                ("admin", *_new_password_hash("wyq666"), now, now),
             )
 
 
@@ -320,15 +1331,18 @@ def create_user(username: str, password: str, is_admin: bool = False) -> dict:
         raise HTTPException(400, "密码至少 6 位")
 
     now = _now_ts()
-    salt_hex, password_hash = _hash_password(password)
+    password_columns = _new_password_hash(password)
     try:
         with db_conn() as conn:
             cur = conn.execute(
                 """
-                INSERT INTO users (username, password_salt, password_hash, is_admin, is_active, created_at, updated_at)
-                VALUES (?, ?, ?, ?, 1, ?, ?)
+                INSERT INTO users (
+                    username, password_salt, password_hash, password_algo, password_iterations,
+                    is_admin, is_active, created_at, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
                 """,
-                (normalized, salt_hex, password_hash, int(is_admin), now, now),
+                (normalized, *password_columns, int(is_admin), now, now),
             )
             row = conn.execute(
                 "SELECT * FROM users WHERE id = ?",
@@ -381,13 +1395,17 @@ def update_user(
             """,
             (int(next_is_admin), int(next_is_active), _now_ts(), target_user_id),
         )
+        _bump_user_comment_versions(conn, target_user_id)
         if not next_is_active:
             conn.execute("DELETE FROM sessions WHERE user_id = ?", (target_user_id,))
+            _revoke_user_tokens(conn, target_user_id)
+        _record_auth_change(conn, target_user_id)
         row = conn.execute(
             "SELECT * FROM users WHERE id = ?",
             (target_user_id,),
         ).fetchone()
-        return _serialize_user(row)
+    _after_auth_change(target_user_id)
+    return _serialize_user(row)
 
 
 def reset_user_password(actor_user_id: int, target_user_id: int, new_password: str) -> dict:
@@ -402,60 +1420,120 @@ def reset_user_password(actor_user_id: int, target_user_id: int, new_password: s
         if not target:
             raise HTTPException(404, "用户不存在")
 
-        salt_hex, password_hash = _hash_password(new_password)
         conn.execute(
             """
             UPDATE users
-            SET password_salt = ?, password_hash = ?, updated_at = ?
+            SET password_salt = ?, password_hash = ?, password_algo = ?, password_iterations = ?, updated_at = ?
             WHERE id = ?
             """,
-            (salt_hex, password_hash, _now_ts(), target_user_id),
+            (*_new_password_hash(new_password), _now_ts(), target_user_id),
         )
         if actor_user_id != target_user_id:
             conn.execute("DELETE FROM sessions WHERE user_id = ?", (target_user_id,))
+            _revoke_user_tokens(conn, target_user_id)
+        _record_auth_change(conn, target_user_id)
         row = conn.execute(
             "SELECT * FROM users WHERE id = ?",
             (target_user_id,),
         ).fetchone()
-        return _serialize_user(row)
+    _after_auth_change(target_user_id)
+    return _serialize_user(row)
+
 
+_avatar_executor: Optional[ThreadPoolExecutor] = None
+_avatar_pending = 0
 
-def set_user_avatar(user_id: int, image_bytes: bytes) -> dict:
+
+def _render_avatar(user_id: int, version: int, image_bytes: bytes) -> None:
+    """Decode once and write every size in every format, named after the new version."""
     try:
         from io import BytesIO
-        from PIL import Image, ImageOps
+        from PIL import Image, ImageOps, features
     except ImportError as exc:
         raise HTTPException(500, "头像处理依赖未安装") from exc
 
-    if len(image_bytes) > 5 * 1024 * 1024:
-        raise HTTPException(400, "头像文件不能超过 5MB")
-
+    largest = AVATAR_SIZES[-1]
     try:
         image = Image.open(BytesIO(image_bytes))
+        # JPEG 直接按缩小的尺寸解码，大照片省掉大部分解码时间
+        image.draft("RGB", (largest * 2, largest * 2))
         image = ImageOps.exif_transpose(image)
+        base = ImageOps.fit(image.convert("RGB"), (largest, largest), method=Image.Resampling.LANCZOS)
     except Exception as exc:
         raise HTTPException(400, "无法识别的图片文件") from exc
 
-    image = ImageOps.fit(image.convert("RGB"), (256, 256), method=Image.Resampling.LANCZOS)
-    avatar_path = get_avatar_path(user_id)
-    avatar_path.parent.mkdir(parents=True, exist_ok=True)
-    image.save(avatar_path, format="JPEG", quality=90, optimize=True)
+    formats = ("webp", "jpg") if features.check("webp") else ("jpg",)
+    AVATAR_DIR.mkdir(parents=True, exist_ok=True)
+    for size in AVATAR_SIZES:
+        variant = base if size == largest else base.resize((size, size), Image.Resampling.LANCZOS)
+        for fmt in formats:
+            path = _avatar_variant_path(user_id, version, size, fmt)
+            tmp_path = path.with_name(path.name + ".tmp")
+            if fmt == "webp":
+                variant.save(tmp_path, format="WEBP", quality=AVATAR_QUALITY, method=4)
+            else:
+                variant.save(tmp_path, format="JPEG", quality=AVATAR_QUALITY, optimize=True, progressive=True)
+            tmp_path.replace(path)
+
+
+async def _run_avatar_job(func, *args):
+    """Run image work on the dedicated avatar pool, rejecting when the queue is full."""
+    global _avatar_executor, _avatar_pending
+    if _avatar_pending >= AVATAR_WORKERS + AVATAR_MAX_PENDING:
+        raise HTTPException(429, "头像处理繁忙，请稍后再试")
+    if _avatar_executor is None:
+        _avatar_executor = ThreadPoolExecutor(AVATAR_WORKERS, thread_name_prefix="avatar")
+    _avatar_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_avatar_executor, func, *args)
+    finally:
+        _avatar_pending -= 1
 
-    now = _now_ts()
+
+def _next_avatar_version(user_id: int) -> int:
+    with db_read() as conn:
+        row = conn.execute("SELECT avatar_updated_at FROM users WHERE id = ?", (user_id,)).fetchone()
+    if not row:
+        raise HTTPException(404, "用户不存在")
+    # 同一秒内连续上传也要换文件名，否则缓存的旧图不会失效
+    return max(_now_ts(), (row["avatar_updated_at"] or 0) + 1)
+
+
+def _store_avatar_version(user_id: int, version: int) -> dict:
     with db_conn() as conn:
         conn.execute(
             "UPDATE users SET avatar_updated_at = ?, updated_at = ? WHERE id = ?",
-            (now, now, user_id),
+            (version, _now_ts(), user_id),
         )
+        _bump_user_comment_versions(conn, user_id)
+        _record_auth_change(conn, user_id)
         row = conn.execute(
             "SELECT * FROM users WHERE id = ?",
             (user_id,),
         ).fetchone()
+    _after_auth_change(user_id)
     if not row:
+        _remove_avatar_files(user_id)
         raise HTTPException(404, "用户不存在")
+    _remove_avatar_files(user_id, keep_version=version)
     return _serialize_user(row)
 
 
+async def set_user_avatar(user_id: int, image_bytes: bytes) -> dict:
+    if len(image_bytes) > AVATAR_MAX_BYTES:
+        raise HTTPException(400, "头像文件不能超过 5MB")
+
+    version = await asyncio.to_thread(_next_avatar_version, user_id)
+    try:
+        await _run_avatar_job(_render_avatar, user_id, version, image_bytes)
+    except Exception:
+        # 已经写出的部分尺寸用不上了
+        for path in AVATAR_DIR.glob(f"user_{user_id}_{version}_*"):
+            path.unlink(missing_ok=True)
+        raise
+    return await asyncio.to_thread(_store_avatar_version, user_id, version)
+
+
 def change_password(user_id: int, current_password: str, new_password: str) -> dict:
     if len(new_password) < 6:
         raise HTTPException(400, "密码至少 6 位")
@@ -467,24 +1545,26 @@ def change_password(user_id: int, current_password: str, new_password: str) -> d
         ).fetchone()
         if not row:
             raise HTTPException(404, "用户不存在")
-        if not _verify_password(current_password, row["password_salt"], row["password_hash"]):
+        if not _verify_password(current_password, row):
             raise HTTPException(400, "当前密码不正确")
 
-        salt_hex, password_hash = _hash_password(new_password)
         conn.execute(
             """
             UPDATE users
-            SET password_salt = ?, password_hash = ?, updated_at = ?
+            SET password_salt = ?, password_hash = ?, password_algo = ?, password_iterations = ?, updated_at = ?
             WHERE id = ?
             """,
-            (salt_hex, password_hash, _now_ts(), user_id),
+            (*_new_password_hash(new_password), _now_ts(), user_id),
         )
         conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        _revoke_user_tokens(conn, user_id)
+        _record_auth_change(conn, user_id)
         updated = conn.execute(
             "SELECT * FROM users WHERE id = ?",
             (user_id,),
         ).fetchone()
-        return _serialize_user(updated)
+    _after_auth_change(user_id)
+    return _serialize_user(updated)
 
 
 def delete_user(actor_user_id: int, target_user_id: int) -> None:
@@ -500,31 +1580,211 @@ def delete_user(actor_user_id: int, target_user_id: int) -> None:
         if bool(target["is_admin"]) and bool(target["is_active"]) and _active_admin_count(conn) <= 1:
             raise HTTPException(400, "至少需要保留一个启用中的管理员账号")
 
+        # 评论随用户级联删除，先让涉及的评论区缓存失效
+        _bump_user_comment_versions(conn, target_user_id)
         conn.execute("DELETE FROM users WHERE id = ?", (target_user_id,))
+        conn.execute("DELETE FROM sync_changes WHERE user_id = ?", (target_user_id,))
+        conn.execute("DELETE FROM sync_pruned WHERE user_id = ?", (target_user_id,))
+        _record_auth_change(conn, target_user_id)
+    _after_auth_change(target_user_id)
+    _remove_avatar_files(target_user_id)
 
 
-def authenticate_user(username: str, password: str) -> Optional[dict]:
-    normalized = _normalize_username(username)
+def _find_login_user(username: str):
     with db_conn() as conn:
-        row = conn.execute(
+        return conn.execute(
             "SELECT * FROM users WHERE username = ?",
-            (normalized,),
+            (_normalize_username(username),),
         ).fetchone()
-        if not row or not _verify_password(password, row["password_salt"], row["password_hash"]):
-            return None
-        if not bool(row["is_active"]):
-            return None
 
+
+def _store_password_hash(user_id: int, salt_hex: str, password_hash: str, algo: str, iterations: int) -> None:
+    with db_conn() as conn:
+        conn.execute(
+            """
+            UPDATE users
+            SET password_salt = ?, password_hash = ?, password_algo = ?, password_iterations = ?
+            WHERE id = ?
+            """,
+            (salt_hex, password_hash, algo, iterations, user_id),
+        )
+
+
+def _evict_sessions(conn: sqlite3.Connection, user_id: int, keep: int) -> list[str]:
+    """Delete all but the newest `keep` sessions of a user and revoke their signed tokens."""
+    rows = conn.execute(
+        """
+        SELECT token, expires_at
+        FROM sessions
+        WHERE user_id = ?
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT -1 OFFSET ?
+        """,
+        (user_id, keep),
+    ).fetchall()
+    if not rows:
+        return []
+    conn.executemany("DELETE FROM sessions WHERE token = ?", [(row["token"],) for row in rows])
+    # 签名令牌不查 sessions 表，要记入 revoked_tokens 才会失效
+    now = _now_ts()
+    for row in rows:
+        if row["expires_at"] > now:
+            _revoke_token(conn, row["token"], row["expires_at"])
+    _bump_auth_version(conn)
+    return [row["token"] for row in rows]
+
+
+def _create_session(row) -> dict:
+    evicted: list[str] = []
+    with db_conn() as conn:
         token = secrets.token_urlsafe(32)
         now = _now_ts()
+        expires_at = now + SESSION_TTL_SECONDS
+        # 签名令牌在 sessions 里仍保存一条记录（用于会话数上限），键是 sid 而不是可用的 token
+        session_key = _signed_session_key(token) if SITE_SIGNED_TOKENS else token
         conn.execute(
             """
             INSERT INTO sessions (token, user_id, created_at, expires_at)
             VALUES (?, ?, ?, ?)
             """,
-            (token, row["id"], now, now + SESSION_TTL_SECONDS),
+            (session_key, row["id"], now, expires_at),
         )
-        return {"token": token, "user": _serialize_user(row)}
+        if SESSION_MAX_PER_USER > 0:
+            evicted = _evict_sessions(conn, row["id"], SESSION_MAX_PER_USER)
+        if SITE_SIGNED_TOKENS:
+            token = issue_signed_token(row, token, expires_at)
+    if evicted:
+        for evicted_token in evicted:
+            session_cache.invalidate_token(evicted_token)
+        epoch_table.invalidate()
+    return {"token": token, "user": _serialize_user(row)}
+
+
+class SessionReaper:
+    """Deletes expired sessions, revoked token ids and old sync tombstones in small batches."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.last_run_at: Optional[int] = None
+        self.sessions_deleted = 0
+        self.revoked_deleted = 0
+        self.tombstones_deleted = 0
+
+    @staticmethod
+    def _reap_batch(conn: sqlite3.Connection, table: str) -> int:
+        return conn.execute(
+            f"""
+            DELETE FROM {table}
+            WHERE rowid IN (SELECT rowid FROM {table} WHERE expires_at <= ? LIMIT ?)
+            """,
+            (_now_ts(), SESSION_REAP_BATCH),
+        ).rowcount
+
+    @staticmethod
+    def _prune_auth_changes(conn: sqlite3.Connection) -> int:
+        return conn.execute(
+            """
+            DELETE FROM auth_changes
+            WHERE seq IN (SELECT seq FROM auth_changes WHERE changed_at <= ? LIMIT ?)
+            """,
+            (_now_ts() - AUTH_CHANGE_RETENTION, SESSION_REAP_BATCH),
+        ).rowcount
+
+    async def reap(self) -> int:
+        deleted = 0
+        for table in ("sessions", "revoked_tokens"):
+            while True:
+                # 每批单独提交，不长时间占住写锁
+                count = await db_write_async(self._reap_batch, table)
+                deleted += count
+                if table == "sessions":
+                    self.sessions_deleted += count
+                else:
+                    self.revoked_deleted += count
+                if count < SESSION_REAP_BATCH:
+                    break
+                await asyncio.sleep(0)
+        # 各 worker 早已读过的 auth_changes
+        while True:
+            count = await db_write_async(self._prune_auth_changes)
+            deleted += count
+            if count < SESSION_REAP_BATCH:
+                break
+            await asyncio.sleep(0)
+        # 同步日志里过期的删除墓碑也在这里分批清理
+        while True:
+            count = await db_write_async(_prune_sync_tombstones, SESSION_REAP_BATCH)
+            deleted += count
+            self.tombstones_deleted += count
+            if count < SESSION_REAP_BATCH:
+                break
+            await asyncio.sleep(0)
+        self.last_run_at = _now_ts()
+        return deleted
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                deleted = await self.reap()
+                if deleted:
+                    print(f"[backend] reaped {deleted} expired session and sync rows")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(SESSION_REAP_INTERVAL)
+
+    def start(self) -> None:
+        if SESSION_REAP_INTERVAL <= 0 or SESSION_REAP_BATCH <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": SESSION_REAP_INTERVAL,
+            "max_per_user": SESSION_MAX_PER_USER,
+            "last_run_at": self.last_run_at,
+            "sessions_deleted": self.sessions_deleted,
+            "revoked_deleted": self.revoked_deleted,
+            "tombstones_deleted": self.tombstones_deleted,
+        }
+
+
+session_reaper = SessionReaper()
+
+
+def authenticate_user(username: str, password: str) -> Optional[dict]:
+    row = _find_login_user(username)
+    if not row or not _verify_password(password, row):
+        return None
+    if not bool(row["is_active"]):
+        return None
+    if _needs_rehash(row):
+        _store_password_hash(row["id"], *_new_password_hash(password))
+    return _create_session(row)
+
+
+async def authenticate_user_async(username: str, password: str) -> Optional[dict]:
+    """authenticate_user with the PBKDF2 work on the dedicated hash pool."""
+    row = await asyncio.to_thread(_find_login_user, username)
+    if not row or not await _run_password_hash(_verify_password, password, row):
+        return None
+    if not bool(row["is_active"]):
+        return None
+    if _needs_rehash(row):
+        password_columns = await _run_password_hash(_new_password_hash, password)
+        await asyncio.to_thread(_store_password_hash, row["id"], *password_columns)
+    return await asyncio.to_thread(_create_session, row)
 
 
 def extract_token(authorization: Optional[str]) -> Optional[str]:
@@ -542,16 +1802,48 @@ def extract_token(authorization: Optional[str]) -> Optional[str]:
 
 
 def delete_session(token: str) -> None:
+    if is_signed_token(token):
+        claims = _decode_signed_token(token)
+        if claims is None:
+            return
+        session_key = _signed_session_key(claims["sid"])
+        now = _now_ts()
+        with db_conn() as conn:
+            # 早期签发的令牌 sid 就是 sessions 里的随机 token，一并删掉
+            conn.execute("DELETE FROM sessions WHERE token IN (?, ?)", (session_key, claims["sid"]))
+            if claims["exp"] > now:
+                _revoke_token(conn, session_key, claims["exp"])
+        epoch_table.invalidate()
+        return
+
+    if token.startswith(SIGNED_TOKEN_PREFIX + ":"):
+        return
     with db_conn() as conn:
         conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+        _bump_auth_version(conn)
+    session_cache.invalidate_token(token)
 
 
 def get_user_by_token(token: str) -> Optional[dict]:
+    if is_signed_token(token):
+        claims = _decode_signed_token(token)
+        if claims is None or claims["exp"] <= _now_ts():
+            return None
+        return epoch_table.lookup(claims["uid"], claims["ep"], _signed_session_key(claims["sid"]))
+
+    # 签名令牌在 sessions 里的记录不是 token
+    if token.startswith(SIGNED_TOKEN_PREFIX + ":"):
+        return None
+
+    cached, generation = session_cache.get(token)
+    if cached is not None:
+        return dict(cached)
+
     now = _now_ts()
     with db_conn() as conn:
         row = conn.execute(
             """
-            SELECT users.*
+            SELECT users.*, sessions.expires_at AS session_expires_at
             FROM sessions
             JOIN users ON users.id = sessions.user_id
             WHERE sessions.token = ? AND sessions.expires_at > ?
@@ -562,7 +1854,9 @@ def get_user_by_token(token: str) -> Optional[dict]:
             if not bool(row["is_active"]):
                 conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
                 return None
-            return _serialize_user(row)
+            user = _serialize_user(row)
+            session_cache.put(token, dict(user), row["session_expires_at"], generation)
+            return user
         conn.execute(
             "DELETE FROM sessions WHERE token = ? OR expires_at <= ?",
             (token, now),
@@ -587,28 +1881,52 @@ def require_admin_user(authorization: Optional[str] = Header(None)) -> dict:
     return user
 
 
-def list_favorites(user_id: int, page: int, page_size: int) -> dict:
-    offset = (page - 1) * page_size
-    with db_conn() as conn:
-        total = conn.execute(
+def list_favorites(
+    user_id: int,
+    page: int,
+    page_size: int,
+    *,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+) -> dict:
+    """Page through favorites by page number, or by the next_cursor of the previous page."""
+    with db_read() as conn:
+        if cursor:
+            updated_at, created_at, album_id = _decode_cursor(cursor, 3)
+            rows = conn.execute(
+                """
+                SELECT *
+                FROM favorites
+                WHERE user_id = ? AND (updated_at, created_at, album_id) < (?, ?, ?)
+                ORDER BY updated_at DESC, created_at DESC, album_id DESC
+                LIMIT ?
+                """,
+                (user_id, updated_at, created_at, album_id, page_size + 1),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                """
+                SELECT *
+                FROM favorites
+                WHERE user_id = ?
+                ORDER BY updated_at DESC, created_at DESC, album_id DESC
+                LIMIT ? OFFSET ?
+                """,
+                (user_id, page_size + 1, (page - 1) * page_size),
+            ).fetchall()
+        total = count_cache.count(
+            conn,
+            ("favorites", user_id),
             "SELECT COUNT(*) AS total FROM favorites WHERE user_id = ?",
             (user_id,),
-        ).fetchone()["total"]
-        rows = conn.execute(
-            """
-            SELECT *
-            FROM favorites
-            WHERE user_id = ?
-            ORDER BY updated_at DESC, created_at DESC
-            LIMIT ? OFFSET ?
-            """,
-            (user_id, page_size, offset),
-        ).fetchall()
-    return {
-        "items": [_serialize_favorite(row) for row in rows],
-        "total": total,
-        "page_count": math.ceil(total / page_size) if total else 0,
-    }
+        ) if with_total else None
+    return _page_result(
+        [_serialize_favorite(row) for row in rows[:page_size]],
+        rows,
+        page_size,
+        lambda row: [row["updated_at"], row["created_at"], row["album_id"]],
+        total,
+    )
 
 
 def add_favorite(
@@ -619,7 +1937,8 @@ def add_favorite(
     cover: str = "",
 ) -> dict:
     now = _now_ts()
-    with db_conn() as conn:
+
+    def write(conn: sqlite3.Connection):
         conn.execute(
             """
             INSERT INTO favorites (user_id, album_id, title, author, cover, created_at, updated_at)
@@ -632,24 +1951,29 @@ def add_favorite(
             """,
             (user_id, album_id, title, author, cover, now, now),
         )
-        row = conn.execute(
+        return conn.execute(
             "SELECT * FROM favorites WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
         ).fetchone()
+
+    row = db_write(write)
+    count_cache.invalidate(("favorites", user_id))
     return _serialize_favorite(row)
 
 
 def remove_favorite(user_id: int, album_id: str) -> bool:
-    with db_conn() as conn:
-        cur = conn.execute(
+    deleted = db_write(
+        lambda conn: conn.execute(
             "DELETE FROM favorites WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
-        )
-        return cur.rowcount > 0
+        ).rowcount
+    )
+    count_cache.invalidate(("favorites", user_id))
+    return deleted > 0
 
 
 def get_favorite_status(user_id: int, album_id: str) -> dict:
-    with db_conn() as conn:
+    with db_read() as conn:
         row = conn.execute(
             "SELECT * FROM favorites WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
@@ -665,7 +1989,8 @@ def upsert_history(
     cover: str = "",
 ) -> dict:
     now = _now_ts()
-    with db_conn() as conn:
+
+    def write(conn: sqlite3.Connection):
         conn.execute(
             """
             INSERT INTO history (
@@ -682,53 +2007,87 @@ def upsert_history(
             """,
             (user_id, album_id, title, author, cover, now),
         )
-        row = conn.execute(
+        return conn.execute(
             "SELECT * FROM history WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
         ).fetchone()
+
+    row = db_write(write)
+    count_cache.invalidate(("history", user_id))
     return _serialize_history(row)
 
 
-def list_history(user_id: int, page: int, page_size: int) -> dict:
-    offset = (page - 1) * page_size
-    with db_conn() as conn:
-        total = conn.execute(
+def list_history(
+    user_id: int,
+    page: int,
+    page_size: int,
+    *,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+) -> dict:
+    """Page through history by page number, or by the next_cursor of the previous page."""
+    with db_read() as conn:
+        if cursor:
+            last_read_at, album_id = _decode_cursor(cursor, 2)
+            rows = conn.execute(
+                """
+                SELECT *
+                FROM history
+                WHERE user_id = ? AND (last_read_at, album_id) < (?, ?)
+                ORDER BY last_read_at DESC, album_id DESC
+                LIMIT ?
+                """,
+                (user_id, last_read_at, album_id, page_size + 1),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                """
+                SELECT *
+                FROM history
+                WHERE user_id = ?
+                ORDER BY last_read_at DESC, album_id DESC
+                LIMIT ? OFFSET ?
+                """,
+                (user_id, page_size + 1, (page - 1) * page_size),
+            ).fetchall()
+        total = count_cache.count(
+            conn,
+            ("history", user_id),
             "SELECT COUNT(*) AS total FROM history WHERE user_id = ?",
             (user_id,),
-        ).fetchone()["total"]
-        rows = conn.execute(
-            """
-            SELECT *
-            FROM history
-            WHERE user_id = ?
-            ORDER BY last_read_at DESC
-            LIMIT ? OFFSET ?
-            """,
-            (user_id, page_size, offset),
-        ).fetchall()
-    return {
-        "items": [_serialize_history(row) for row in rows],
-        "total": total,
-        "page_count": math.ceil(total / page_size) if total else 0,
-    }
+        ) if with_total else None
+    return _page_result(
+        [_serialize_history(row) for row in rows[:page_size]],
+        rows,
+        page_size,
+        lambda row: [row["last_read_at"], row["album_id"]],
+        total,
+    )
 
 
 def remove_history(user_id: int, album_id: str) -> bool:
-    with db_conn() as conn:
+    progress_buffer.discard(user_id, album_id)
+
+    def write(conn: sqlite3.Connection) -> int:
         conn.execute(
             "DELETE FROM chapter_progress WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
         )
-        cur = conn.execute(
+        return conn.execute(
             "DELETE FROM history WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
-        )
-        return cur.rowcount > 0
+        ).rowcount
+
+    deleted = db_write(write)
+    count_cache.invalidate(("history", user_id))
+    return deleted > 0
 
 
 def clear_history(user_id: int) -> dict:
-    with db_conn() as conn:
-        deleted_history = conn.execute(
+    progress_buffer.discard(user_id)
+
+    def write(conn: sqlite3.Connection) -> int:
+        deleted = conn.execute(
             "DELETE FROM history WHERE user_id = ?",
             (user_id,),
         ).rowcount
@@ -736,9 +2095,221 @@ def clear_history(user_id: int) -> dict:
             "DELETE FROM chapter_progress WHERE user_id = ?",
             (user_id,),
         )
+        return deleted
+
+    deleted_history = db_write(write)
+    count_cache.invalidate(("history", user_id))
     return {"cleared": deleted_history}
 
 
+_PROGRESS_SQL = """
+    INSERT INTO chapter_progress (
+        user_id, album_id, photo_id, chapter_title, chapter_sort, last_page, total_pages, updated_at
+    )
+    VALUES (:user_id, :album_id, :photo_id, :chapter_title, :chapter_sort, :last_page, :total_pages, :updated_at)
+    ON CONFLICT(user_id, photo_id) DO UPDATE SET
+        album_id = excluded.album_id,
+        chapter_title = excluded.chapter_title,
+        chapter_sort = excluded.chapter_sort,
+        last_page = excluded.last_page,
+        total_pages = excluded.total_pages,
+        updated_at = excluded.updated_at
+    WHERE excluded.updated_at >= chapter_progress.updated_at
+"""
+
+_PROGRESS_HISTORY_SQL = """
+    INSERT INTO history (
+        user_id, album_id, title, author, cover,
+        last_read_at, view_count, last_photo_id, last_photo_title, last_chapter_sort, last_page, total_pages
+    )
+    VALUES (
+        :user_id, :album_id, :album_title, :album_author, :cover,
+        :updated_at, 1, :photo_id, :chapter_title, :chapter_sort, :last_page, :total_pages
+    )
+    ON CONFLICT(user_id, album_id) DO UPDATE SET
+        title = CASE WHEN excluded.title <> '' THEN excluded.title ELSE history.title END,
+        author = CASE WHEN excluded.author <> '' THEN excluded.author ELSE history.author END,
+        cover = CASE WHEN excluded.cover <> '' THEN excluded.cover ELSE history.cover END,
+        last_read_at = excluded.last_read_at,
+        last_photo_id = excluded.last_photo_id,
+        last_photo_title = excluded.last_photo_title,
+        last_chapter_sort = excluded.last_chapter_sort,
+        last_page = excluded.last_page,
+        total_pages = excluded.total_pages
+    WHERE excluded.last_read_at >= history.last_read_at
+"""
+
+
+def _write_progress(conn: sqlite3.Connection, entries: list[dict]) -> int:
+    """Apply progress entries oldest first; entries older than the stored position are skipped."""
+    entries = sorted(entries, key=lambda entry: entry["updated_at"])
+    applied = conn.executemany(_PROGRESS_SQL, entries).rowcount
+    conn.executemany(_PROGRESS_HISTORY_SQL, entries)
+    return applied
+
+
+def _overlay_history(item: Optional[dict], entry: dict) -> dict:
+    """History item as it will look once a buffered progress entry is written."""
+    if item is None:
+        item = {
+            "id": entry["album_id"],
+            "album_id": entry["album_id"],
+            "title": entry["album_title"] or entry["album_id"],
+            "author": entry["album_author"],
+            "cover": _fallback_cover(entry["album_id"], entry["cover"]),
+            "view_count": 1,
+        }
+    else:
+        item = dict(item)
+        for key, source in (("title", "album_title"), ("author", "album_author")):
+            if entry[source]:
+                item[key] = entry[source]
+        if entry["cover"]:
+            item["cover"] = _fallback_cover(entry["album_id"], entry["cover"])
+    item.update(
+        visited_at=entry["updated_at"],
+        last_read_at=entry["updated_at"],
+        last_photo_id=entry["photo_id"],
+        last_photo_title=entry["chapter_title"],
+        last_chapter_sort=entry["chapter_sort"],
+        last_page=entry["last_page"],
+        total_pages=entry["total_pages"],
+    )
+    return item
+
+
+class ProgressBuffer:
+    """Coalesces reading progress per (user, photo) and writes it in batched transactions."""
+
+    def __init__(self):
+        self._pending: dict[tuple[int, str], dict] = {}
+        # 正在写入的批次，提交前读取仍要能看到
+        self._flushing: dict[tuple[int, str], dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+
+    def enabled(self) -> bool:
+        return PROGRESS_FLUSH_INTERVAL > 0
+
+    def put(self, entry: dict) -> None:
+        key = (entry["user_id"], entry["photo_id"])
+        with self._lock:
+            # 重新插入，字典顺序即更新顺序，同一秒内的多条也能分出先后
+            self._pending.pop(key, None)
+            self._pending[key] = entry
+            self.received += 1
+            pending = len(self._pending)
+        if pending >= PROGRESS_FLUSH_MAX_PENDING:
+            # 写入失败时进度已放回缓冲区，这次请求本身算成功，不把错误抛给客户端
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def entries_for(self, user_id: int, album_id: str) -> list[dict]:
+        """Buffered entries of one album, oldest first."""
+        return self.entries_for_albums(user_id, {album_id})
+
+    def entries_for_albums(self, user_id: int, album_ids: set[str]) -> list[dict]:
+        with self._lock:
+            merged = {**self._flushing, **self._pending}
+        return sorted(
+            (entry for (uid, _), entry in merged.items() if uid == user_id and entry["album_id"] in album_ids),
+            key=lambda entry: entry["updated_at"],
+        )
+
+    def discard(self, user_id: int, album_id: Optional[str] = None) -> None:
+        """Drop buffered entries so a removed history row is not written back."""
+        # 等正在进行的写入结束，避免它在删除之后才提交
+        with self._flush_lock, self._lock:
+            for key, entry in list(self._pending.items()):
+                if key[0] == user_id and (album_id is None or entry["album_id"] == album_id):
+                    del self._pending[key]
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, batch: list[dict]) -> set[int]:
+        # 批次里的用户可能已被删除，跳过这些记录，不让整批因外键失败
+        user_ids = sorted({entry["user_id"] for entry in batch})
+        existing = {
+            row["id"]
+            for row in conn.execute(
+                "SELECT id FROM users WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(user_ids),),
+            )
+        }
+        _write_progress(conn, [entry for entry in batch if entry["user_id"] in existing])
+        return existing
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+                batch = list(self._flushing.values())
+            try:
+                existing = db_write(self._write_batch, batch)
+            except Exception:
+                self.failures += 1
+                with self._lock:
+                    # 写入失败的进度放回去，期间收到的更新优先
+                    self._pending = {**self._flushing, **self._pending}
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+            self.flushes += 1
+            self.written += len(batch)
+        for user_id in existing:
+            count_cache.invalidate(("history", user_id))
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception:
+                traceback.print_exc()
+
+    def start(self) -> None:
+        if not self.enabled() or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        written = await asyncio.to_thread(self.flush)
+        if written:
+            print(f"[backend] flushed {written} buffered reading progress entries")
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "enabled": self.enabled(),
+            "pending": pending,
+            "received": self.received,
+            "written": self.written,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
+
+
+progress_buffer = ProgressBuffer()
+
+
 def save_reading_progress(
     user_id: int,
     album_id: str,
@@ -751,65 +2322,49 @@ def save_reading_progress(
     last_page: int = 0,
     total_pages: int = 0,
 ) -> dict:
-    now = _now_ts()
-    with db_conn() as conn:
-        conn.execute(
-            """
-            INSERT INTO chapter_progress (
-                user_id, album_id, photo_id, chapter_title, chapter_sort, last_page, total_pages, updated_at
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(user_id, photo_id) DO UPDATE SET
-                album_id = excluded.album_id,
-                chapter_title = excluded.chapter_title,
-                chapter_sort = excluded.chapter_sort,
-                last_page = excluded.last_page,
-                total_pages = excluded.total_pages,
-                updated_at = excluded.updated_at
-            """,
-            (user_id, album_id, photo_id, chapter_title, chapter_sort, last_page, total_pages, now),
-        )
-        conn.execute(
-            """
-            INSERT INTO history (
-                user_id, album_id, title, author, cover,
-                last_read_at, view_count, last_photo_id, last_photo_title, last_chapter_sort, last_page, total_pages
-            )
-            VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
-            ON CONFLICT(user_id, album_id) DO UPDATE SET
-                title = CASE WHEN excluded.title <> '' THEN excluded.title ELSE history.title END,
-                author = CASE WHEN excluded.author <> '' THEN excluded.author ELSE history.author END,
-                cover = CASE WHEN excluded.cover <> '' THEN excluded.cover ELSE history.cover END,
-                last_read_at = excluded.last_read_at,
-                last_photo_id = excluded.last_photo_id,
-                last_photo_title = excluded.last_photo_title,
-                last_chapter_sort = excluded.last_chapter_sort,
-                last_page = excluded.last_page,
-                total_pages = excluded.total_pages
-            """,
-            (
-                user_id,
-                album_id,
-                album_title,
-                album_author,
-                cover,
-                now,
-                photo_id,
-                chapter_title,
-                chapter_sort,
-                last_page,
-                total_pages,
-            ),
-        )
-        row = conn.execute(
+    entry = {
+        "user_id": user_id,
+        "album_id": album_id,
+        "photo_id": photo_id,
+        "album_title": album_title,
+        "album_author": album_author,
+        "cover": cover,
+        "chapter_title": chapter_title,
+        "chapter_sort": chapter_sort,
+        "last_page": last_page,
+        "total_pages": total_pages,
+        "updated_at": _now_ts(),
+    }
+    if progress_buffer.enabled():
+        progress_buffer.put(entry)
+        with db_read() as conn:
+            row = conn.execute(
+                "SELECT * FROM history WHERE user_id = ? AND album_id = ?",
+                (user_id, album_id),
+            ).fetchone()
+        return _overlay_history(_serialize_history(row) if row else None, entry)
+
+    def write(conn: sqlite3.Connection):
+        _write_progress(conn, [entry])
+        return conn.execute(
             "SELECT * FROM history WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
         ).fetchone()
+
+    row = db_write(write)
+    count_cache.invalidate(("history", user_id))
     return _serialize_history(row)
 
 
+def _newer_than(entry: dict, stored_at: Optional[int]) -> bool:
+    return stored_at is None or entry["updated_at"] >= stored_at
+
+
 def get_reading_state(user_id: int, album_id: str) -> dict:
-    with db_conn() as conn:
+    # 先取缓冲区快照再读库：中间提交的批次至少出现在其中之一；
+    # 快照里比库中旧的记录不覆盖库里的值
+    buffered = progress_buffer.entries_for(user_id, album_id)
+    with db_read() as conn:
         history_row = conn.execute(
             "SELECT * FROM history WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
@@ -828,22 +2383,246 @@ def get_reading_state(user_id: int, album_id: str) -> dict:
             (user_id, album_id),
         ).fetchall()
 
-    chapters = [_serialize_chapter_progress(row) for row in chapter_rows]
-    progress_map = {item["photo_id"]: item for item in chapters}
+    history = _serialize_history(history_row) if history_row else None
+    progress_map = {row["photo_id"]: _serialize_chapter_progress(row) for row in chapter_rows}
+    for entry in buffered:
+        if _newer_than(entry, history["last_read_at"] if history else None):
+            history = _overlay_history(history, entry)
+        stored = progress_map.get(entry["photo_id"])
+        if not _newer_than(entry, stored["updated_at"] if stored else None):
+            continue
+        progress_map[entry["photo_id"]] = {
+            "photo_id": entry["photo_id"],
+            "chapter_title": entry["chapter_title"],
+            "chapter_sort": entry["chapter_sort"],
+            "last_page": entry["last_page"],
+            "total_pages": entry["total_pages"],
+            "updated_at": entry["updated_at"],
+        }
+    chapters = sorted(
+        progress_map.values(),
+        key=lambda item: (-item["updated_at"], item["chapter_sort"] or 0),
+    )
     return {
         "album_id": album_id,
         "is_favorite": bool(favorite_row),
-        "history": _serialize_history(history_row) if history_row else None,
-        "last_read_photo_id": history_row["last_photo_id"] if history_row else None,
+        "history": history,
+        "last_read_photo_id": history["last_photo_id"] if history else None,
         "chapters": chapters,
-        "progress_map": progress_map,
+        "progress_map": {item["photo_id"]: item for item in chapters},
     }
 
 
+def get_album_states(user_id: int, album_ids: list[str]) -> dict:
+    """Favorite / history / progress / cache badges for many albums in four indexed queries."""
+    ids = list(dict.fromkeys(album_ids))
+    ids_json = json.dumps(ids)
+    # 与 get_reading_state 相同，缓冲区快照要先于读库
+    buffered = progress_buffer.entries_for_albums(user_id, set(ids))
+    with db_read() as conn:
+        favorite_rows = conn.execute(
+            """
+            SELECT album_id, updated_at
+            FROM favorites
+            WHERE user_id = ? AND album_id IN (SELECT value FROM json_each(?))
+            """,
+            (user_id, ids_json),
+        ).fetchall()
+        history_rows = conn.execute(
+            """
+            SELECT *
+            FROM history
+            WHERE user_id = ? AND album_id IN (SELECT value FROM json_each(?))
+            """,
+            (user_id, ids_json),
+        ).fetchall()
+        progress_rows = conn.execute(
+            """
+            SELECT album_id, photo_id, updated_at
+            FROM chapter_progress
+            WHERE user_id = ? AND album_id IN (SELECT value FROM json_each(?))
+            """,
+            (user_id, ids_json),
+        ).fetchall()
+        cache_rows = conn.execute(
+            """
+            SELECT album_id, COUNT(*) AS total
+            FROM user_cache_items
+            WHERE user_id = ? AND album_id IN (SELECT value FROM json_each(?))
+            GROUP BY album_id
+            """,
+            (user_id, ids_json),
+        ).fetchall()
+
+    favorites = {row["album_id"]: row["updated_at"] for row in favorite_rows}
+    histories = {row["album_id"]: _serialize_history(row) for row in history_rows}
+    progress: dict[str, dict[str, int]] = {}
+    for row in progress_rows:
+        progress.setdefault(row["album_id"], {})[row["photo_id"]] = row["updated_at"]
+    for entry in buffered:
+        history = histories.get(entry["album_id"])
+        if _newer_than(entry, history["last_read_at"] if history else None):
+            histories[entry["album_id"]] = _overlay_history(history, entry)
+        chapters = progress.setdefault(entry["album_id"], {})
+        chapters[entry["photo_id"]] = max(chapters.get(entry["photo_id"], 0), entry["updated_at"])
+    cached = {row["album_id"]: row["total"] for row in cache_rows}
+
+    items = {}
+    for album_id in ids:
+        history = histories.get(album_id)
+        chapters = progress.get(album_id, {})
+        items[album_id] = {
+            "album_id": album_id,
+            "is_favorite": album_id in favorites,
+            "favorited_at": favorites.get(album_id),
+            "in_history": history is not None,
+            "last_read_at": history["last_read_at"] if history else None,
+            "last_photo_id": history["last_photo_id"] if history else None,
+            "last_photo_title": history["last_photo_title"] if history else "",
+            "last_chapter_sort": history["last_chapter_sort"] if history else None,
+            "last_page": history["last_page"] if history else 0,
+            "total_pages": history["total_pages"] if history else 0,
+            "chapters_read": len(chapters),
+            "progress_updated_at": max(chapters.values()) if chapters else None,
+            "cached_chapters": cached.get(album_id, 0),
+        }
+    return {"items": items}
+
+
+def _sync_page(reset: bool, cursor: int, has_more: bool) -> dict:
+    return {
+        "reset": reset,
+        "cursor": cursor,
+        "has_more": has_more,
+        "favorites": [],
+        "history": [],
+        "progress": [],
+        "deleted": {"favorites": [], "history": [], "progress": []},
+    }
+
+
+def get_sync_changes(user_id: int, since: int, limit: int) -> dict:
+    """Favorites / history / progress changed after `since`, with tombstones for deletions."""
+    with db_read() as conn:
+        pruned_seq = conn.execute(
+            """
+            SELECT MAX(
+                (SELECT pruned_seq FROM sync_state WHERE id = 1),
+                COALESCE((SELECT pruned_seq FROM sync_pruned WHERE user_id = ?), 0)
+            ) AS pruned_seq
+            """,
+            (user_id,),
+        ).fetchone()["pruned_seq"]
+        if 0 < since < pruned_seq:
+            # 需要的墓碑已被清理，客户端要丢弃本地数据从 0 重新同步
+            return _sync_page(True, 0, True)
+        changes = conn.execute(
+            """
+            SELECT seq, kind, item_key, op
+            FROM sync_changes
+            WHERE user_id = ? AND seq > ?
+            ORDER BY seq
+            LIMIT ?
+            """,
+            (user_id, since, limit + 1),
+        ).fetchall()
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        rows: dict[str, dict[str, sqlite3.Row]] = {}
+        for kind, (table, key_column) in SYNC_KINDS.items():
+            keys = [row["item_key"] for row in changes if row["kind"] == kind and row["op"] == "upsert"]
+            if not keys:
+                continue
+            rows[kind] = {
+                row[key_column]: row
+                for row in conn.execute(
+                    f"""
+                    SELECT *
+                    FROM {table}
+                    WHERE user_id = ? AND {key_column} IN (SELECT value FROM json_each(?))
+                    """,
+                    (user_id, json.dumps(keys)),
+                )
+            }
+
+    data = _sync_page(False, changes[-1]["seq"] if changes else since, has_more)
+    lists = {"favorite": "favorites", "history": "history", "progress": "progress"}
+    for change in changes:
+        name = lists[change["kind"]]
+        row = rows.get(change["kind"], {}).get(change["item_key"])
+        if change["op"] == "delete" or row is None:
+            data["deleted"][name].append(change["item_key"])
+        elif change["kind"] == "favorite":
+            data["favorites"].append(_serialize_favorite(row))
+        elif change["kind"] == "history":
+            data["history"].append(_serialize_history(row))
+        else:
+            data["progress"].append({"album_id": row["album_id"], **_serialize_chapter_progress(row)})
+    return data
+
+
+def upload_reading_progress(user_id: int, items: list[dict]) -> dict:
+    """Apply progress recorded offline; an item only wins over a newer stored position if it is newer."""
+    now = _now_ts()
+    entries = [
+        {
+            "user_id": user_id,
+            "album_id": item["album_id"],
+            "photo_id": item["photo_id"],
+            "album_title": item.get("album_title") or "",
+            "album_author": item.get("album_author") or "",
+            "cover": item.get("cover") or "",
+            "chapter_title": item.get("chapter_title") or "",
+            "chapter_sort": item.get("chapter_sort"),
+            "last_page": item.get("last_page") or 0,
+            "total_pages": item.get("total_pages") or 0,
+            # 客户端时间不可信，不允许晚于服务器当前时间
+            "updated_at": min(item.get("updated_at") or now, now),
+        }
+        for item in items
+    ]
+    applied = db_write(_write_progress, entries)
+    count_cache.invalidate(("history", user_id))
+    return {"received": len(entries), "applied": applied}
+
+
+def _prune_sync_tombstones(conn: sqlite3.Connection, limit: int) -> int:
+    rows = conn.execute(
+        """
+        SELECT seq, user_id
+        FROM sync_changes
+        WHERE op = 'delete' AND changed_at <= ?
+        ORDER BY changed_at
+        LIMIT ?
+        """,
+        (_now_ts() - SYNC_TOMBSTONE_TTL, limit),
+    ).fetchall()
+    if not rows:
+        return 0
+    seqs = [row["seq"] for row in rows]
+    conn.execute(
+        "DELETE FROM sync_changes WHERE seq IN (SELECT value FROM json_each(?))",
+        (json.dumps(seqs),),
+    )
+    pruned: dict[int, int] = {}
+    for row in rows:
+        pruned[row["user_id"]] = max(pruned.get(row["user_id"], 0), row["seq"])
+    conn.executemany(
+        """
+        INSERT INTO sync_pruned (user_id, pruned_seq)
+        VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET pruned_seq = MAX(pruned_seq, excluded.pruned_seq)
+        """,
+        list(pruned.items()),
+    )
+    return len(seqs)
+
+
 def add_user_cache_item(user_id: int, album_id: str, photo_id: str) -> None:
     now = _now_ts()
-    with db_conn() as conn:
-        conn.execute(
+    db_write(
+        lambda conn: conn.execute(
             """
             INSERT INTO user_cache_items (user_id, album_id, photo_id, created_at, updated_at)
             VALUES (?, ?, ?, ?, ?)
@@ -853,10 +2632,11 @@ def add_user_cache_item(user_id: int, album_id: str, photo_id: str) -> None:
             """,
             (user_id, album_id, photo_id, now, now),
         )
+    )
 
 
 def has_user_cache_item(user_id: int, album_id: str, photo_id: str) -> bool:
-    with db_conn() as conn:
+    with db_read() as conn:
         row = conn.execute(
             """
             SELECT 1
@@ -869,7 +2649,7 @@ def has_user_cache_item(user_id: int, album_id: str, photo_id: str) -> bool:
 
 
 def get_user_cache_photo_ids(user_id: int, album_id: Optional[str] = None) -> set[str]:
-    with db_conn() as conn:
+    with db_read() as conn:
         if album_id is None:
             rows = conn.execute(
                 "SELECT photo_id FROM user_cache_items WHERE user_id = ?",
@@ -884,7 +2664,7 @@ def get_user_cache_photo_ids(user_id: int, album_id: Optional[str] = None) -> se
 
 
 def get_user_cache_album_map(user_id: int) -> dict[str, set[str]]:
-    with db_conn() as conn:
+    with db_read() as conn:
         rows = conn.execute(
             "SELECT album_id, photo_id FROM user_cache_items WHERE user_id = ?",
             (user_id,),
@@ -897,33 +2677,35 @@ def get_user_cache_album_map(user_id: int) -> dict[str, set[str]]:
 
 
 def remove_user_cache_item(user_id: int, album_id: str, photo_id: str) -> bool:
-    with db_conn() as conn:
-        cur = conn.execute(
+    deleted = db_write(
+        lambda conn: conn.execute(
             """
             DELETE FROM user_cache_items
             WHERE user_id = ? AND album_id = ? AND photo_id = ?
             """,
             (user_id, album_id, photo_id),
-        )
-    return cur.rowcount > 0
+        ).rowcount
+    )
+    return deleted > 0
 
 
 def remove_user_album_cache_items(user_id: int, album_id: str) -> list[str]:
-    with db_conn() as conn:
+    def write(conn: sqlite3.Connection) -> list[str]:
         rows = conn.execute(
             "SELECT photo_id FROM user_cache_items WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
         ).fetchall()
-        photo_ids = [row["photo_id"] for row in rows]
         conn.execute(
             "DELETE FROM user_cache_items WHERE user_id = ? AND album_id = ?",
             (user_id, album_id),
         )
-    return photo_ids
+        return [row["photo_id"] for row in rows]
+
+    return db_write(write)
 
 
 def count_cache_links(album_id: str, photo_id: str) -> int:
-    with db_conn() as conn:
+    with db_read() as conn:
         row = conn.execute(
             """
             SELECT COUNT(*) AS total
@@ -935,62 +2717,162 @@ def count_cache_links(album_id: str, photo_id: str) -> int:
     return row["total"]
 
 
-def list_comments(
+class CommentTreeCache:
+    """Assembled comment pages per album, valid while the album's comment version is unchanged."""
+
+    def __init__(self, max_entries: int = COMMENT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[int, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, version: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, version: int, data: dict) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {"entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+comment_tree_cache = CommentTreeCache()
+
+
+def _bump_comment_version(conn: sqlite3.Connection, album_id: str) -> None:
+    conn.execute(
+        """
+        INSERT INTO comment_versions (album_id, version) VALUES (?, 1)
+        ON CONFLICT(album_id) DO UPDATE SET version = version + 1
+        """,
+        (album_id,),
+    )
+
+
+def _bump_user_comment_versions(conn: sqlite3.Connection, user_id: int) -> None:
+    """Invalidate every album a user has commented on, e.g. after an avatar or role change."""
+    conn.execute(
+        """
+        INSERT INTO comment_versions (album_id, version)
+        SELECT DISTINCT album_id, 1 FROM comments WHERE user_id = ?
+        ON CONFLICT(album_id) DO UPDATE SET version = version + 1
+        """,
+        (user_id,),
+    )
+
+
+def get_comment_version(album_id: str) -> int:
+    with db_read() as conn:
+        row = conn.execute(
+            "SELECT version FROM comment_versions WHERE album_id = ?",
+            (album_id,),
+        ).fetchone()
+    return row["version"] if row else 0
+
+
+def comment_etag(
     album_id: str,
+    version: int,
     page: int,
     page_size: int,
     *,
     viewer_user_id: Optional[int] = None,
     viewer_is_admin: bool = False,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+) -> str:
+    # can_delete 随查看者变化，ETag 里要带上查看者
+    key = json.dumps(
+        [album_id, version, cursor or page, page_size, with_total, viewer_user_id, viewer_is_admin],
+        separators=(",", ":"),
+    )
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def _load_comment_page(
+    album_id: str,
+    page: int,
+    page_size: int,
+    cursor: Optional[str],
+    with_total: bool,
 ) -> dict:
-    offset = (page - 1) * page_size
-    with db_conn() as conn:
-        total = conn.execute(
+    with db_read() as conn:
+        if cursor:
+            created_at, comment_id = _decode_cursor(cursor, 2)
+            page_rows = conn.execute(
+                """
+                SELECT comments.*, users.username, users.is_admin, users.avatar_updated_at
+                FROM comments
+                JOIN users ON users.id = comments.user_id
+                WHERE comments.album_id = ? AND comments.parent_id IS NULL
+                  AND (comments.created_at, comments.id) < (?, ?)
+                ORDER BY comments.created_at DESC, comments.id DESC
+                LIMIT ?
+                """,
+                (album_id, created_at, comment_id, page_size + 1),
+            ).fetchall()
+        else:
+            page_rows = conn.execute(
+                """
+                SELECT comments.*, users.username, users.is_admin, users.avatar_updated_at
+                FROM comments
+                JOIN users ON users.id = comments.user_id
+                WHERE comments.album_id = ? AND comments.parent_id IS NULL
+                ORDER BY comments.created_at DESC, comments.id DESC
+                LIMIT ? OFFSET ?
+                """,
+                (album_id, page_size + 1, (page - 1) * page_size),
+            ).fetchall()
+        roots = page_rows[:page_size]
+        total = count_cache.count(
+            conn,
+            ("comments", album_id),
             "SELECT COUNT(*) AS total FROM comments WHERE album_id = ? AND parent_id IS NULL",
             (album_id,),
-        ).fetchone()["total"]
-        roots = conn.execute(
+        ) if with_total else None
+
+        # 整棵回复树一条递归查询取出，根 id 以 JSON 数组传入，不受参数个数上限影响
+        descendants = conn.execute(
             """
+            WITH RECURSIVE tree(id) AS (
+                SELECT comments.id
+                FROM comments
+                WHERE comments.album_id = ?
+                  AND comments.parent_id IN (SELECT value FROM json_each(?))
+                UNION ALL
+                SELECT comments.id
+                FROM comments
+                JOIN tree ON comments.parent_id = tree.id
+                WHERE comments.album_id = ?
+            )
             SELECT comments.*, users.username, users.is_admin, users.avatar_updated_at
-            FROM comments
+            FROM tree
+            JOIN comments ON comments.id = tree.id
             JOIN users ON users.id = comments.user_id
-            WHERE comments.album_id = ? AND comments.parent_id IS NULL
-            ORDER BY comments.created_at DESC
-            LIMIT ? OFFSET ?
+            ORDER BY comments.created_at ASC, comments.id ASC
             """,
-            (album_id, page_size, offset),
-        ).fetchall()
-
-        root_ids = [row["id"] for row in roots]
-        descendants = []
-        pending_parent_ids = root_ids[:]
-        while pending_parent_ids:
-            placeholders = ",".join("?" for _ in pending_parent_ids)
-            batch = conn.execute(
-                f"""
-                SELECT comments.*, users.username, users.is_admin, users.avatar_updated_at
-                FROM comments
-                JOIN users ON users.id = comments.user_id
-                WHERE comments.parent_id IN ({placeholders})
-                ORDER BY comments.created_at ASC
-                """,
-                pending_parent_ids,
-            ).fetchall()
-            if not batch:
-                break
-            descendants.extend(batch)
-            pending_parent_ids = [row["id"] for row in batch]
+            (album_id, json.dumps([row["id"] for row in roots]), album_id),
+        ).fetchall() if roots else []
 
     comment_map = {}
-    for row in roots:
-        item = _serialize_comment(row)
-        item["can_delete"] = viewer_is_admin or row["user_id"] == viewer_user_id
-        item["replies"] = []
-        comment_map[row["id"]] = item
-
-    for row in descendants:
+    for row in [*roots, *descendants]:
         item = _serialize_comment(row)
-        item["can_delete"] = viewer_is_admin or row["user_id"] == viewer_user_id
         item["replies"] = []
         comment_map[row["id"]] = item
 
@@ -1000,22 +2882,58 @@ def list_comments(
         if parent:
             parent["replies"].append(comment_map[row["id"]])
 
-    return {
-        "items": items,
-        "total": total,
-        "page_count": math.ceil(total / page_size) if total else 0,
-    }
+    return _page_result(
+        items,
+        page_rows,
+        page_size,
+        lambda row: [row["created_at"], row["id"]],
+        total,
+    )
+
+
+def _with_can_delete(items: list[dict], viewer_user_id: Optional[int], viewer_is_admin: bool) -> list[dict]:
+    return [
+        {
+            **item,
+            "can_delete": viewer_is_admin or item["user"]["id"] == viewer_user_id,
+            "replies": _with_can_delete(item["replies"], viewer_user_id, viewer_is_admin),
+        }
+        for item in items
+    ]
+
+
+def list_comments(
+    album_id: str,
+    page: int,
+    page_size: int,
+    *,
+    viewer_user_id: Optional[int] = None,
+    viewer_is_admin: bool = False,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+    version: Optional[int] = None,
+) -> dict:
+    """Comment page with reply trees; pass the version read for the ETag to avoid reading it twice."""
+    if version is None:
+        version = get_comment_version(album_id)
+    key = (album_id, cursor or page, page_size, with_total)
+    data = comment_tree_cache.get(key, version)
+    if data is None:
+        data = _load_comment_page(album_id, page, page_size, cursor, with_total)
+        comment_tree_cache.put(key, version, data)
+    return {**data, "items": _with_can_delete(data["items"], viewer_user_id, viewer_is_admin)}
 
 
 def create_comment(user_id: int, album_id: str, content: str, parent_id: Optional[int] = None) -> dict:
     text = content.strip()
     if not text:
         raise HTTPException(400, "评论内容不能为空")
-    if len(text) > 2000:
+    if len(text) > COMMENT_MAX_LENGTH:
         raise HTTPException(400, "评论内容过长")
 
     now = _now_ts()
-    with db_conn() as conn:
+
+    def write(conn: sqlite3.Connection):
         if parent_id is not None:
             parent = conn.execute(
                 "SELECT * FROM comments WHERE id = ? AND album_id = ?",
@@ -1031,7 +2949,8 @@ def create_comment(user_id: int, album_id: str, content: str, parent_id: Optiona
             """,
             (album_id, user_id, parent_id, text, now, now),
         )
-        row = conn.execute(
+        _bump_comment_version(conn, album_id)
+        return conn.execute(
             """
             SELECT comments.*, users.username, users.is_admin, users.avatar_updated_at
             FROM comments
@@ -1041,6 +2960,8 @@ def create_comment(user_id: int, album_id: str, content: str, parent_id: Optiona
             (cur.lastrowid,),
         ).fetchone()
 
+    row = db_write(write)
+    count_cache.invalidate(("comments", album_id))
     item = _serialize_comment(row)
     item["can_delete"] = True
     item["replies"] = []
@@ -1048,7 +2969,7 @@ def create_comment(user_id: int, album_id: str, content: str, parent_id: Optiona
 
 
 def delete_comment(comment_id: int, actor_user_id: int, actor_is_admin: bool) -> None:
-    with db_conn() as conn:
+    def write(conn: sqlite3.Connection) -> None:
         row = conn.execute(
             "SELECT * FROM comments WHERE id = ?",
             (comment_id,),
@@ -1066,3 +2987,6 @@ def delete_comment(comment_id: int, actor_user_id: int, actor_is_admin: bool) ->
             """,
             (_now_ts(), comment_id),
         )
+        _bump_comment_version(conn, row["album_id"])
+
+    db_write(write)
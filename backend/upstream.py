@@ -0,0 +1,411 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Optional
+from urllib.parse import urlsplit
+
+from anyio import CapacityLimiter, to_thread
+
+from common import PostmanProxy
+from jmcomic import JmImageResp, JmModuleConfig
+
+from circuit_breaker import BreakerRegistry, CircuitOpenError, RetryBudget, RetryBudgetExhausted
+
+# jmcomic 的客户端是同步实现，元数据请求（详情/搜索/分类）放到独立的线程配额里执行，
+# 不占用 FastAPI 默认线程池；图片请求直接走 curl_cffi 的 AsyncSession，在事件循环上并发。
+UPSTREAM_THREADS = int(os.getenv("UPSTREAM_THREADS", "64"))
+UPSTREAM_IMAGE_TIMEOUT = float(os.getenv("UPSTREAM_IMAGE_TIMEOUT", "30"))
+
+# 连接池：每个上游 host 一个长连接 session，复用 TLS 连接
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "256"))
+UPSTREAM_KEEPALIVE = os.getenv("UPSTREAM_KEEPALIVE", "1") != "0"
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") != "0"
+UPSTREAM_DNS_CACHE_SECONDS = int(os.getenv("UPSTREAM_DNS_CACHE_SECONDS", "600"))
+
+# 对冲请求：主请求超过延迟分位数仍未返回时，向另一个图片域名补发一次，取先返回者
+UPSTREAM_HEDGE_ENABLED = os.getenv("UPSTREAM_HEDGE_ENABLED", "1") != "0"
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))
+UPSTREAM_HEDGE_BUDGET = float(os.getenv("UPSTREAM_HEDGE_BUDGET", "0.05"))
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.2"))
+UPSTREAM_HEDGE_INITIAL_DELAY = float(os.getenv("UPSTREAM_HEDGE_INITIAL_DELAY", "1.5"))
+
+_limiter: Optional[CapacityLimiter] = None
+_postman_meta: dict = {}
+_guarded_client = None
+_call_state = threading.local()
+# 假上游模式下图片请求不走网络，由这里的同步函数返回响应
+_image_transport: Optional[Callable[[str], Any]] = None
+
+breakers = BreakerRegistry()
+retry_budget = RetryBudget()
+
+
+class UpstreamUnavailable(Exception):
+    """Every candidate upstream domain is short-circuited; the call never left the process."""
+
+
+def configure(option) -> None:
+    """Remember the postman settings (impersonate / proxies) of the jmcomic option."""
+    global _postman_meta
+    try:
+        _postman_meta = dict(option.client.postman.meta_data.src_dict)
+    except Exception:
+        _postman_meta = {}
+
+
+def _get_limiter() -> CapacityLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = CapacityLimiter(UPSTREAM_THREADS)
+    return _limiter
+
+
+async def run_sync(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking call without touching the request threadpool."""
+    return await to_thread.run_sync(func, *args, limiter=_get_limiter())
+
+
+def _is_failure_status(status_code: int) -> bool:
+    return status_code >= 500 or status_code in (403, 429)
+
+
+class GuardedPostman(PostmanProxy):
+    """Routes the jmcomic client's requests through per-domain breakers and the retry budget."""
+
+    def get(self, url, **kwargs):
+        return self._guarded(self.postman.get, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._guarded(self.postman.post, url, **kwargs)
+
+    def _guarded(self, request, url, **kwargs):
+        host = urlsplit(url).hostname or ""
+        breaker = breakers.get(host)
+        if not breaker.allow():
+            raise CircuitOpenError(f"域名熔断中: {host}")
+
+        attempts = getattr(_call_state, "attempts", None)
+        if attempts is not None:
+            # 第一次请求免费，之后每次真正发出的重试（含切换域名）都要消耗预算
+            if attempts > 0 and not retry_budget.try_spend():
+                breaker.release()
+                raise RetryBudgetExhausted(f"上游重试预算已耗尽: {url}")
+            _call_state.attempts = attempts + 1
+
+        try:
+            resp = request(url, **kwargs)
+        except Exception:
+            breaker.record_failure()
+            raise
+        if _is_failure_status(resp.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return resp
+
+
+def set_image_transport(transport: Optional[Callable[[str], Any]]) -> None:
+    """Serve CDN requests from ``transport(url)`` instead of the connection pool."""
+    global _image_transport
+    _image_transport = transport
+
+
+def guard_client(client) -> None:
+    """Install the breaker-aware postman on the shared jmcomic client."""
+    global _guarded_client
+    if not isinstance(client.postman, GuardedPostman):
+        client.postman = GuardedPostman(client.postman)
+    _guarded_client = client
+
+
+def _client_call(func: Callable[..., Any], args: tuple) -> Any:
+    _call_state.attempts = 0
+    retry_budget.deposit()
+    try:
+        return func(*args)
+    except Exception as e:
+        if _call_state.attempts == 0:
+            raise UpstreamUnavailable(f"上游暂不可用: {e}") from e
+        raise
+    finally:
+        _call_state.attempts = None
+
+
+def all_domains_open() -> bool:
+    """True when every API domain of the shared client is short-circuited."""
+    if _guarded_client is None:
+        return False
+    domains = list(_guarded_client.get_domain_list())
+    return bool(domains) and all(breakers.is_open(d) for d in domains)
+
+
+async def run_client(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a jmcomic client call, failing fast when every domain's breaker is open."""
+    if all_domains_open():
+        raise UpstreamUnavailable("所有上游域名均处于熔断状态")
+    return await to_thread.run_sync(_client_call, func, args, limiter=_get_limiter())
+
+
+class HostSessionPool:
+    """Keep-alive curl_cffi sessions, one per upstream host, with usage counters."""
+
+    def __init__(
+        self,
+        max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+        keepalive: bool = UPSTREAM_KEEPALIVE,
+        http2: bool = UPSTREAM_HTTP2,
+        dns_cache_seconds: int = UPSTREAM_DNS_CACHE_SECONDS,
+    ):
+        self.max_connections = max_connections
+        self.keepalive = keepalive
+        self.http2 = http2
+        self.dns_cache_seconds = dns_cache_seconds
+        self._sessions: dict[str, Any] = {}
+        self._stats: dict[str, dict] = {}
+
+    def _new_session(self):
+        from curl_cffi import CurlHttpVersion, CurlInfo, CurlOpt
+        from curl_cffi.requests import AsyncSession
+
+        curl_options = {
+            CurlOpt.DNS_CACHE_TIMEOUT: self.dns_cache_seconds,
+            CurlOpt.TCP_KEEPALIVE: int(self.keepalive),
+            CurlOpt.MAXCONNECTS: self.max_connections,
+        }
+        if not self.keepalive:
+            curl_options[CurlOpt.FORBID_REUSE] = 1
+        if self.http2:
+            # 等待已有连接的 HTTP/2 多路复用，而不是新开连接
+            curl_options[CurlOpt.PIPEWAIT] = 1
+
+        return AsyncSession(
+            max_clients=self.max_connections,
+            impersonate=_postman_meta.get("impersonate") or "chrome",
+            proxies=_postman_meta.get("proxies") or None,
+            http_version=CurlHttpVersion.V2TLS if self.http2 else CurlHttpVersion.V1_1,
+            curl_options=curl_options,
+            curl_infos=[CurlInfo.NUM_CONNECTS],
+        )
+
+    def session_for(self, host: str):
+        session = self._sessions.get(host)
+        if session is None:
+            session = self._new_session()
+            self._sessions[host] = session
+            self._stats[host] = {
+                "in_use": 0,
+                "requests": 0,
+                "errors": 0,
+                "new_connections": 0,
+            }
+        return session
+
+    async def request(self, method: str, url: str, **kwargs):
+        from curl_cffi import CurlInfo
+
+        host = urlsplit(url).hostname or ""
+        session = self.session_for(host)
+        stats = self._stats[host]
+        stats["in_use"] += 1
+        stats["requests"] += 1
+        try:
+            resp = await session.request(method, url, **kwargs)
+        except Exception:
+            stats["errors"] += 1
+            raise
+        finally:
+            stats["in_use"] -= 1
+        stats["new_connections"] += int(resp.infos.get(CurlInfo.NUM_CONNECTS) or 0)
+        return resp
+
+    def stats(self) -> dict:
+        hosts = []
+        for host, item in sorted(self._stats.items()):
+            completed = item["requests"] - item["in_use"] - item["errors"]
+            reused = max(completed - item["new_connections"], 0)
+            hosts.append({
+                "host": host,
+                **item,
+                "reuse_ratio": round(reused / completed, 3) if completed > 0 else 0.0,
+            })
+        return {
+            "max_connections": self.max_connections,
+            "keepalive": self.keepalive,
+            "http2": self.http2,
+            "dns_cache_seconds": self.dns_cache_seconds,
+            "in_use": sum(item["in_use"] for item in self._stats.values()),
+            "hosts": hosts,
+        }
+
+    async def aclose(self) -> None:
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        self._stats.clear()
+        for session in sessions:
+            await session.close()
+
+
+pool = HostSessionPool()
+
+
+class HedgePolicy:
+    """Latency percentile tracker plus a hedge budget relative to total requests."""
+
+    def __init__(
+        self,
+        percentile: float = UPSTREAM_HEDGE_PERCENTILE,
+        budget: float = UPSTREAM_HEDGE_BUDGET,
+        min_delay: float = UPSTREAM_HEDGE_MIN_DELAY,
+        initial_delay: float = UPSTREAM_HEDGE_INITIAL_DELAY,
+        window: int = 1000,
+        min_samples: int = 50,
+        burst: int = 10,
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.burst = burst
+        self._samples: deque[float] = deque(maxlen=window)
+        self._observed = 0
+        self._delay: Optional[float] = None
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._observed += 1
+        # 分位数每攒一批样本再重新计算，避免每个请求都排序
+        if self._observed % self.min_samples == 0:
+            self._delay = None
+
+    def delay(self) -> float:
+        if len(self._samples) < self.min_samples:
+            return self.initial_delay
+        if self._delay is None:
+            ordered = sorted(self._samples)
+            index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+            self._delay = max(ordered[index], self.min_delay)
+        return self._delay
+
+    def try_acquire(self) -> bool:
+        if self.hedges >= self.budget * self.requests + self.burst:
+            return False
+        self.hedges += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": UPSTREAM_HEDGE_ENABLED,
+            "percentile": self.percentile,
+            "budget": self.budget,
+            "delay_ms": round(self.delay() * 1000),
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_ratio": round(self.hedges / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+hedge_policy = HedgePolicy()
+
+
+def alternate_image_url(img_url: str) -> Optional[str]:
+    """Same image path on another CDN domain, or None if there is no alternative."""
+    parts = urlsplit(img_url)
+    image_domains = list(JmModuleConfig.DOMAIN_IMAGE_LIST)
+    if parts.hostname not in image_domains:
+        return None
+    candidates = [d for d in image_domains if d != parts.hostname and not breakers.is_open(d)]
+    if not candidates:
+        return None
+    return parts._replace(netloc=random.choice(candidates)).geturl()
+
+
+async def _fetch_image(img_url: str) -> JmImageResp:
+    breaker = breakers.get(urlsplit(img_url).hostname or "")
+    if not breaker.allow():
+        # 当前图片域名熔断中，直接换到一个健康的图片域名
+        alt_url = alternate_image_url(img_url)
+        if alt_url is None:
+            raise UpstreamUnavailable(f"图片域名熔断中: {urlsplit(img_url).hostname}")
+        img_url = alt_url
+        breaker = breakers.get(urlsplit(img_url).hostname or "")
+        if not breaker.allow():
+            raise UpstreamUnavailable(f"图片域名熔断中: {urlsplit(img_url).hostname}")
+
+    start = time.monotonic()
+    try:
+        if _image_transport is not None:
+            raw = await run_sync(_image_transport, img_url)
+        else:
+            raw = await pool.request(
+                "GET",
+                img_url,
+                headers=JmModuleConfig.new_html_headers(),
+                timeout=UPSTREAM_IMAGE_TIMEOUT,
+            )
+    except asyncio.CancelledError:
+        # 被对冲请求取消，不算失败
+        breaker.release()
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+
+    if _is_failure_status(raw.status_code):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    resp = JmImageResp(raw)
+    if resp.is_success:
+        hedge_policy.observe(time.monotonic() - start)
+    return resp
+
+
+async def _first_success(primary: asyncio.Future, hedge: asyncio.Future) -> JmImageResp:
+    """Return the first successful response; fall back to the primary's outcome."""
+    pending = {primary, hedge}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None and task.result().is_success:
+                if task is hedge:
+                    hedge_policy.hedge_wins += 1
+                return task.result()
+    return primary.result()
+
+
+async def get_jm_image(img_url: str) -> JmImageResp:
+    """Async counterpart of ``client.get_jm_image`` with hedging against slow CDN nodes."""
+    hedge_policy.requests += 1
+    if not UPSTREAM_HEDGE_ENABLED:
+        return await _fetch_image(img_url)
+
+    tasks = [asyncio.ensure_future(_fetch_image(img_url))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_policy.delay())
+        if done:
+            return tasks[0].result()
+
+        alt_url = alternate_image_url(img_url)
+        if alt_url is None or not hedge_policy.try_acquire():
+            return await tasks[0]
+
+        tasks.append(asyncio.ensure_future(_fetch_image(alt_url)))
+        return await _first_success(tasks[0], tasks[1])
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def aclose() -> None:
+    await pool.aclose()
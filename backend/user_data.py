@@ -0,0 +1,519 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import uuid
+from typing import AsyncIterator, Iterator, Optional
+
+from fastapi import HTTPException
+
+import site_store
+from site_store import _normalize_username, _now_ts, db_read, db_write_async
+
+# 用户数据导入导出：NDJSON，每行 {"type": 数据类型, "data": 行}，第一行是 meta。
+# 行之间用 username 关联用户，不依赖自增 id，可以在不同实例之间迁移。
+# 导出边查询边输出，导入按 USER_DATA_CHUNK_ROWS 行一个事务分批写入，内存占用与数据量无关。
+USER_DATA_CHUNK_ROWS = int(os.getenv("USER_DATA_CHUNK_ROWS", "500"))
+USER_DATA_MAX_LINE_BYTES = int(os.getenv("USER_DATA_MAX_LINE_BYTES", str(1024 * 1024)))
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_FLUSH_BYTES = 64 * 1024
+MAX_REPORTED_ERRORS = 20
+# skip：已存在的行不动；overwrite：用导入的行覆盖；newer：导入的行更新时才覆盖
+CONFLICT_POLICIES = ("skip", "overwrite", "newer")
+
+# 导出顺序即导入时一个批次内的处理顺序：用户在前，评论按 id 升序保证父评论先于回复
+DATA_TYPES = ("users", "favorites", "history", "chapter_progress", "comments", "user_cache_items")
+
+_USER_COLUMNS = (
+    "username",
+    "password_salt",
+    "password_hash",
+    "password_algo",
+    "password_iterations",
+    "is_admin",
+    "is_active",
+    "created_at",
+    "updated_at",
+)
+_COMMENT_COLUMNS = ("id", "album_id", "parent_id", "content", "is_deleted", "created_at", "updated_at")
+# 每列接受的 JSON 类型，类型不对的行记为无效，不交给 SQLite
+_TEXT = (str,)
+_INT = (int,)
+_OPTIONAL_TEXT = (str, type(None))
+_OPTIONAL_INT = (int, type(None))
+_COLUMN_TYPES = {
+    "username": _TEXT,
+    "password_salt": _TEXT,
+    "password_hash": _TEXT,
+    "password_algo": _TEXT,
+    "password_iterations": _INT,
+    "is_admin": _INT,
+    "is_active": _INT,
+    "created_at": _INT,
+    "updated_at": _INT,
+    "id": _INT,
+    "album_id": _TEXT,
+    "parent_id": _OPTIONAL_INT,
+    "content": _TEXT,
+    "is_deleted": _INT,
+    "title": _TEXT,
+    "author": _TEXT,
+    "cover": _TEXT,
+    "last_read_at": _INT,
+    "view_count": _INT,
+    "last_photo_id": _OPTIONAL_TEXT,
+    "last_photo_title": _TEXT,
+    "last_chapter_sort": _OPTIONAL_INT,
+    "last_page": _INT,
+    "total_pages": _INT,
+    "photo_id": _TEXT,
+    "chapter_title": _TEXT,
+    "chapter_sort": _OPTIONAL_INT,
+}
+# 按用户保存的表：key 是唯一键（不含 user_id），stamp 是 newer 策略比较的时间列
+_USER_TABLES = {
+    "favorites": {
+        "key": ("album_id",),
+        "columns": ("album_id", "title", "author", "cover", "created_at", "updated_at"),
+        "stamp": "updated_at",
+    },
+    "history": {
+        "key": ("album_id",),
+        "columns": (
+            "album_id",
+            "title",
+            "author",
+            "cover",
+            "last_read_at",
+            "view_count",
+            "last_photo_id",
+            "last_photo_title",
+            "last_chapter_sort",
+            "last_page",
+            "total_pages",
+        ),
+        "stamp": "last_read_at",
+    },
+    "chapter_progress": {
+        "key": ("photo_id",),
+        "columns": ("album_id", "photo_id", "chapter_title", "chapter_sort", "last_page", "total_pages", "updated_at"),
+        "stamp": "updated_at",
+    },
+    "user_cache_items": {
+        "key": ("photo_id",),
+        "columns": ("album_id", "photo_id", "created_at", "updated_at"),
+        "stamp": "updated_at",
+    },
+}
+
+
+# ---- Export ----
+
+def _export_rows(conn: sqlite3.Connection, user_id: Optional[int]) -> Iterator[tuple[str, dict]]:
+    # 逐行迭代游标，不 fetchall
+    scope = "" if user_id is None else "WHERE users.id = ?"
+    params = () if user_id is None else (user_id,)
+    # 个人导出不包含密码哈希
+    user_columns = _USER_COLUMNS if user_id is None else ("username", "created_at")
+    for row in conn.execute(
+        f"SELECT {', '.join(user_columns)} FROM users {scope} ORDER BY users.id",
+        params,
+    ):
+        yield "users", dict(row)
+
+    for data_type in DATA_TYPES[1:]:
+        if data_type == "comments":
+            columns = ", ".join(f"comments.{column}" for column in _COMMENT_COLUMNS)
+            query = f"""
+                SELECT users.username, {columns}
+                FROM comments
+                JOIN users ON users.id = comments.user_id
+                {scope}
+                ORDER BY comments.id
+            """
+        else:
+            columns = ", ".join(f"{data_type}.{column}" for column in _USER_TABLES[data_type]["columns"])
+            query = f"""
+                SELECT users.username, {columns}
+                FROM {data_type}
+                JOIN users ON users.id = {data_type}.user_id
+                {scope}
+            """
+        for row in conn.execute(query, params):
+            yield data_type, dict(row)
+
+
+def _ndjson_line(data_type: str, data: dict) -> str:
+    return json.dumps({"type": data_type, "data": data}, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def export_ndjson(user_id: Optional[int] = None) -> Iterator[bytes]:
+    """All site user data (or one user's) as NDJSON, yielded in ~64 KiB chunks."""
+    with db_read() as conn:
+        buf = [
+            _ndjson_line(
+                "meta",
+                {
+                    "version": EXPORT_FORMAT_VERSION,
+                    "exported_at": _now_ts(),
+                    "scope": "all" if user_id is None else "user",
+                },
+            )
+        ]
+        size = len(buf[0])
+        for data_type, data in _export_rows(conn, user_id):
+            line = _ndjson_line(data_type, data)
+            buf.append(line)
+            size += len(line)
+            if size >= EXPORT_FLUSH_BYTES:
+                yield "".join(buf).encode("utf-8")
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf).encode("utf-8")
+
+
+# ---- Import ----
+
+def _upsert_sql(table: str, columns: tuple[str, ...], key: tuple[str, ...], stamp: str, on_conflict: str) -> str:
+    insert_columns = ("user_id", *columns)
+    sql = (
+        f"INSERT INTO {table} ({', '.join(insert_columns)}) "
+        f"VALUES ({', '.join('?' * len(insert_columns))}) "
+        f"ON CONFLICT(user_id, {', '.join(key)}) "
+    )
+    if on_conflict == "skip":
+        return sql + "DO NOTHING"
+    sql += "DO UPDATE SET " + ", ".join(
+        f"{column} = excluded.{column}" for column in columns if column not in key
+    )
+    if on_conflict == "newer":
+        sql += f" WHERE excluded.{stamp} > {table}.{stamp}"
+    return sql
+
+
+class _ChunkResult:
+    def __init__(self):
+        self.applied: dict[str, int] = {}
+        self.skipped: dict[str, int] = {}
+        self.errors: list[tuple[int, str]] = []
+        self.user_ids: set[int] = set()
+        self.album_ids: set[str] = set()
+        self.users_changed = False
+
+    def count(self, bucket: dict[str, int], data_type: str) -> None:
+        bucket[data_type] = bucket.get(data_type, 0) + 1
+
+
+def _import_users(conn, rows, on_conflict, actor_user_id, result) -> None:
+    columns = _USER_COLUMNS
+    sql = (
+        f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+        "ON CONFLICT(username) "
+    )
+    if on_conflict == "skip":
+        sql += "DO NOTHING"
+    else:
+        # 密码等变化时递增 token_epoch，旧令牌失效；不修改执行导入的管理员自己
+        sql += "DO UPDATE SET " + ", ".join(
+            f"{column} = excluded.{column}" for column in columns if column != "username"
+        ) + ", token_epoch = users.token_epoch + 1 WHERE users.id IS NOT ?"
+        if on_conflict == "newer":
+            sql += " AND excluded.updated_at > users.updated_at"
+    for line_no, data in rows:
+        values = [data[column] for column in columns]
+        values[0] = _normalize_username(values[0])
+        params = values if on_conflict == "skip" else [*values, actor_user_id]
+        try:
+            changed = conn.execute(sql, params).rowcount
+        except sqlite3.Error as e:
+            result.errors.append((line_no, str(e)))
+            continue
+        if changed > 0:
+            result.count(result.applied, "users")
+            result.users_changed = True
+        else:
+            result.count(result.skipped, "users")
+
+
+def _import_comments(conn, rows, run_id, user_ids, personal, result) -> None:
+    now = _now_ts()
+    for line_no, data in rows:
+        user_id = user_ids.get(data["username"])
+        if personal:
+            # 个人导入不能自己标记删除状态或把时间写到未来；已删除的评论不再导入
+            if data["is_deleted"]:
+                result.count(result.skipped, "comments")
+                continue
+            data["created_at"] = min(data["created_at"], now)
+            data["updated_at"] = min(data["updated_at"], now)
+        parent_id = data["parent_id"]
+        if parent_id is not None:
+            mapped = conn.execute(
+                "SELECT new_id FROM import_comment_ids WHERE run_id = ? AND old_id = ?",
+                (run_id, parent_id),
+            ).fetchone()
+            # 父评论不在这次导入里（例如个人导出里回复的是别人的评论），无法还原层级
+            parent_id = mapped["new_id"] if mapped else None
+            if mapped is None:
+                user_id = None
+        if user_id is None:
+            result.count(result.skipped, "comments")
+            continue
+        existing = conn.execute(
+            """
+            SELECT id FROM comments
+            WHERE album_id = ? AND parent_id IS ? AND user_id = ? AND created_at = ? AND content = ?
+            """,
+            (data["album_id"], parent_id, user_id, data["created_at"], data["content"]),
+        ).fetchone()
+        if existing:
+            new_id = existing["id"]
+            result.count(result.skipped, "comments")
+        else:
+            try:
+                new_id = conn.execute(
+                    """
+                    INSERT INTO comments (album_id, user_id, parent_id, content, is_deleted, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        data["album_id"],
+                        user_id,
+                        parent_id,
+                        data["content"],
+                        0 if personal else data["is_deleted"],
+                        data["created_at"],
+                        data["updated_at"],
+                    ),
+                ).lastrowid
+            except sqlite3.Error as e:
+                result.errors.append((line_no, str(e)))
+                continue
+            result.count(result.applied, "comments")
+            result.album_ids.add(data["album_id"])
+        conn.execute(
+            "INSERT OR REPLACE INTO import_comment_ids (run_id, old_id, new_id) VALUES (?, ?, ?)",
+            (run_id, data["id"], new_id),
+        )
+
+
+def _apply_chunk(
+    conn: sqlite3.Connection,
+    chunk: list[tuple[int, str, dict]],
+    on_conflict: str,
+    user_id: Optional[int],
+    actor_user_id: Optional[int],
+    run_id: str,
+) -> _ChunkResult:
+    result = _ChunkResult()
+    by_type: dict[str, list[tuple[int, dict]]] = {data_type: [] for data_type in DATA_TYPES}
+    for line_no, data_type, data in chunk:
+        by_type[data_type].append((line_no, data))
+
+    if user_id is None and by_type["users"]:
+        _import_users(conn, by_type["users"], on_conflict, actor_user_id, result)
+
+    if user_id is None:
+        usernames = {_normalize_username(data["username"]) for rows in by_type.values() for _, data in rows}
+        user_ids = {
+            row["username"]: row["id"]
+            for row in conn.execute(
+                "SELECT id, username FROM users WHERE username IN (SELECT value FROM json_each(?))",
+                (json.dumps(sorted(usernames)),),
+            )
+        }
+        for rows in by_type.values():
+            for _, data in rows:
+                data["username"] = _normalize_username(data["username"])
+    else:
+        # 个人导入：解析时已只留下文件主人的行，全部归到当前用户
+        user_ids = {data["username"]: user_id for rows in by_type.values() for _, data in rows}
+
+    for data_type in DATA_TYPES[1:]:
+        rows = by_type[data_type]
+        if not rows:
+            continue
+        if data_type == "comments":
+            _import_comments(conn, rows, run_id, user_ids, user_id is not None, result)
+            continue
+        spec = _USER_TABLES[data_type]
+        sql = _upsert_sql(data_type, spec["columns"], spec["key"], spec["stamp"], on_conflict)
+        for line_no, data in rows:
+            target_user_id = user_ids.get(data["username"])
+            if target_user_id is None:
+                result.count(result.skipped, data_type)
+                continue
+            try:
+                changed = conn.execute(sql, (target_user_id, *(data[column] for column in spec["columns"]))).rowcount
+            except sqlite3.Error as e:
+                result.errors.append((line_no, str(e)))
+                continue
+            if changed > 0:
+                result.count(result.applied, data_type)
+                result.user_ids.add(target_user_id)
+            else:
+                result.count(result.skipped, data_type)
+
+    for album_id in result.album_ids:
+        site_store._bump_comment_version(conn, album_id)
+    if result.users_changed:
+        site_store._record_auth_change(conn)
+    return result
+
+
+def _validate_line(raw: bytes, line_no: int, user_id: Optional[int]) -> Optional[tuple[int, str, dict]]:
+    """Parse one NDJSON line; None for blank lines, ValueError for bad ones."""
+    raw = raw.strip()
+    if not raw:
+        return None
+    try:
+        item = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"无法解析的 JSON：{e}") from e
+    if not isinstance(item, dict) or not isinstance(item.get("data"), dict):
+        raise ValueError("缺少 type / data 字段")
+    data_type, data = item.get("type"), item["data"]
+    if data_type == "meta":
+        version = data.get("version", 0)
+        if not isinstance(version, int):
+            raise ValueError("无效的导出文件版本")
+        if version > EXPORT_FORMAT_VERSION:
+            raise ValueError("导出文件版本过新")
+        return line_no, data_type, data
+    if data_type not in DATA_TYPES:
+        raise ValueError(f"未知的数据类型：{data_type}")
+    if data_type == "users":
+        # 个人导入只用 users 行确定文件属于谁，不导入账号字段
+        required = _USER_COLUMNS if user_id is None else ("username",)
+    elif data_type == "comments":
+        required = ("username", *_COMMENT_COLUMNS)
+    else:
+        required = ("username", *_USER_TABLES[data_type]["columns"])
+    missing = [column for column in required if column not in data]
+    if missing:
+        raise ValueError(f"缺少字段：{', '.join(missing)}")
+    wrong = [column for column in required if not isinstance(data[column], _COLUMN_TYPES[column])]
+    if wrong:
+        raise ValueError(f"字段类型不正确：{', '.join(wrong)}")
+    if data_type == "comments":
+        # 与发表评论相同的内容限制；已删除的评论内容可以为空
+        data["content"] = data["content"].strip()
+        if len(data["content"]) > site_store.COMMENT_MAX_LENGTH:
+            raise ValueError("评论内容过长")
+        if not data["content"] and not data["is_deleted"]:
+            raise ValueError("评论内容不能为空")
+    return line_no, data_type, data
+
+
+async def import_ndjson(
+    stream: AsyncIterator[bytes],
+    *,
+    on_conflict: str = "newer",
+    user_id: Optional[int] = None,
+    actor_user_id: Optional[int] = None,
+) -> dict:
+    """Stream NDJSON into the site database in chunked transactions; user_id limits it to one user."""
+    if on_conflict not in CONFLICT_POLICIES:
+        raise HTTPException(400, f"不支持的冲突策略：{on_conflict}")
+
+    run_id = uuid.uuid4().hex
+    report = {"lines": 0, "applied": {}, "skipped": {}, "invalid": 0, "errors": []}
+
+    def add_error(line_no: int, message: str) -> None:
+        report["invalid"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_no, "error": message})
+
+    async def flush(chunk: list) -> None:
+        result = await db_write_async(_apply_chunk, chunk, on_conflict, user_id, actor_user_id, run_id)
+        for name in ("applied", "skipped"):
+            for data_type, count in getattr(result, name).items():
+                report[name][data_type] = report[name].get(data_type, 0) + count
+        for line_no, message in result.errors:
+            add_error(line_no, message)
+        for changed_user_id in result.user_ids:
+            site_store.count_cache.invalidate(("favorites", changed_user_id))
+            site_store.count_cache.invalidate(("history", changed_user_id))
+        for album_id in result.album_ids:
+            site_store.count_cache.invalidate(("comments", album_id))
+        if result.users_changed:
+            site_store.epoch_table.invalidate()
+
+    # 个人导入只接受个人导出的文件（meta.scope 为 user），并且只导入文件里唯一那个用户的行，
+    # 否则普通用户可以把整站导出里别人的评论、收藏导进自己的账号
+    owner: dict = {"meta": False, "username": None}
+
+    def accept_personal(data_type: str, data: dict) -> bool:
+        if not owner["meta"]:
+            raise HTTPException(400, "只能导入个人数据导出文件")
+        if data_type == "users":
+            if owner["username"] is not None:
+                raise HTTPException(400, "个人数据导出文件只能包含一个用户")
+            owner["username"] = _normalize_username(data["username"])
+            return False
+        if owner["username"] is None or _normalize_username(data["username"]) != owner["username"]:
+            report["skipped"][data_type] = report["skipped"].get(data_type, 0) + 1
+            return False
+        return True
+
+    def parse(raw: bytes) -> None:
+        report["lines"] += 1
+        try:
+            item = _validate_line(raw, report["lines"], user_id)
+        except ValueError as e:
+            add_error(report["lines"], str(e))
+            return
+        if item is None:
+            return
+        _, data_type, data = item
+        if data_type == "meta":
+            if user_id is not None:
+                if data.get("scope") != "user":
+                    raise HTTPException(400, "只能导入个人数据导出文件")
+                owner["meta"] = True
+            return
+        if user_id is not None and not accept_personal(data_type, data):
+            return
+        chunk.append(item)
+
+    await db_write_async(_begin_run)
+    chunk: list[tuple[int, str, dict]] = []
+    pending = b""
+    try:
+        async for part in stream:
+            lines = (pending + part).split(b"\n")
+            pending = lines.pop()
+            if len(pending) > USER_DATA_MAX_LINE_BYTES:
+                raise HTTPException(400, f"第 {report['lines'] + 1} 行超过 {USER_DATA_MAX_LINE_BYTES} 字节")
+            for raw in lines:
+                parse(raw)
+                if len(chunk) >= USER_DATA_CHUNK_ROWS:
+                    await flush(chunk)
+                    chunk = []
+        if pending.strip():
+            parse(pending)
+        if chunk:
+            await flush(chunk)
+    finally:
+        await db_write_async(_end_run, run_id)
+    return report
+
+
+def _begin_run(conn: sqlite3.Connection) -> None:
+    # 评论 id 在两个实例之间不通用，导入期间记录 旧 id -> 新 id 以还原回复关系
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS import_comment_ids (
+            run_id TEXT NOT NULL,
+            old_id INTEGER NOT NULL,
+            new_id INTEGER NOT NULL,
+            PRIMARY KEY (run_id, old_id)
+        )
+        """
+    )
+
+
+def _end_run(conn: sqlite3.Connection, run_id: str) -> None:
+    conn.execute("DELETE FROM import_comment_ids WHERE run_id = ?", (run_id,))
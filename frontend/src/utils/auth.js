@@ -165,6 +165,15 @@ export function getUserLabel(user = state.user) {
   return user.displayName || user.username || '当前用户'
 }
 
+export function getAvatarUrl(user = state.user, size = 256) {
+  const url = user?.avatar_url || ''
+  if (!url) {
+    return ''
+  }
+
+  return `${url}${url.includes('?') ? '&' : '?'}size=${size}`
+}
+
 export function setAuthUser(user, options = {}) {
   return setUser(user, options)
 }